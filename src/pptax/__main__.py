@@ -1,6 +1,7 @@
 """Entry Point für SteuerPP (CLI + GUI)."""
 
 import argparse
+import multiprocessing
 import sys
 
 
@@ -59,4 +60,6 @@ def _run_gui(args):
 
 
 if __name__ == "__main__":
+    # Worker-Prozesse (spawn) im PyInstaller-Bundle starten, siehe pptax.spec
+    multiprocessing.freeze_support()
     main()
@@ -2,6 +2,10 @@
 
 from dataclasses import dataclass, field
 from decimal import Decimal
+from pathlib import Path
+
+# Optionale Benutzer-Steuerparameter (z.B. neuer Basiszins ohne App-Update)
+USER_PARAMETER_FILE = Path.home() / ".pptax" / "tax_parameters.json"
 
 
 @dataclass
@@ -0,0 +1,118 @@
+"""Bestandsverlauf je Wertpapier zu jedem Jahresende.
+
+Ein Durchlauf über die sortierten Kauf-/Verkaufstransaktionen eines
+Wertpapiers hält am Ende jedes Jahres den FIFO-Stand fest: Anzahl der bis
+dahin gekauften Lots, erstes noch offenes Lot mit Reststücken und die
+Gesamtstückzahl. Damit lässt sich ohne erneuten Replay in O(1) beantworten,
+wie viele Stücke ein Lot bzw. das ganze Wertpapier in einem Jahr gehalten
+hat (z.B. für die Verteilung von Ausschüttungen).
+"""
+
+from dataclasses import dataclass
+from decimal import Decimal
+
+from pptax.engine.fifo_replay import KAUF_TYPEN, VERKAUF_TYPEN
+from pptax.models.portfolio import Transaction
+
+
+@dataclass(frozen=True)
+class _Jahresstand:
+    anzahl_lots: int  # bis Jahresende gekaufte Lots
+    head: int  # erstes nicht vollständig verkauftes Lot
+    head_rest: Decimal  # verbleibende Stücke des Lots head
+    gesamt: Decimal
+
+
+_LEER = _Jahresstand(0, 0, Decimal("0"), Decimal("0"))
+
+
+class Bestandsverlauf:
+    """Stückzahlen je Kauf-Lot und Wertpapier zu jedem Jahresende.
+
+    Lots werden über ihre laufende Nummer in Kaufreihenfolge (0 = erster
+    Kauf) angesprochen. Nicht gedeckte Verkäufe werden wie in replay_fifo
+    ignoriert.
+    """
+
+    def __init__(self, transaktionen: list[Transaction]):
+        """
+        Args:
+            transaktionen: Transaktionen eines Wertpapiers, nach Datum
+                sortiert; andere Typen als Kauf/Verkauf werden ignoriert
+        """
+        self._kaufstuecke: list[Decimal] = []
+        self._staende: dict[int, _Jahresstand] = {}
+        self._erstes_jahr: int | None = None
+        self._letztes_jahr: int | None = None
+
+        head = 0
+        head_rest = Decimal("0")
+        gesamt = Decimal("0")
+        jahr: int | None = None
+        for tx in transaktionen:
+            if tx.typ not in KAUF_TYPEN and tx.typ not in VERKAUF_TYPEN:
+                continue
+            if jahr is not None and tx.datum.year != jahr:
+                self._schliesse_jahre(jahr, tx.datum.year, head, head_rest, gesamt)
+            jahr = tx.datum.year
+            if self._erstes_jahr is None:
+                self._erstes_jahr = jahr
+
+            if tx.typ in KAUF_TYPEN:
+                if head == len(self._kaufstuecke):
+                    head_rest = tx.stuecke
+                self._kaufstuecke.append(tx.stuecke)
+                gesamt += tx.stuecke
+                continue
+            if tx.stuecke <= 0 or tx.stuecke > gesamt:
+                continue
+            gesamt -= tx.stuecke
+            verbleibend = tx.stuecke
+            while verbleibend > 0 and head < len(self._kaufstuecke):
+                if verbleibend >= head_rest:
+                    verbleibend -= head_rest
+                    head += 1
+                    head_rest = (
+                        self._kaufstuecke[head]
+                        if head < len(self._kaufstuecke)
+                        else Decimal("0")
+                    )
+                else:
+                    head_rest -= verbleibend
+                    verbleibend = Decimal("0")
+
+        if jahr is not None:
+            self._schliesse_jahre(jahr, jahr + 1, head, head_rest, gesamt)
+            self._letztes_jahr = jahr
+
+    def _schliesse_jahre(
+        self, von: int, bis: int, head: int, head_rest: Decimal, gesamt: Decimal
+    ) -> None:
+        """Stand für die Jahresenden von..bis-1 festhalten."""
+        stand = _Jahresstand(len(self._kaufstuecke), head, head_rest, gesamt)
+        for j in range(von, bis):
+            self._staende[j] = stand
+
+    def _stand(self, jahr: int) -> _Jahresstand:
+        if self._erstes_jahr is None or jahr < self._erstes_jahr:
+            return _LEER
+        if jahr > self._letztes_jahr:
+            return self._staende[self._letztes_jahr]
+        return self._staende[jahr]
+
+    def anzahl_lots(self, jahr: int) -> int:
+        """Anzahl der bis Ende des Jahres gekauften Lots."""
+        return self._stand(jahr).anzahl_lots
+
+    def gesamtstuecke(self, jahr: int) -> Decimal:
+        """Gehaltene Stücke am Ende des Jahres."""
+        return self._stand(jahr).gesamt
+
+    def lot_stuecke(self, lot_nr: int, jahr: int) -> Decimal:
+        """Vom Lot lot_nr (Kaufreihenfolge) am Ende des Jahres gehaltene Stücke."""
+        stand = self._stand(jahr)
+        if lot_nr < stand.head or lot_nr >= stand.anzahl_lots:
+            return Decimal("0")
+        if lot_nr == stand.head:
+            return stand.head_rest
+        return self._kaufstuecke[lot_nr]
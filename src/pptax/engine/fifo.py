@@ -1,30 +1,80 @@
 """FIFO-Bestandsführung gem. § 20 Abs. 4 Satz 7 EStG."""
 
-import copy
+from bisect import bisect_left
 from datetime import date
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 
 from pptax.models.portfolio import FifoPosition
-from pptax.models.tax import VerkauftePosition
+from pptax.models.tax import VerkaufsSimulation, VerkauftePosition
+
+
+# Ab dieser Anzahl verbrauchter Lots wird der Lot-Puffer kompaktiert
+_KOMPAKTIEREN_AB = 64
 
 
 class FifoBestand:
-    """Verwaltet FIFO-Bestände für ein einzelnes Wertpapier."""
+    """Verwaltet FIFO-Bestände für ein einzelnes Wertpapier.
+
+    Die Lots werden spaltenweise in parallelen Listen (Kaufdatum, Stücke,
+    Einstandskurs, kumulierte Vorabpauschale) gehalten; Listenposition i
+    ist die Identität eines Lots. FifoPosition-Objekte entstehen erst in
+    bestand(). Sparpläne mit tausenden Lots werden so in kompakten
+    Schleifen über die Spalten statt Objekt für Objekt verarbeitet.
+
+    Snapshots (siehe snapshot()) teilen sich die Spalten; kopiert wird erst,
+    wenn ein Snapshot sie selbst verändern muss (Copy-on-Write).
+    """
 
     def __init__(self, security_uuid: str):
         self.security_uuid = security_uuid
-        self._lots: list[FifoPosition] = []
+        # Spalten in Kaufreihenfolge; gültig ist der Bereich [_head, _ende).
+        # Vollständig verkaufte Lots werden nicht per pop(0) entfernt, sondern
+        # durch Vorrücken von _head übersprungen und erst beim Kompaktieren
+        # gelöscht (amortisiert O(1) je Lot).
+        self._kaufdaten: list[date] = []
+        self._stuecke: list[Decimal] = []
+        self._kurse: list[Decimal] = []
+        self._vp: list[Decimal] = []
+        self._head = 0
+        self._ende = 0
+        # Teilweise verkauftes ältestes Lot als (Stücke, VP); ersetzt die
+        # Werte an Position _head, ohne die (evtl. geteilten) Spalten
+        # anzufassen.
+        self._kopf: tuple[Decimal, Decimal] | None = None
+        # True, solange die Spalten mit einem Snapshot geteilt werden
+        self._geteilt = False
+        # Laufende Summen über alle offenen Lots (O(1)-Abfragen)
+        self._stuecke_gesamt = Decimal("0")
+        self._einstand_gesamt = Decimal("0")
+        self._vp_gesamt = Decimal("0")
+
+    @classmethod
+    def aus_lots(cls, security_uuid: str, lots: list[FifoPosition]) -> "FifoBestand":
+        """Erzeuge einen Bestand direkt aus offenen Lots (älteste zuerst)."""
+        fifo = cls(security_uuid)
+        fifo._kaufdaten = [lot.kaufdatum for lot in lots]
+        fifo._stuecke = [lot.stuecke for lot in lots]
+        fifo._kurse = [lot.einstandskurs for lot in lots]
+        fifo._vp = [lot.vorabpauschalen_kumuliert for lot in lots]
+        fifo._ende = len(lots)
+        for stuecke, kurs, vp in zip(fifo._stuecke, fifo._kurse, fifo._vp):
+            fifo._stuecke_gesamt += stuecke
+            fifo._einstand_gesamt += stuecke * kurs
+            fifo._vp_gesamt += vp
+        return fifo
 
     def kauf(self, datum: date, stuecke: Decimal, kurs: Decimal) -> None:
         """Fügt ein neues Kauflot hinzu."""
-        self._lots.append(
-            FifoPosition(
-                kaufdatum=datum,
-                stuecke=stuecke,
-                einstandskurs=kurs,
-                security_uuid=self.security_uuid,
-            )
-        )
+        if self._geteilt and self._ende != len(self._stuecke):
+            # Ein anderer Snapshot hat die geteilten Spalten bereits verlängert
+            self._entkoppeln()
+        self._kaufdaten.append(datum)
+        self._stuecke.append(stuecke)
+        self._kurse.append(kurs)
+        self._vp.append(Decimal("0"))
+        self._ende += 1
+        self._stuecke_gesamt += stuecke
+        self._einstand_gesamt += stuecke * kurs
 
     def verkauf(
         self, datum: date, stuecke: Decimal, aktueller_kurs: Decimal
@@ -34,6 +84,43 @@ class FifoBestand:
         Vorabpauschalen werden bei Gewinnermittlung angerechnet
         (§ 19 Abs. 1 Satz 3 InvStG).
         """
+        ergebnis = [
+            VerkauftePosition(
+                kaufdatum=self._kaufdaten[idx],
+                verkaufsdatum=datum,
+                stuecke=verkauft,
+                einstandskurs=self._kurse[idx],
+                verkaufskurs=aktueller_kurs,
+                gewinn_brutto=verkauft * (aktueller_kurs - self._kurse[idx]),
+                vorabpauschalen_angerechnet=vp_angerechnet,
+            )
+            for idx, verkauft, vp_angerechnet in self._entnehmen(stuecke)
+        ]
+        self._kompaktieren()
+        return ergebnis
+
+    def verbrauche(self, stuecke: Decimal) -> tuple[Decimal, Decimal]:
+        """Entnimm die ersten stuecke FIFO-konform ohne Einzelpositionen.
+
+        Returns:
+            (Einstandswert, angerechnete Vorabpauschalen) der entnommenen
+            Stücke, identisch mit der Summe über verkauf()
+        """
+        einstand = Decimal("0")
+        vp = Decimal("0")
+        for idx, verkauft, vp_angerechnet in self._entnehmen(stuecke):
+            einstand += verkauft * self._kurse[idx]
+            vp += vp_angerechnet
+        self._kompaktieren()
+        return einstand, vp
+
+    def _entnehmen(self, stuecke: Decimal) -> list[tuple[int, Decimal, Decimal]]:
+        """Gemeinsamer Kern von verkauf() und verbrauche().
+
+        Liefert je berührtem Lot (Spaltenposition, entnommene Stücke,
+        anteilige VP). Verbrauchte Spaltenpositionen bleiben bis zum
+        anschließenden _kompaktieren() lesbar.
+        """
         if stuecke > self.gesamtstuecke():
             raise ValueError(
                 f"Nicht genügend Stücke: {stuecke} angefordert, "
@@ -41,71 +128,276 @@ class FifoBestand:
             )
 
         verbleibend = stuecke
-        ergebnis: list[VerkauftePosition] = []
-
-        while verbleibend > 0 and self._lots:
-            lot = self._lots[0]
-            verkauft = min(verbleibend, lot.stuecke)
-            anteil = verkauft / lot.stuecke if lot.stuecke > 0 else Decimal("1")
+        entnommen: list[tuple[int, Decimal, Decimal]] = []
+        kurse = self._kurse
 
-            gewinn_brutto = verkauft * (aktueller_kurs - lot.einstandskurs)
-            vp_angerechnet = lot.vorabpauschalen_kumuliert * anteil
-
-            ergebnis.append(
-                VerkauftePosition(
-                    kaufdatum=lot.kaufdatum,
-                    verkaufsdatum=datum,
-                    stuecke=verkauft,
-                    einstandskurs=lot.einstandskurs,
-                    verkaufskurs=aktueller_kurs,
-                    gewinn_brutto=gewinn_brutto,
-                    vorabpauschalen_angerechnet=vp_angerechnet,
-                )
-            )
+        while verbleibend > 0 and self._head < self._ende:
+            idx = self._head
+            if self._kopf is not None:
+                lot_stuecke, lot_vp = self._kopf
+            else:
+                lot_stuecke, lot_vp = self._stuecke[idx], self._vp[idx]
+            verkauft = min(verbleibend, lot_stuecke)
+            anteil = verkauft / lot_stuecke if lot_stuecke > 0 else Decimal("1")
+            entnommen.append((idx, verkauft, lot_vp * anteil))
 
-            if verkauft >= lot.stuecke:
-                self._lots.pop(0)
+            if verkauft >= lot_stuecke:
+                self._head += 1
+                self._kopf = None
+                self._vp_gesamt -= lot_vp
             else:
-                rest_anteil = (lot.stuecke - verkauft) / lot.stuecke
-                lot.vorabpauschalen_kumuliert = (
-                    lot.vorabpauschalen_kumuliert * rest_anteil
-                )
-                lot.stuecke -= verkauft
+                rest_anteil = (lot_stuecke - verkauft) / lot_stuecke
+                vp_rest = lot_vp * rest_anteil
+                self._vp_gesamt += vp_rest - lot_vp
+                self._kopf = (lot_stuecke - verkauft, vp_rest)
+            self._stuecke_gesamt -= verkauft
+            self._einstand_gesamt -= verkauft * kurse[idx]
 
             verbleibend -= verkauft
+        return entnommen
 
-        return ergebnis
+    def snapshot(self) -> "FifoBestand":
+        """Unabhängiger Snapshot des Bestands in O(1).
+
+        Snapshot und Original teilen sich die Spalten, bis einer von beiden
+        sie verändern muss. Verkäufe auf einem Snapshot kopieren keine Lots,
+        daher eignen sich Snapshots für beliebig viele Was-wäre-wenn-Verkäufe
+        auf demselben Ausgangsbestand.
+        """
+        sim = FifoBestand.__new__(FifoBestand)
+        sim.__dict__.update(self.__dict__)
+        self._geteilt = sim._geteilt = True
+        return sim
+
+    def _entkoppeln(self) -> None:
+        """Eigene Spalten anlegen und das Kopf-Lot in sie übernehmen."""
+        if self._geteilt:
+            bereich = slice(self._head, self._ende)
+            self._kaufdaten = self._kaufdaten[bereich]
+            self._stuecke = self._stuecke[bereich]
+            self._kurse = self._kurse[bereich]
+            self._vp = self._vp[bereich]
+            self._head = 0
+            self._ende = len(self._stuecke)
+            self._geteilt = False
+        if self._kopf is not None:
+            self._stuecke[self._head], self._vp[self._head] = self._kopf
+            self._kopf = None
+
+    def _kompaktieren(self) -> None:
+        """Entferne verbrauchte Lots, sobald sie die Hälfte des Puffers belegen."""
+        if self._head == self._ende:
+            # Leerer Bestand: Summen exakt zurücksetzen (keine Rundungsreste)
+            self._kaufdaten = []
+            self._stuecke = []
+            self._kurse = []
+            self._vp = []
+            self._head = 0
+            self._ende = 0
+            self._kopf = None
+            self._geteilt = False
+            self._stuecke_gesamt = Decimal("0")
+            self._einstand_gesamt = Decimal("0")
+            self._vp_gesamt = Decimal("0")
+        elif (
+            not self._geteilt
+            and self._head >= _KOMPAKTIEREN_AB
+            and self._head * 2 >= self._ende
+        ):
+            for spalte in (self._kaufdaten, self._stuecke, self._kurse, self._vp):
+                del spalte[: self._head]
+            self._ende -= self._head
+            self._head = 0
+
+    def _index(self, lot_index: int) -> int:
+        """Spaltenposition eines offenen Lots (0 = ältestes)."""
+        anzahl = self._ende - self._head
+        if lot_index < 0:
+            lot_index += anzahl
+        if not 0 <= lot_index < anzahl:
+            raise IndexError(f"Lot-Index außerhalb des Bestands: {lot_index}")
+        return self._head + lot_index
 
     def bestand(self) -> list[FifoPosition]:
         """Aktueller Bestand aller offenen Lots."""
-        return list(self._lots)
+        bereich = slice(self._head, self._ende)
+        stuecke = self._stuecke[bereich]
+        vp = self._vp[bereich]
+        if self._kopf is not None:
+            stuecke[0], vp[0] = self._kopf
+        return [
+            FifoPosition(
+                kaufdatum=kaufdatum,
+                stuecke=lot_stuecke,
+                einstandskurs=kurs,
+                security_uuid=self.security_uuid,
+                vorabpauschalen_kumuliert=lot_vp,
+            )
+            for kaufdatum, lot_stuecke, kurs, lot_vp in zip(
+                self._kaufdaten[bereich], stuecke, self._kurse[bereich], vp
+            )
+        ]
+
+    def anzahl_lots(self) -> int:
+        """Anzahl der offenen Lots."""
+        return self._ende - self._head
 
     def gesamtstuecke(self) -> Decimal:
         """Gesamtzahl aller Stücke im Bestand."""
-        return sum((lot.stuecke for lot in self._lots), Decimal("0"))
+        return self._stuecke_gesamt
+
+    def einstandswert_gesamt(self) -> Decimal:
+        """Summe der Anschaffungskosten (Stücke × Einstandskurs) aller Lots."""
+        return self._einstand_gesamt
+
+    def vorabpauschalen_gesamt(self) -> Decimal:
+        """Summe der kumulierten Vorabpauschalen aller Lots."""
+        return self._vp_gesamt
 
     def gewinn_bei_verkauf(
         self, stuecke: Decimal, aktueller_kurs: Decimal
     ) -> Decimal:
         """Simuliert Verkauf ohne Bestand zu verändern. Gibt Brutto-Gewinn zurück."""
-        # Erstelle tiefe Kopie und simuliere
-        sim = FifoBestand(self.security_uuid)
-        sim._lots = copy.deepcopy(self._lots)
-        positionen = sim.verkauf(date.today(), stuecke, aktueller_kurs)
+        positionen = self.snapshot().verkauf(date.today(), stuecke, aktueller_kurs)
         return sum(
             (p.gewinn_brutto - p.vorabpauschalen_angerechnet for p in positionen),
             Decimal("0"),
         )
 
+    def simuliere_verkaeufe(
+        self,
+        mengen: list[Decimal],
+        aktueller_kurs: Decimal,
+        teilfreistellung: Decimal = Decimal("0"),
+    ) -> list[VerkaufsSimulation]:
+        """Simuliere Verkäufe vieler Stückzahlen in einem Durchlauf.
+
+        Die Mengen müssen aufsteigend sortiert sein; die Lots werden dabei
+        nur einmal durchlaufen. Brutto-Gewinn und angerechnete VP entsprechen
+        exakt den Summen über verkauf(); der steuerpflichtige Gewinn ist
+        exakt gewinn_bei_verkauf(menge, aktueller_kurs) nach
+        Teilfreistellung. Exakt heißt hier: solange Stückzahlen ohne
+        Rundung im Decimal-Kontext darstellbar sind (reale Stückzahlen).
+        """
+        ergebnis: list[VerkaufsSimulation] = []
+        if any(b < a for a, b in zip(mengen, mengen[1:])):
+            raise ValueError("Mengen müssen aufsteigend sortiert sein")
+        if mengen and mengen[-1] > self.gesamtstuecke():
+            raise ValueError(
+                f"Nicht genügend Stücke: {mengen[-1]} angefordert, "
+                f"{self.gesamtstuecke()} verfügbar"
+            )
+
+        # Summen über die vollständig verkauften Lots vor Lot idx, in
+        # derselben Reihenfolge aufaddiert wie bei verkauf()
+        idx = self._head
+        verkauft_voll = Decimal("0")
+        brutto_voll = Decimal("0")
+        vp_voll = Decimal("0")
+        netto_voll = Decimal("0")
+        faktor = 1 - teilfreistellung
+
+        for menge in mengen:
+            while idx < self._ende:
+                lot_stuecke, lot_vp = self._lot_werte(idx)
+                rest = menge - verkauft_voll
+                if rest <= 0 or rest < lot_stuecke:
+                    break
+                gewinn = lot_stuecke * (aktueller_kurs - self._kurse[idx])
+                brutto_voll += gewinn
+                vp_voll += lot_vp
+                netto_voll += gewinn - lot_vp
+                verkauft_voll += lot_stuecke
+                idx += 1
+
+            brutto, vp_summe, netto = brutto_voll, vp_voll, netto_voll
+            rest = menge - verkauft_voll
+            if rest > 0 and idx < self._ende:
+                lot_stuecke, lot_vp = self._lot_werte(idx)
+                gewinn = rest * (aktueller_kurs - self._kurse[idx])
+                vp = lot_vp * (rest / lot_stuecke)
+                brutto += gewinn
+                vp_summe += vp
+                netto += gewinn - vp
+            ergebnis.append(
+                VerkaufsSimulation(
+                    stuecke=menge,
+                    gewinn_brutto=brutto,
+                    vorabpauschalen_angerechnet=vp_summe,
+                    gewinn_steuerpflichtig=netto * faktor,
+                )
+            )
+        return ergebnis
+
+    def _lot_werte(self, idx: int) -> tuple[Decimal, Decimal]:
+        """(Stücke, VP) an Spaltenposition idx unter Berücksichtigung des Kopf-Lots."""
+        if idx == self._head and self._kopf is not None:
+            return self._kopf
+        return self._stuecke[idx], self._vp[idx]
+
     def add_vorabpauschale_to_lot(self, lot_index: int, betrag: Decimal) -> None:
         """Vorabpauschale direkt auf ein bestimmtes Lot addieren."""
-        self._lots[lot_index].vorabpauschalen_kumuliert += betrag
+        idx = self._index(lot_index)
+        if idx == self._head:
+            # Kopf-Lot ohne Kopie der Spalten ersetzen
+            if self._kopf is not None:
+                lot_stuecke, lot_vp = self._kopf
+            else:
+                lot_stuecke, lot_vp = self._stuecke[idx], self._vp[idx]
+            self._kopf = (lot_stuecke, lot_vp + betrag)
+        else:
+            self._entkoppeln()
+            idx = self._index(lot_index)
+            self._vp[idx] += betrag
+        self._vp_gesamt += betrag
 
     def add_vorabpauschale(self, betrag: Decimal) -> None:
         """Verteile Vorabpauschale proportional auf alle Lots."""
         gesamt = self.gesamtstuecke()
         if gesamt == 0:
             return
-        for lot in self._lots:
-            anteil = lot.stuecke / gesamt
-            lot.vorabpauschalen_kumuliert += betrag * anteil
+        self._entkoppeln()
+        stuecke = self._stuecke
+        vp = self._vp
+        for idx in range(self._head, self._ende):
+            anteil = stuecke[idx] / gesamt
+            vp[idx] += betrag * anteil
+            self._vp_gesamt += betrag * anteil
+
+    def add_vorabpauschale_pro_stueck(
+        self,
+        betrag_pro_stueck: Decimal,
+        gekauft_vor: date | None = None,
+        quantisierung: Decimal | None = None,
+    ) -> Decimal:
+        """Addiere eine Vorabpauschale je Stück auf alle (früh gekauften) Lots.
+
+        Args:
+            betrag_pro_stueck: Vorabpauschale je Stück
+            gekauft_vor: Nur Lots mit Kaufdatum vor diesem Tag (None = alle);
+                die Lots liegen in Kaufreihenfolge, daher per Binärsuche
+            quantisierung: Optional je Lot runden (z.B. Decimal("0.01"),
+                kaufmännisch)
+
+        Returns:
+            Summe der addierten Beträge
+        """
+        ende = self._ende
+        if gekauft_vor is not None:
+            ende = bisect_left(self._kaufdaten, gekauft_vor, self._head, self._ende)
+        anzahl = ende - self._head
+        if anzahl <= 0:
+            return Decimal("0")
+
+        self._entkoppeln()
+        stuecke = self._stuecke
+        vp = self._vp
+        summe = Decimal("0")
+        for idx in range(self._head, self._head + anzahl):
+            betrag = stuecke[idx] * betrag_pro_stueck
+            if quantisierung is not None:
+                betrag = betrag.quantize(quantisierung, rounding=ROUND_HALF_UP)
+            vp[idx] += betrag
+            summe += betrag
+        self._vp_gesamt += summe
+        return summe
@@ -0,0 +1,326 @@
+"""FIFO-Ledger mit Jahresend-Checkpoints.
+
+Statt bei jedem Wechsel des Steuerjahres die komplette Historie neu
+abzuspielen, speichert der Ledger je Wertpapier den Lot-Bestand am Ende
+jedes Jahres (unveränderlich, herausgegeben werden Copy-on-Write-Snapshots).
+Je Jahr spielt der Replay-Kernel (replay_verkaeufe) die Transaktionen ab
+dem vorigen Checkpoint ab. Der Bestand für ein Steuerjahr
+ergibt sich aus dem nächstgelegenen früheren Checkpoint plus den
+Transaktionen der fehlenden Jahre.
+
+Die beim Abspielen historischer Verkäufe aufgelösten Lots werden im selben
+Durchlauf je Jahr, Wertpapier und Depot festgehalten und stehen für
+Auswertungen und die Verlustverrechnung ohne erneuten Replay bereit.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.fifo_replay import KAUF_TYPEN, VERKAUF_TYPEN, replay_verkaeufe
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.verlustverrechnung import VerlustverrechnungsManager
+from pptax.engine.vp_integration import VorabpauschalenSpeicher, apply_vorabpauschalen
+from pptax.models.portfolio import Security, Transaction, TransaktionsTyp
+from pptax.models.tax import VerkauftePosition
+
+
+def _tx_key(tx: Transaction) -> tuple:
+    # Depot gehört dazu: realisierte Positionen werden je Depot ausgewiesen
+    return (tx.datum, tx.typ, tx.stuecke, tx.kurs, tx.portfolio_uuid)
+
+
+class FifoLedger:
+    """Verwaltet FIFO-Bestände aller Wertpapiere mit Checkpoints je Jahresende."""
+
+    def __init__(self, transactions: list[Transaction] | None = None):
+        # security_uuid -> jahr -> Kauf-/Verkaufstransaktionen (nach Datum)
+        self._jahre: dict[str, dict[int, list[Transaction]]] = {}
+        # security_uuid -> Ausschüttungen (für die VP-Anrechnung)
+        self._dividenden: dict[str, list[Transaction]] = {}
+        # security_uuid -> jahr -> Bestand am Jahresende
+        self._checkpoints: dict[str, dict[int, FifoBestand]] = {}
+        # security_uuid -> jahr -> realisierte Positionen mit Depot-UUID
+        self._realisiert: dict[
+            str, dict[int, list[tuple[str | None, VerkauftePosition]]]
+        ] = {}
+        # Wertpapiere in Reihenfolge ihres ersten Kaufs
+        self._reihenfolge: list[str] = []
+        self._erster_kauf: dict[str, int] = {}
+        if transactions is not None:
+            self.setze_transaktionen(transactions)
+
+    def setze_transaktionen(self, transactions: list[Transaction]) -> set[str]:
+        """Übernimm einen (neuen) Transaktionsbestand.
+
+        Checkpoints werden nur für Wertpapiere verworfen, deren Kauf- oder
+        Verkaufstransaktionen sich geändert haben, und dort erst ab dem
+        ersten betroffenen Jahr.
+
+        Returns:
+            UUIDs der Wertpapiere mit geänderten Transaktionen
+        """
+        jahre: dict[str, dict[int, list[Transaction]]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        dividenden: dict[str, list[Transaction]] = defaultdict(list)
+        reihenfolge: list[str] = []
+        erster_kauf: dict[str, int] = {}
+        for tx in sorted(transactions, key=lambda t: t.datum):
+            if tx.typ == TransaktionsTyp.DIVIDENDE:
+                dividenden[tx.security_uuid].append(tx)
+                continue
+            if tx.typ in KAUF_TYPEN:
+                if tx.security_uuid not in erster_kauf:
+                    erster_kauf[tx.security_uuid] = tx.datum.year
+                    reihenfolge.append(tx.security_uuid)
+            elif tx.typ not in VERKAUF_TYPEN or tx.security_uuid not in erster_kauf:
+                continue
+            jahre[tx.security_uuid][tx.datum.year].append(tx)
+
+        geaendert: set[str] = set()
+        for uuid in set(self._jahre) | set(jahre):
+            alt = self._jahre.get(uuid, {})
+            neu = jahre.get(uuid, {})
+            ab_jahr = _erstes_geaendertes_jahr(alt, neu)
+            if ab_jahr is None:
+                continue
+            geaendert.add(uuid)
+            checkpoints = self._checkpoints.get(uuid, {})
+            for jahr in [j for j in checkpoints if j >= ab_jahr]:
+                del checkpoints[jahr]
+            realisiert = self._realisiert.get(uuid, {})
+            for jahr in [j for j in realisiert if j >= ab_jahr]:
+                del realisiert[jahr]
+
+        self._jahre = {uuid: dict(j) for uuid, j in jahre.items()}
+        self._dividenden = dict(dividenden)
+        self._reihenfolge = reihenfolge
+        self._erster_kauf = erster_kauf
+        for uuid in list(self._checkpoints):
+            if uuid not in self._jahre:
+                del self._checkpoints[uuid]
+                self._realisiert.pop(uuid, None)
+        return geaendert
+
+    def invalidiere(self, security_uuid: str | None = None) -> None:
+        """Verwirf Checkpoints (eines oder aller Wertpapiere)."""
+        if security_uuid is None:
+            self._checkpoints.clear()
+            self._realisiert.clear()
+        else:
+            self._checkpoints.pop(security_uuid, None)
+            self._realisiert.pop(security_uuid, None)
+
+    def bestand(self, security_uuid: str, jahr: int) -> FifoBestand | None:
+        """Bestand am Ende des Jahres als unabhängiger Snapshot.
+
+        None, wenn das Wertpapier bis dahin nie gekauft wurde.
+        """
+        erster = self._erster_kauf.get(security_uuid)
+        if erster is None or jahr < erster:
+            return None
+        return self._checkpoint(security_uuid, jahr).snapshot()
+
+    def positionen(self, bis_jahr: int | None = None) -> dict[str, FifoBestand]:
+        """FIFO-Bestände aller Wertpapiere am Ende von bis_jahr.
+
+        Ohne bis_jahr werden alle Transaktionen berücksichtigt. Die
+        Bestände sind Snapshots und dürfen verändert werden.
+        """
+        positionen: dict[str, FifoBestand] = {}
+        for uuid in self._reihenfolge:
+            jahr = bis_jahr if bis_jahr is not None else max(self._jahre[uuid])
+            fifo = self.bestand(uuid, jahr)
+            if fifo is not None:
+                positionen[uuid] = fifo
+        return positionen
+
+    def realisiert(
+        self,
+        jahr: int,
+        security_uuid: str | None = None,
+        depot_uuid: str | None = None,
+    ) -> list[VerkauftePosition]:
+        """Im Jahr durch Verkäufe aufgelöste Lots.
+
+        Args:
+            jahr: Verkaufsjahr
+            security_uuid: Nur dieses Wertpapier (None = alle)
+            depot_uuid: Nur Verkäufe aus diesem Depot (None = alle)
+
+        Die Positionen stammen aus dem Lot-Bestand der Checkpoints und
+        enthalten daher keine Anrechnung von Vorabpauschalen (siehe
+        realisiert_mit_vorabpauschalen).
+        """
+        uuids = self._reihenfolge if security_uuid is None else [security_uuid]
+        ergebnis: list[VerkauftePosition] = []
+        for uuid in uuids:
+            erster = self._erster_kauf.get(uuid)
+            if erster is None or jahr < erster:
+                continue
+            self._checkpoint(uuid, jahr)
+            for depot, pos in self._realisiert[uuid].get(jahr, ()):
+                if depot_uuid is None or depot == depot_uuid:
+                    ergebnis.append(pos)
+        return ergebnis
+
+    def realisiert_mit_vorabpauschalen(
+        self,
+        jahr: int,
+        security: Security,
+        kurse_map: dict[str, dict[str, Decimal]],
+        depot_uuid: str | None = None,
+        speicher: VorabpauschalenSpeicher | None = None,
+    ) -> list[VerkauftePosition]:
+        """Im Jahr aufgelöste Lots eines Fonds mit angerechneten Vorabpauschalen.
+
+        Auf den Bestand am Ende des Vorjahres werden die Vorabpauschalen bis
+        zum Vorjahr verteilt, anschließend werden die Transaktionen des
+        Jahres erneut abgespielt (§ 19 Abs. 1 Satz 3 InvStG).
+
+        Args:
+            jahr: Verkaufsjahr
+            security: Das Wertpapier
+            kurse_map: Verschachtelte Map security_uuid -> datum_iso -> kurs
+            depot_uuid: Nur Verkäufe aus diesem Depot (None = alle)
+            speicher: Optionaler Memo-Speicher der Lot-Vorabpauschalen
+        """
+        uuid = security.uuid
+        txs = self._jahre.get(uuid, {}).get(jahr)
+        if not txs:
+            return []
+        vorher = self.bestand(uuid, jahr - 1)
+        if vorher is None:
+            # Erster Kauf im Verkaufsjahr: keine Vorabpauschalen
+            return self.realisiert(jahr, uuid, depot_uuid)
+
+        strom = [tx for j in sorted(self._jahre[uuid]) for tx in self._jahre[uuid][j]]
+        apply_vorabpauschalen(
+            {uuid: vorher},
+            {uuid: security},
+            kurse_map,
+            strom + self._dividenden.get(uuid, []),
+            jahr,
+            speicher,
+        )
+        _, verkauft = replay_verkaeufe(uuid, txs, vorher)
+        return [
+            pos
+            for tx, pos in verkauft
+            if depot_uuid is None or tx.portfolio_uuid == depot_uuid
+        ]
+
+    def realisierter_gewinn(
+        self,
+        jahr: int,
+        security_uuid: str | None = None,
+        depot_uuid: str | None = None,
+    ) -> Decimal:
+        """Saldo der im Jahr realisierten Gewinne und Verluste."""
+        return sum(
+            (
+                p.gewinn_brutto - p.vorabpauschalen_angerechnet
+                for p in self.realisiert(jahr, security_uuid, depot_uuid)
+            ),
+            Decimal("0"),
+        )
+
+    def verrechne_verluste(
+        self,
+        jahr: int,
+        securities: dict[str, Security],
+        manager: VerlustverrechnungsManager,
+        kurse_map: dict[str, dict[str, Decimal]],
+        depot_uuid: str | None = None,
+        speicher: VorabpauschalenSpeicher | None = None,
+    ) -> Decimal:
+        """Übergib die realisierten Ergebnisse eines Jahres an die Verlustverrechnung.
+
+        Fonds gehen nach Anrechnung der Vorabpauschalen (Kurse aus
+        kurse_map, optional mit speicher) und Teilfreistellung in den
+        allgemeinen Topf, Einzelaktien in den Aktientopf. Je Topf wird zunächst saldiert;
+        Verluste werden vor Gewinnen eingebucht, da die Verrechnung für das
+        ganze Jahr gilt.
+
+        Returns:
+            Steuerpflichtiger Gewinn nach Verlustverrechnung (vor
+            Sparerpauschbetrag)
+        """
+        ctx = get_tax_context(jahr)
+        salden = {False: Decimal("0"), True: Decimal("0")}  # ist_aktie -> Saldo
+        for uuid in self._reihenfolge:
+            sec = securities.get(uuid)
+            if not sec:
+                continue
+            if sec.is_fond:
+                gewinn = sum(
+                    (
+                        p.gewinn_brutto - p.vorabpauschalen_angerechnet
+                        for p in self.realisiert_mit_vorabpauschalen(
+                            jahr, sec, kurse_map, depot_uuid, speicher
+                        )
+                    ),
+                    Decimal("0"),
+                )
+                gewinn *= 1 - ctx.teilfreistellung_satz(sec.fonds_typ)
+            else:
+                gewinn = self.realisierter_gewinn(jahr, uuid, depot_uuid)
+            salden[not sec.is_fond] += gewinn
+
+        for ist_aktie, saldo in salden.items():
+            if saldo < 0:
+                manager.add_verlust(saldo, ist_aktie=ist_aktie)
+        steuerpflichtig = Decimal("0")
+        for ist_aktie, saldo in salden.items():
+            if saldo > 0:
+                steuerpflichtig += manager.add_gewinn(saldo, ist_aktie=ist_aktie)
+        return steuerpflichtig
+
+    def _checkpoint(self, security_uuid: str, jahr: int) -> FifoBestand:
+        checkpoints = self._checkpoints.setdefault(security_uuid, {})
+        if jahr in checkpoints:
+            return checkpoints[jahr]
+
+        jahre = self._jahre[security_uuid]
+        letztes_tx_jahr = max(jahre)
+        # Jahre ohne Transaktionen nach dem letzten Checkpoint übernehmen
+        # den Bestand unverändert; ab dem letzten Transaktionsjahr ist der
+        # Bestand konstant.
+        ziel = min(jahr, letztes_tx_jahr)
+        if ziel in checkpoints:
+            checkpoints[jahr] = checkpoints[ziel]
+            return checkpoints[jahr]
+
+        frueher = [j for j in checkpoints if j < ziel]
+        if frueher:
+            start = max(frueher)
+            arbeit = checkpoints[start]
+        else:
+            start = self._erster_kauf[security_uuid] - 1
+            arbeit = FifoBestand(security_uuid)
+
+        realisiert = self._realisiert.setdefault(security_uuid, {})
+        for j in range(start + 1, ziel + 1):
+            if j in jahre:
+                # Replay-Kernel; der Ausgangsbestand bleibt unverändert
+                arbeit, verkauft = replay_verkaeufe(security_uuid, jahre[j], arbeit)
+                realisiert[j] = [(tx.portfolio_uuid, pos) for tx, pos in verkauft]
+            else:
+                realisiert[j] = []
+            checkpoints[j] = arbeit
+
+        checkpoints[jahr] = checkpoints[ziel]
+        return checkpoints[jahr]
+
+
+def _erstes_geaendertes_jahr(
+    alt: dict[int, list[Transaction]], neu: dict[int, list[Transaction]]
+) -> int | None:
+    """Frühestes Jahr, in dem sich die Transaktionen unterscheiden."""
+    for jahr in sorted(set(alt) | set(neu)):
+        if [_tx_key(t) for t in alt.get(jahr, ())] != [
+            _tx_key(t) for t in neu.get(jahr, ())
+        ]:
+            return jahr
+    return None
@@ -0,0 +1,132 @@
+"""Paralleler Aufbau der FIFO-Bestände je Wertpapier.
+
+Der FIFO-Bestand eines Wertpapiers hängt nur von dessen eigenen
+Transaktionen ab. Transaktionen werden daher nach Wertpapier partitioniert
+und Replay plus Vorabpauschalen-Verteilung je Wertpapier in einem
+Prozess-Pool ausgeführt. Das Ergebnis ist unabhängig von der Anzahl der
+Worker: die Bestände werden in der Reihenfolge des ersten Kaufs
+zusammengeführt, wie in FifoLedger.positionen.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from decimal import Decimal
+
+from pptax.engine import tax_params
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.fifo_replay import KAUF_TYPEN, VERKAUF_TYPEN, replay_fifo
+from pptax.engine.vp_integration import apply_vorabpauschalen
+from pptax.models.portfolio import Security, Transaction, TransaktionsTyp
+
+
+@dataclass
+class _Auftrag:
+    """Arbeitspaket für ein Wertpapier."""
+
+    security_uuid: str
+    strom: list[Transaction]  # Käufe/Verkäufe ab dem ersten Kauf, nach Datum
+    dividenden: list[Transaction]
+    security: Security | None
+    kurse: dict[str, Decimal]
+    steuerjahr: int | None
+
+
+def _bearbeite(auftrag: _Auftrag) -> FifoBestand:
+    fifo, _ = replay_fifo(auftrag.security_uuid, auftrag.strom)
+    if auftrag.steuerjahr is not None and auftrag.security is not None:
+        apply_vorabpauschalen(
+            {auftrag.security_uuid: fifo},
+            {auftrag.security_uuid: auftrag.security},
+            {auftrag.security_uuid: auftrag.kurse},
+            # Käufe/Verkäufe für den Bestand je Jahresende, wie im seriellen Pfad
+            auftrag.strom + auftrag.dividenden,
+            auftrag.steuerjahr,
+        )
+    return fifo
+
+
+def _init_worker(user_layer: dict, override_layer: dict) -> None:
+    """Parameter-Schichten des Hauptprozesses im Worker übernehmen."""
+    tax_params.set_parameter_layers(user_layer, override_layer)
+
+
+def _auftraege(
+    transactions: list[Transaction],
+    securities: dict[str, Security],
+    kurse_map: dict[str, dict[str, Decimal]],
+    steuerjahr: int | None,
+) -> list[_Auftrag]:
+    """Partitioniere die Transaktionen nach Wertpapier.
+
+    Mit steuerjahr werden nur Käufe/Verkäufe bis zum Ende des Steuerjahres
+    berücksichtigt (wie FifoLedger.positionen).
+    """
+    auftraege: dict[str, _Auftrag] = {}
+    dividenden: dict[str, list[Transaction]] = {}
+    for tx in sorted(transactions, key=lambda t: t.datum):
+        if tx.typ == TransaktionsTyp.DIVIDENDE:
+            dividenden.setdefault(tx.security_uuid, []).append(tx)
+            continue
+        if steuerjahr is not None and tx.datum.year > steuerjahr:
+            continue
+        if tx.typ in KAUF_TYPEN and tx.security_uuid not in auftraege:
+            auftraege[tx.security_uuid] = _Auftrag(
+                security_uuid=tx.security_uuid,
+                strom=[],
+                dividenden=[],
+                security=securities.get(tx.security_uuid),
+                kurse=kurse_map.get(tx.security_uuid, {}),
+                steuerjahr=steuerjahr,
+            )
+        if (tx.typ in KAUF_TYPEN or tx.typ in VERKAUF_TYPEN) and (
+            tx.security_uuid in auftraege
+        ):
+            auftraege[tx.security_uuid].strom.append(tx)
+
+    for uuid, auftrag in auftraege.items():
+        auftrag.dividenden = dividenden.get(uuid, [])
+    return list(auftraege.values())
+
+
+def baue_positionen(
+    transactions: list[Transaction],
+    securities: dict[str, Security],
+    kurse_map: dict[str, dict[str, Decimal]],
+    steuerjahr: int | None = None,
+    max_workers: int = 1,
+) -> dict[str, FifoBestand]:
+    """FIFO-Bestände aller Wertpapiere inkl. Vorabpauschalen aufbauen.
+
+    Args:
+        transactions: Alle Transaktionen
+        securities: Security-Objekte nach UUID
+        kurse_map: Verschachtelte Map security_uuid -> datum_iso -> kurs
+        steuerjahr: Bestand am Ende dieses Jahres, VP für alle Jahre davor
+            (None = alle Transaktionen, keine VP)
+        max_workers: Anzahl Worker-Prozesse; bei 1 wird seriell gerechnet
+
+    Returns:
+        FIFO-Bestände je Wertpapier in Reihenfolge des ersten Kaufs
+    """
+    auftraege = _auftraege(transactions, securities, kurse_map, steuerjahr)
+    if max_workers <= 1 or len(auftraege) <= 1:
+        ergebnisse = [_bearbeite(a) for a in auftraege]
+    else:
+        worker = min(max_workers, len(auftraege))
+        # spawn statt fork: der GUI-Prozess (Qt, Worker-Threads) wird nicht geklont
+        with ProcessPoolExecutor(
+            max_workers=worker,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=tax_params.get_parameter_layers(),
+        ) as pool:
+            # map liefert die Ergebnisse in Auftragsreihenfolge
+            ergebnisse = list(
+                pool.map(
+                    _bearbeite,
+                    auftraege,
+                    chunksize=max(1, len(auftraege) // (worker * 4)),
+                )
+            )
+    return {a.security_uuid: fifo for a, fifo in zip(auftraege, ergebnisse)}
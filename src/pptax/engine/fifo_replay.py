@@ -0,0 +1,146 @@
+"""Replay kompletter Transaktionsstroeme in FIFO-Bestände.
+
+Ein FIFO-Verkauf gegen N Lots ist ein Intervall-Überlappungsproblem: Lot i
+belegt auf der kumulierten Stückzahlachse das Intervall
+[grenzen[i-1], grenzen[i]), ein Verkauf das Intervall [S, S + stuecke) der
+kumulierten Verkaufsmenge S. Die Lots eines Verkaufs werden per
+Binärsuche auf den kumulierten Kaufgrenzen bestimmt, statt Lot für Lot
+einen FifoBestand abzuarbeiten. Die Ergebnisse entsprechen exakt
+FifoBestand.verkauf (gleiche Decimal-Ausdrücke, gleiche Reihenfolge).
+"""
+
+from bisect import bisect_left
+from dataclasses import dataclass
+from decimal import Decimal
+from itertools import accumulate
+
+from pptax.engine.fifo import FifoBestand
+from pptax.models.portfolio import FifoPosition, Transaction, TransaktionsTyp
+from pptax.models.tax import VerkauftePosition
+
+KAUF_TYPEN = (TransaktionsTyp.KAUF, TransaktionsTyp.EINLIEFERUNG)
+VERKAUF_TYPEN = (TransaktionsTyp.VERKAUF, TransaktionsTyp.AUSLIEFERUNG)
+
+
+@dataclass
+class _Verkauf:
+    tx: Transaction
+    lots_davor: int  # Anzahl Lots, die zum Verkaufszeitpunkt existieren
+
+
+def replay_fifo(
+    security_uuid: str,
+    transaktionen: list[Transaction],
+    bestand: FifoBestand | None = None,
+) -> tuple[FifoBestand, list[VerkauftePosition]]:
+    """Spiele den Kauf-/Verkaufsstrom eines Wertpapiers in einem Durchlauf ab.
+
+    Args:
+        security_uuid: Wertpapier, dessen Transaktionen abgespielt werden
+        transaktionen: Transaktionen in Ausführungsreihenfolge (nach Datum
+            sortiert); Transaktionen anderer Typen werden ignoriert
+        bestand: Optionaler Ausgangsbestand (z.B. mit kumulierten
+            Vorabpauschalen), der nicht verändert wird
+
+    Verkäufe, die den Bestand übersteigen, werden wie ein von
+    FifoBestand.verkauf abgelehnter Verkauf übersprungen.
+
+    Returns:
+        (Endbestand, realisierte Positionen in Verkaufsreihenfolge)
+    """
+    fifo, verkauft = replay_verkaeufe(security_uuid, transaktionen, bestand)
+    return fifo, [pos for _, pos in verkauft]
+
+
+def replay_verkaeufe(
+    security_uuid: str,
+    transaktionen: list[Transaction],
+    bestand: FifoBestand | None = None,
+) -> tuple[FifoBestand, list[tuple[Transaction, VerkauftePosition]]]:
+    """Wie replay_fifo, jede Position zusammen mit ihrer Verkaufstransaktion.
+
+    Returns:
+        (Endbestand, (Verkaufstransaktion, Position) in Verkaufsreihenfolge)
+    """
+    lots: list[FifoPosition] = list(bestand.bestand()) if bestand else []
+    verkaeufe: list[_Verkauf] = []
+    for tx in transaktionen:
+        if tx.typ in KAUF_TYPEN:
+            lots.append(
+                FifoPosition(
+                    kaufdatum=tx.datum,
+                    stuecke=tx.stuecke,
+                    einstandskurs=tx.kurs,
+                    security_uuid=security_uuid,
+                )
+            )
+        elif tx.typ in VERKAUF_TYPEN:
+            verkaeufe.append(_Verkauf(tx, len(lots)))
+
+    # Kumulierte Stückzahl am Ende jedes Lots
+    grenzen = list(accumulate((lot.stuecke for lot in lots), initial=Decimal("0")))[1:]
+
+    ergebnis: list[tuple[Transaction, VerkauftePosition]] = []
+    verkauft_gesamt = Decimal("0")  # S: bisher verkaufte Stücke
+    head = 0  # erstes nicht vollständig verkauftes Lot
+    # Angebrochenes Kopf-Lot: (verbleibende Stücke, verbleibende VP)
+    kopf: tuple[Decimal, Decimal] | None = None
+
+    for vk in verkaeufe:
+        tx = vk.tx
+        if tx.stuecke <= 0:
+            continue
+        verfuegbar = (
+            grenzen[vk.lots_davor - 1] - verkauft_gesamt
+            if vk.lots_davor > 0
+            else Decimal("0")
+        )
+        if tx.stuecke > verfuegbar:
+            continue
+
+        ziel = verkauft_gesamt + tx.stuecke
+        letzter = bisect_left(grenzen, ziel, head, vk.lots_davor)
+        verbleibend = tx.stuecke
+        for i in range(head, letzter + 1):
+            lot = lots[i]
+            if i == head and kopf is not None:
+                lot_stuecke, lot_vp = kopf
+            else:
+                lot_stuecke, lot_vp = lot.stuecke, lot.vorabpauschalen_kumuliert
+
+            verkauft = min(verbleibend, lot_stuecke)
+            anteil = verkauft / lot_stuecke if lot_stuecke > 0 else Decimal("1")
+            ergebnis.append((
+                tx,
+                VerkauftePosition(
+                    kaufdatum=lot.kaufdatum,
+                    verkaufsdatum=tx.datum,
+                    stuecke=verkauft,
+                    einstandskurs=lot.einstandskurs,
+                    verkaufskurs=tx.kurs,
+                    gewinn_brutto=verkauft * (tx.kurs - lot.einstandskurs),
+                    vorabpauschalen_angerechnet=lot_vp * anteil,
+                ),
+            ))
+
+            if verkauft >= lot_stuecke:
+                head = i + 1
+                kopf = None
+            else:
+                rest_anteil = (lot_stuecke - verkauft) / lot_stuecke
+                kopf = (lot_stuecke - verkauft, lot_vp * rest_anteil)
+            verbleibend -= verkauft
+        verkauft_gesamt = ziel
+
+    offen = lots[head:]
+    if kopf is not None:
+        lot_stuecke, lot_vp = kopf
+        offen[0] = FifoPosition(
+            kaufdatum=offen[0].kaufdatum,
+            stuecke=lot_stuecke,
+            einstandskurs=offen[0].einstandskurs,
+            security_uuid=offen[0].security_uuid,
+            vorabpauschalen_kumuliert=lot_vp,
+        )
+    return FifoBestand.aus_lots(security_uuid, offen), ergebnis
+
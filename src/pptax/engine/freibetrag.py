@@ -1,40 +1,47 @@
 """Sparerpauschbetrag-Optimierung."""
 
-from decimal import Decimal, ROUND_HALF_UP
+import heapq
+from bisect import bisect_right
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_CEILING, ROUND_HALF_UP
 
-from pptax.models.portfolio import Security
+from pptax.models.portfolio import FifoPosition, Security
 from pptax.models.tax import FreibetragOptimierungErgebnis, VerkaufsVorschlag
 from pptax.engine.fifo import FifoBestand
-from pptax.engine.tax_params import get_param
+from pptax.engine.tax_context import TaxContext, resolve_tax_context
 from pptax.engine.bestandsschutz import ist_bestandsgeschuetzt
 
 TWO_PLACES = Decimal("0.01")
+STUECK_PLACES = Decimal("0.00000001")
+# Einstandskurse + VP je Stück, die höchstens so weit auseinander liegen,
+# können nach Rundung der Decimal-Division in beliebiger Reihenfolge gleich
+# oder verschieden ausfallen; der Index vergleicht sie daher exakt
+KOSTEN_TOLERANZ = Decimal("1e-12")
 
 
-def optimiere_freibetrag(
-    jahr: int,
-    veranlagungstyp: str,
-    bereits_genutzt: Decimal,
+@dataclass
+class _Kandidat:
+    """Lot mit positivem steuerpflichtigem Gewinn, Kennzahlen je Stück vorberechnet."""
+
+    security: Security
+    lot: FifoPosition
+    kurs: Decimal
+    tfs: Decimal
+    gewinn_steuerlich_pro_stueck: Decimal
+    gewinn_stpfl_pro_stueck: Decimal
+
+
+def _kandidaten(
     positionen: dict[str, FifoBestand],
     aktuelle_kurse: dict[str, Decimal],
     securities: dict[str, Security],
-) -> FreibetragOptimierungErgebnis:
-    """Berechne optimale Verkäufe um den Sparerpauschbetrag auszunutzen."""
-    spb = get_param("sparerpauschbetrag", jahr)
-    freibetrag_gesamt = Decimal(str(spb[veranlagungstyp]))
-    freibetrag_verbleibend = max(Decimal("0"), freibetrag_gesamt - bereits_genutzt)
-
-    if freibetrag_verbleibend <= 0:
-        return FreibetragOptimierungErgebnis(
-            jahr=jahr,
-            freibetrag_gesamt=freibetrag_gesamt,
-            freibetrag_bereits_genutzt=bereits_genutzt,
-            freibetrag_verbleibend=Decimal("0"),
-        )
+    ctx: TaxContext,
+) -> list[_Kandidat]:
+    """Sammle alle Lots mit positivem steuerpflichtigem Gewinn pro Stück.
 
-    # Sammle Lots mit positivem steuerpflichtigem Gewinn pro Stück
-    # Tuple: (uuid, lot_index, gewinn_stpfl_pro_stueck)
-    kandidaten: list[tuple[str, int, Decimal]] = []
+    Teilfreistellung und Lot-Liste werden je Wertpapier einmal ermittelt.
+    """
+    kandidaten: list[_Kandidat] = []
     for uuid, fifo in positionen.items():
         if uuid not in aktuelle_kurse or fifo.gesamtstuecke() <= 0:
             continue
@@ -42,10 +49,10 @@ def optimiere_freibetrag(
         if sec is None:
             continue
         kurs = aktuelle_kurse[uuid]
-        tfs_data = get_param("teilfreistellung", jahr)
-        tfs = Decimal(str(tfs_data[sec.fonds_typ.value]))
+        tfs = ctx.teilfreistellung_satz(sec.fonds_typ)
+        faktor = 1 - tfs
 
-        for lot_idx, lot in enumerate(fifo.bestand()):
+        for lot in fifo.bestand():
             if ist_bestandsgeschuetzt(lot.kaufdatum, sec.is_fond):
                 continue
             gewinn_pro_stueck_brutto = kurs - lot.einstandskurs
@@ -55,67 +62,88 @@ def optimiere_freibetrag(
                 else Decimal("0")
             )
             gewinn_steuerlich = gewinn_pro_stueck_brutto - vp_pro_stueck
-            gewinn_stpfl_pro_stueck = gewinn_steuerlich * (1 - tfs)
+            gewinn_stpfl_pro_stueck = gewinn_steuerlich * faktor
 
             if gewinn_stpfl_pro_stueck > 0:
-                kandidaten.append((uuid, lot_idx, gewinn_stpfl_pro_stueck))
+                kandidaten.append(
+                    _Kandidat(sec, lot, kurs, tfs, gewinn_steuerlich, gewinn_stpfl_pro_stueck)
+                )
+    return kandidaten
 
-    # Sortiere: höchster steuerpflichtiger Gewinn pro Stück zuerst
-    kandidaten.sort(key=lambda x: x[2], reverse=True)
 
-    empfehlungen: list[VerkaufsVorschlag] = []
-    noch_frei = freibetrag_verbleibend
+def _stuecke_benoetigt(k: _Kandidat, noch_frei: Decimal) -> Decimal:
+    """Stücke, deren Verkauf noch_frei steuerpflichtigen Gewinn realisiert."""
+    return (noch_frei / k.gewinn_stpfl_pro_stueck).quantize(STUECK_PLACES, ROUND_HALF_UP)
 
-    for uuid, lot_idx, gewinn_stpfl_pro_stueck in kandidaten:
-        if noch_frei <= 0:
-            break
 
-        fifo = positionen[uuid]
-        sec = securities[uuid]
-        kurs = aktuelle_kurse[uuid]
-        tfs_data = get_param("teilfreistellung", jahr)
-        tfs = Decimal(str(tfs_data[sec.fonds_typ.value]))
-
-        lot = fifo.bestand()[lot_idx]
+def _vorschlag(k: _Kandidat, noch_frei: Decimal) -> VerkaufsVorschlag:
+    """Verkauf aus einem Lot, der höchstens noch_frei steuerpflichtigen Gewinn realisiert."""
+    return _vorschlag_stuecke(k, min(_stuecke_benoetigt(k, noch_frei), k.lot.stuecke))
 
-        # Berechne benötigte Stücke aus diesem Lot
-        stuecke_benoetigt = (noch_frei / gewinn_stpfl_pro_stueck).quantize(
-            Decimal("0.00000001"), ROUND_HALF_UP
-        )
-        stuecke = min(stuecke_benoetigt, lot.stuecke)
 
-        # Lot-weise Gewinnberechnung
-        gewinn_pro_stueck_brutto = kurs - lot.einstandskurs
-        vp_pro_stueck = (
-            lot.vorabpauschalen_kumuliert / lot.stuecke
-            if lot.stuecke > 0
-            else Decimal("0")
-        )
-        gewinn_steuerlich = gewinn_pro_stueck_brutto - vp_pro_stueck
-        gewinn_brutto = (stuecke * gewinn_steuerlich).quantize(
+def _vorschlag_stuecke(k: _Kandidat, stuecke: Decimal) -> VerkaufsVorschlag:
+    erloes = (stuecke * k.kurs).quantize(TWO_PLACES, ROUND_HALF_UP)
+    return VerkaufsVorschlag(
+        security_uuid=k.security.uuid,
+        security_name=k.security.name,
+        isin=k.security.isin,
+        stuecke=stuecke,
+        kaufdatum=k.lot.kaufdatum,
+        einstandskurs=k.lot.einstandskurs,
+        aktueller_kurs=k.kurs,
+        brutto_erloes=erloes,
+        gewinn_brutto=(stuecke * k.gewinn_steuerlich_pro_stueck).quantize(
             TWO_PLACES, ROUND_HALF_UP
-        )
-        gewinn_stpfl = (stuecke * gewinn_stpfl_pro_stueck).quantize(
+        ),
+        teilfreistellung_satz=k.tfs,
+        gewinn_steuerpflichtig=(stuecke * k.gewinn_stpfl_pro_stueck).quantize(
             TWO_PLACES, ROUND_HALF_UP
-        )
+        ),
+        steuer=Decimal("0"),  # Innerhalb Freibetrag = keine Steuer
+        netto_erloes=erloes,
+    )
+
+
+def optimiere_freibetrag(
+    jahr: int,
+    veranlagungstyp: str,
+    bereits_genutzt: Decimal,
+    positionen: dict[str, FifoBestand],
+    aktuelle_kurse: dict[str, Decimal],
+    securities: dict[str, Security],
+    ctx: TaxContext | None = None,
+) -> FreibetragOptimierungErgebnis:
+    """Berechne optimale Verkäufe um den Sparerpauschbetrag auszunutzen."""
+    ctx = resolve_tax_context(ctx, jahr, veranlagungstyp)
+    if ctx.sparerpauschbetrag is None:
+        raise ValueError(f"Kein Sparerpauschbetrag für das Jahr {jahr} verfügbar")
+    freibetrag_gesamt = ctx.sparerpauschbetrag
+    freibetrag_verbleibend = max(Decimal("0"), freibetrag_gesamt - bereits_genutzt)
 
-        vorschlag = VerkaufsVorschlag(
-            security_uuid=uuid,
-            security_name=sec.name,
-            isin=sec.isin,
-            stuecke=stuecke,
-            kaufdatum=lot.kaufdatum,
-            einstandskurs=lot.einstandskurs,
-            aktueller_kurs=kurs,
-            brutto_erloes=(stuecke * kurs).quantize(TWO_PLACES, ROUND_HALF_UP),
-            gewinn_brutto=gewinn_brutto,
-            teilfreistellung_satz=tfs,
-            gewinn_steuerpflichtig=gewinn_stpfl,
-            steuer=Decimal("0"),  # Innerhalb Freibetrag = keine Steuer
-            netto_erloes=(stuecke * kurs).quantize(TWO_PLACES, ROUND_HALF_UP),
+    if freibetrag_verbleibend <= 0:
+        return FreibetragOptimierungErgebnis(
+            jahr=jahr,
+            freibetrag_gesamt=freibetrag_gesamt,
+            freibetrag_bereits_genutzt=bereits_genutzt,
+            freibetrag_verbleibend=Decimal("0"),
         )
+
+    kandidaten = _kandidaten(positionen, aktuelle_kurse, securities, ctx)
+
+    # Höchster steuerpflichtiger Gewinn pro Stück zuerst; bei Gleichstand
+    # gilt die Sammelreihenfolge (wie eine stabile Sortierung). Der Heap
+    # wird nur so weit abgebaut, bis der Freibetrag ausgeschöpft ist.
+    heap = [(-k.gewinn_stpfl_pro_stueck, nr) for nr, k in enumerate(kandidaten)]
+    heapq.heapify(heap)
+
+    empfehlungen: list[VerkaufsVorschlag] = []
+    noch_frei = freibetrag_verbleibend
+
+    while heap and noch_frei > 0:
+        _, nr = heapq.heappop(heap)
+        vorschlag = _vorschlag(kandidaten[nr], noch_frei)
         empfehlungen.append(vorschlag)
-        noch_frei -= gewinn_stpfl
+        noch_frei -= vorschlag.gewinn_steuerpflichtig
 
     return FreibetragOptimierungErgebnis(
         jahr=jahr,
@@ -124,3 +152,256 @@ def optimiere_freibetrag(
         freibetrag_verbleibend=freibetrag_verbleibend,
         verkaufsempfehlungen=empfehlungen,
     )
+
+
+def optimiere_freibetrag_sweep(
+    jahr: int,
+    veranlagungstyp: str,
+    bereits_genutzt: list[Decimal],
+    positionen: dict[str, FifoBestand],
+    aktuelle_kurse: dict[str, Decimal],
+    securities: dict[str, Security],
+    ctx: TaxContext | None = None,
+) -> list[FreibetragOptimierungErgebnis]:
+    """Optimale Verkäufe für viele Werte des bereits genutzten Freibetrags.
+
+    Ergebnis i ist identisch mit optimiere_freibetrag(bereits_genutzt[i], ...).
+    Die Kandidaten werden einmal sortiert; vollständig verkaufte Lots und
+    ihre Präfixsummen sind für alle Werte gleich. Je Wert wird per
+    Binärsuche bestimmt, wie viele Lots vollständig verkauft werden, nur das
+    angebrochene Lot wird einzeln berechnet.
+    """
+    ctx = resolve_tax_context(ctx, jahr, veranlagungstyp)
+    if ctx.sparerpauschbetrag is None:
+        raise ValueError(f"Kein Sparerpauschbetrag für das Jahr {jahr} verfügbar")
+    freibetrag_gesamt = ctx.sparerpauschbetrag
+
+    # Stabile Sortierung = Reihenfolge des Heaps in optimiere_freibetrag
+    kandidaten = sorted(
+        _kandidaten(positionen, aktuelle_kurse, securities, ctx),
+        key=lambda k: k.gewinn_stpfl_pro_stueck,
+        reverse=True,
+    )
+    voll = [_vorschlag_stuecke(k, k.lot.stuecke) for k in kandidaten]
+
+    # praefix[j]: realisierter Gewinn der Lots vor j, wenn alle voll verkauft
+    # werden. Lot j wird voll verkauft, sobald noch_frei die Schwelle
+    # erreicht, ab der die auf 8 Stellen gerundete Stückzahl die Lotgröße
+    # erreicht; grenze[j] ist das laufende Maximum von praefix[j] + Schwelle.
+    praefix = [Decimal("0")]
+    grenze: list[Decimal] = []
+    halbe_stelle = STUECK_PLACES / 2
+    for k, v in zip(kandidaten, voll):
+        schwelle = k.gewinn_stpfl_pro_stueck * (
+            k.lot.stuecke.quantize(STUECK_PLACES, ROUND_CEILING) - halbe_stelle
+        )
+        grenze.append(max(grenze[-1], praefix[-1] + schwelle) if grenze else schwelle)
+        praefix.append(praefix[-1] + v.gewinn_steuerpflichtig)
+
+    def ist_voll(j: int, noch_frei: Decimal) -> bool:
+        return noch_frei > 0 and _stuecke_benoetigt(kandidaten[j], noch_frei) >= kandidaten[j].lot.stuecke
+
+    ergebnisse: list[FreibetragOptimierungErgebnis] = []
+    for genutzt in bereits_genutzt:
+        verbleibend = max(Decimal("0"), freibetrag_gesamt - genutzt)
+        if verbleibend <= 0:
+            ergebnisse.append(
+                FreibetragOptimierungErgebnis(
+                    jahr=jahr,
+                    freibetrag_gesamt=freibetrag_gesamt,
+                    freibetrag_bereits_genutzt=genutzt,
+                    freibetrag_verbleibend=Decimal("0"),
+                )
+            )
+            continue
+
+        anzahl_voll = bisect_right(grenze, verbleibend)
+        # Rundungsgrenzfälle der Division exakt nachprüfen
+        if (anzahl_voll > 0 and not ist_voll(anzahl_voll - 1, verbleibend - praefix[anzahl_voll - 1])) or (
+            anzahl_voll < len(kandidaten) and ist_voll(anzahl_voll, verbleibend - praefix[anzahl_voll])
+        ):
+            anzahl_voll = 0
+
+        empfehlungen = voll[:anzahl_voll]
+        noch_frei = verbleibend - praefix[anzahl_voll]
+        idx = anzahl_voll
+        while idx < len(kandidaten) and noch_frei > 0:
+            vorschlag = _vorschlag(kandidaten[idx], noch_frei)
+            empfehlungen.append(vorschlag)
+            noch_frei -= vorschlag.gewinn_steuerpflichtig
+            idx += 1
+
+        ergebnisse.append(
+            FreibetragOptimierungErgebnis(
+                jahr=jahr,
+                freibetrag_gesamt=freibetrag_gesamt,
+                freibetrag_bereits_genutzt=genutzt,
+                freibetrag_verbleibend=verbleibend,
+                verkaufsempfehlungen=empfehlungen,
+            )
+        )
+    return ergebnisse
+
+
+@dataclass
+class _LotIndex:
+    """Nicht bestandsgeschützte Lots eines Wertpapiers, aufsteigend nach
+    Einstandskurs + VP je Stück sortiert (= absteigend nach Gewinn je Stück
+    bei jedem Kurs)."""
+
+    security: Security
+    rang: int  # Position in positionen, entscheidet Gleichstände
+    tfs: Decimal
+    kosten: list[Decimal]
+    lots: list[tuple[int, FifoPosition]]  # (Nr. in bestand(), Lot)
+    kurs: Decimal | None = None
+    anzahl_im_gewinn: int = 0
+
+    def gewinn(self, pos: int) -> tuple[Decimal, Decimal]:
+        """Steuerlicher und steuerpflichtiger Gewinn je Stück des Lots an pos,
+        gerechnet wie in _kandidaten."""
+        _, lot = self.lots[pos]
+        vp_pro_stueck = (
+            lot.vorabpauschalen_kumuliert / lot.stuecke if lot.stuecke > 0 else Decimal("0")
+        )
+        gewinn_steuerlich = self.kurs - lot.einstandskurs - vp_pro_stueck
+        return gewinn_steuerlich, gewinn_steuerlich * (1 - self.tfs)
+
+
+class FreibetragIndex:
+    """Inkrementelle Freibetrag-Optimierung bei wechselnden Kursen.
+
+    Ändert sich der Kurs eines Wertpapiers, verschiebt sich der Gewinn je
+    Stück aller seiner Lots um denselben Betrag; die Reihenfolge der Lots
+    innerhalb des Wertpapiers bleibt gleich. Der Index sortiert die Lots
+    daher einmal je Wertpapier nach Einstandskurs + VP je Stück. Ein neuer
+    Kurs kostet nur eine Binärsuche (Anzahl Lots im Gewinn), und optimiere()
+    verschmilzt die Wertpapiere lazy über einen Heap, statt alle Kandidaten
+    neu zu sammeln und zu sortieren. Das Ergebnis ist identisch mit
+    optimiere_freibetrag für dieselben Bestände und Kurse.
+    """
+
+    def __init__(
+        self,
+        jahr: int,
+        veranlagungstyp: str,
+        positionen: dict[str, FifoBestand],
+        aktuelle_kurse: dict[str, Decimal],
+        securities: dict[str, Security],
+        ctx: TaxContext | None = None,
+    ):
+        ctx = resolve_tax_context(ctx, jahr, veranlagungstyp)
+        if ctx.sparerpauschbetrag is None:
+            raise ValueError(f"Kein Sparerpauschbetrag für das Jahr {jahr} verfügbar")
+        self.jahr = jahr
+        self._ctx = ctx
+        self._securities = securities
+        self._raenge: dict[str, int] = {}
+        self._index: dict[str, _LotIndex] = {}
+        for uuid, fifo in positionen.items():
+            self.setze_bestand(uuid, fifo)
+            if uuid in aktuelle_kurse:
+                self.setze_kurs(uuid, aktuelle_kurse[uuid])
+
+    def setze_bestand(self, uuid: str, fifo: FifoBestand) -> None:
+        """Lots eines Wertpapiers (neu) einlesen, z.B. nach Kauf oder Verkauf."""
+        rang = self._raenge.setdefault(uuid, len(self._raenge))
+        alt = self._index.pop(uuid, None)
+        sec = self._securities.get(uuid)
+        if sec is None or fifo.gesamtstuecke() <= 0:
+            return
+
+        eintraege = []
+        for nr, lot in enumerate(fifo.bestand()):
+            if ist_bestandsgeschuetzt(lot.kaufdatum, sec.is_fond):
+                continue
+            vp_pro_stueck = (
+                lot.vorabpauschalen_kumuliert / lot.stuecke if lot.stuecke > 0 else Decimal("0")
+            )
+            eintraege.append((lot.einstandskurs + vp_pro_stueck, nr, lot))
+        eintraege.sort(key=lambda e: (e[0], e[1]))
+
+        self._index[uuid] = _LotIndex(
+            security=sec,
+            rang=rang,
+            tfs=self._ctx.teilfreistellung_satz(sec.fonds_typ),
+            kosten=[e[0] for e in eintraege],
+            lots=[(e[1], e[2]) for e in eintraege],
+        )
+        if alt is not None and alt.kurs is not None:
+            self.setze_kurs(uuid, alt.kurs)
+
+    def setze_kurs(self, uuid: str, kurs: Decimal) -> None:
+        """Neuen Kurs eines Wertpapiers übernehmen (O(log n) in dessen Lots)."""
+        eintrag = self._index.get(uuid)
+        if eintrag is None:
+            return
+        eintrag.kurs = kurs
+        eintrag.anzahl_im_gewinn = bisect_right(eintrag.kosten, kurs + KOSTEN_TOLERANZ)
+
+    def optimiere(self, bereits_genutzt: Decimal) -> FreibetragOptimierungErgebnis:
+        """Optimale Verkäufe wie optimiere_freibetrag zu den aktuellen Kursen."""
+        freibetrag_gesamt = self._ctx.sparerpauschbetrag
+        freibetrag_verbleibend = max(Decimal("0"), freibetrag_gesamt - bereits_genutzt)
+        if freibetrag_verbleibend <= 0:
+            return FreibetragOptimierungErgebnis(
+                jahr=self.jahr,
+                freibetrag_gesamt=freibetrag_gesamt,
+                freibetrag_bereits_genutzt=bereits_genutzt,
+                freibetrag_verbleibend=Decimal("0"),
+            )
+
+        # Je Wertpapier liegt der Block mit den höchsten Gewinnen im Heap;
+        # Gleichstände nach Sammelreihenfolge wie in optimiere_freibetrag.
+        # Der nächste Block folgt, sobald ein Lot des letzten Blocks fällt.
+        heap: list = []
+        blockende: dict[int, int] = {}
+        for eintrag in self._index.values():
+            if eintrag.kurs is not None and eintrag.anzahl_im_gewinn > 0:
+                blockende[eintrag.rang] = self._push_block(heap, eintrag, 0)
+
+        empfehlungen: list[VerkaufsVorschlag] = []
+        noch_frei = freibetrag_verbleibend
+        while heap and noch_frei > 0:
+            _, _, _, pos, ende, gewinn_steuerlich, eintrag = heapq.heappop(heap)
+            k = _Kandidat(
+                eintrag.security,
+                eintrag.lots[pos][1],
+                eintrag.kurs,
+                eintrag.tfs,
+                gewinn_steuerlich,
+                gewinn_steuerlich * (1 - eintrag.tfs),
+            )
+            vorschlag = _vorschlag(k, noch_frei)
+            empfehlungen.append(vorschlag)
+            noch_frei -= vorschlag.gewinn_steuerpflichtig
+            if ende == blockende[eintrag.rang] and ende < eintrag.anzahl_im_gewinn:
+                blockende[eintrag.rang] = self._push_block(heap, eintrag, ende)
+
+        return FreibetragOptimierungErgebnis(
+            jahr=self.jahr,
+            freibetrag_gesamt=freibetrag_gesamt,
+            freibetrag_bereits_genutzt=bereits_genutzt,
+            freibetrag_verbleibend=freibetrag_verbleibend,
+            verkaufsempfehlungen=empfehlungen,
+        )
+
+    @staticmethod
+    def _push_block(heap: list, eintrag: _LotIndex, start: int) -> int:
+        """Lots ab start mit praktisch gleichen Kosten in den Heap legen.
+
+        Returns:
+            Position hinter dem Block
+        """
+        ende = start + 1
+        grenze = eintrag.kosten[start] + KOSTEN_TOLERANZ
+        while ende < eintrag.anzahl_im_gewinn and eintrag.kosten[ende] <= grenze:
+            ende += 1
+        for pos in range(start, ende):
+            gewinn_steuerlich, gewinn_stpfl = eintrag.gewinn(pos)
+            if gewinn_stpfl > 0:
+                nr = eintrag.lots[pos][0]
+                heapq.heappush(
+                    heap, (-gewinn_stpfl, eintrag.rang, nr, pos, ende, gewinn_steuerlich, eintrag)
+                )
+        return ende
@@ -0,0 +1,347 @@
+"""Mehrjährige Planung zum Ausnutzen des Sparerpauschbetrags.
+
+Jedes Jahr kann der verbleibende Sparerpauschbetrag durch Verkauf und
+sofortigen Rückkauf steuerfrei genutzt werden; der Einstandskurs steigt,
+die latente Steuer bei einem späteren Verkauf sinkt. Über mehrere Jahre
+hängen die Entscheidungen zusammen: verkauft wird FIFO-konform, der
+Rückkauf landet am Ende der Lot-Reihe, Vorabpauschalen werden angerechnet
+und Transaktionskosten machen kleine Verkäufe unattraktiv.
+
+Gesucht wird mit einer Strahlsuche: je Jahr werden aus jedem Zustand
+(simulierte FIFO-Bestände je Wertpapier) einige Aktionen abgeleitet
+(nichts tun, ein Wertpapier allein, gierig über mehrere Wertpapiere), die
+besten Zustände bleiben erhalten. Kurse entwickeln sich mit einer festen
+jährlichen Rendite; Verkauf und Rückkauf finden zu Jahresbeginn statt.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_UP, Decimal
+
+from pptax.engine.bestandsschutz import ist_bestandsgeschuetzt
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.tax_context import TaxContext, get_tax_context
+from pptax.engine.vorabpauschale import vorabpauschale_pro_stueck
+from pptax.models.portfolio import FifoPosition, Security
+from pptax.models.tax import (
+    FreibetragJahresplan,
+    FreibetragMehrjahresPlan,
+    VerkaufsVorschlag,
+)
+
+TWO_PLACES = Decimal("0.01")
+STUECK_PLACES = Decimal("0.00000001")
+KURS_PLACES = Decimal("0.0001")
+
+
+@dataclass
+class _Zustand:
+    """Simulierter Stand eines Suchpfads."""
+
+    bestaende: dict[str, FifoBestand]
+    plan: list[FreibetragJahresplan] = field(default_factory=list)
+    # Steuerwert der steuerfrei realisierten Gewinne abzgl. Kosten
+    wert: Decimal = Decimal("0")
+    kosten: Decimal = Decimal("0")
+
+
+def _ernte_menge(
+    lots: list[FifoPosition],
+    kurs: Decimal,
+    faktor: Decimal,
+    is_fond: bool,
+    ziel: Decimal | None = None,
+) -> tuple[Decimal, Decimal]:
+    """Stückzahl, deren FIFO-Verkauf ziel an stpfl. Gewinn realisiert.
+
+    Ohne ziel (oder wenn es nicht erreichbar ist) die Stückzahl mit dem
+    größten realisierbaren Gewinn. Bestandsgeschützte Lots beenden die
+    Suche, da ein Verkauf mit Rückkauf den Bestandsschutz aufgeben würde.
+
+    Returns:
+        (Stücke, geschätzter steuerpflichtiger Gewinn)
+    """
+    kumuliert = Decimal("0")
+    stuecke = Decimal("0")
+    beste = (Decimal("0"), Decimal("0"))
+    for lot in lots:
+        if ist_bestandsgeschuetzt(lot.kaufdatum, is_fond):
+            break
+        if lot.stuecke <= 0:
+            continue
+        g = (kurs - lot.einstandskurs - lot.vorabpauschalen_kumuliert / lot.stuecke) * faktor
+        lot_gewinn = g * lot.stuecke
+        if ziel is not None and g > 0 and kumuliert + lot_gewinn >= ziel:
+            # Abrunden: der Freibetrag wird nicht überschritten
+            teil = ((ziel - kumuliert) / g).quantize(STUECK_PLACES, ROUND_DOWN)
+            return stuecke + min(teil, lot.stuecke), ziel
+        kumuliert += lot_gewinn
+        stuecke += lot.stuecke
+        if kumuliert > beste[1]:
+            beste = (stuecke, kumuliert)
+    return beste
+
+
+def _latente_steuer(
+    bestaende: dict[str, FifoBestand],
+    kurse: dict[str, Decimal],
+    securities: dict[str, Security],
+    ctx: TaxContext,
+) -> Decimal:
+    """Steuer bei Verkauf aller Bestände (vor Sparerpauschbetrag).
+
+    Fonds nach Teilfreistellung in den allgemeinen Topf, Aktienverluste nur
+    mit Aktiengewinnen; bestandsgeschützte Lots bleiben steuerfrei.
+    """
+    allgemein = Decimal("0")
+    aktien = Decimal("0")
+    for uuid, fifo in bestaende.items():
+        sec = securities[uuid]
+        kurs = kurse[uuid]
+        gewinn = Decimal("0")
+        for lot in fifo.bestand():
+            if ist_bestandsgeschuetzt(lot.kaufdatum, sec.is_fond):
+                continue
+            gewinn += lot.stuecke * (kurs - lot.einstandskurs) - lot.vorabpauschalen_kumuliert
+        if sec.is_fond:
+            allgemein += gewinn * (1 - ctx.teilfreistellung_satz(sec.fonds_typ))
+        else:
+            aktien += gewinn
+    steuerpflichtig = max(Decimal("0"), allgemein + max(Decimal("0"), aktien))
+    return (steuerpflichtig * ctx.steuersatz).quantize(TWO_PLACES, ROUND_HALF_UP)
+
+
+def plane_freibetrag_mehrjahre(
+    positionen: dict[str, FifoBestand],
+    aktuelle_kurse: dict[str, Decimal],
+    securities: dict[str, Security],
+    start_jahr: int,
+    anzahl_jahre: int = 10,
+    veranlagungstyp: str = "single",
+    bereits_genutzt: dict[int, Decimal] | None = None,
+    rendite: Decimal = Decimal("0.05"),
+    kosten_pro_verkauf: Decimal = Decimal("0"),
+    strahlbreite: int = 8,
+    kirchensteuer: bool = False,
+    bundesland: str = "default",
+) -> FreibetragMehrjahresPlan:
+    """Plane Verkauf/Rückkauf zum Ausnutzen des Sparerpauschbetrags über mehrere Jahre.
+
+    Args:
+        positionen: FIFO-Bestände pro Security (werden nicht verändert)
+        aktuelle_kurse: Kurs pro Security zu Beginn des Startjahres
+        securities: Security-Objekte nach UUID
+        start_jahr: Erstes Planungsjahr
+        anzahl_jahre: Anzahl Planungsjahre
+        bereits_genutzt: Anderweitig genutzter Sparerpauschbetrag je Jahr
+        rendite: Angenommene jährliche Kursentwicklung aller Wertpapiere
+        kosten_pro_verkauf: Kosten je Wertpapier und Jahr für Verkauf
+            und Rückkauf
+        strahlbreite: Anzahl Zustände, die je Jahr weiterverfolgt werden
+
+    Returns:
+        Plan je Jahr und Minderung der latenten Steuer am Ende des
+        letzten Jahres (abzgl. Kosten)
+    """
+    if anzahl_jahre < 1 or strahlbreite < 1:
+        raise ValueError("Anzahl Jahre und Strahlbreite müssen mindestens 1 sein")
+    if bereits_genutzt is None:
+        bereits_genutzt = {}
+
+    uuids = [
+        uuid
+        for uuid, fifo in positionen.items()
+        if uuid in securities and uuid in aktuelle_kurse and fifo.gesamtstuecke() > 0
+    ]
+    jahre = list(range(start_jahr, start_jahr + anzahl_jahre))
+    kontexte = [
+        get_tax_context(jahr, veranlagungstyp, kirchensteuer, bundesland) for jahr in jahre
+    ]
+    # Kurs je Jahresbeginn; Index anzahl_jahre = Ende des letzten Jahres
+    kurse: list[dict[str, Decimal]] = [
+        {
+            uuid: (aktuelle_kurse[uuid] * (1 + rendite) ** i).quantize(
+                KURS_PLACES, ROUND_HALF_UP
+            )
+            for uuid in uuids
+        }
+        for i in range(anzahl_jahre + 1)
+    ]
+
+    start = {uuid: positionen[uuid].snapshot() for uuid in uuids}
+    strahl = [_Zustand(bestaende=start)]
+    ohne_plan = _Zustand(bestaende=dict(start))
+
+    for i, (jahr, ctx) in enumerate(zip(jahre, kontexte)):
+        if ctx.sparerpauschbetrag is None:
+            raise ValueError(f"Kein Sparerpauschbetrag für das Jahr {jahr} verfügbar")
+        frei = max(
+            Decimal("0"), ctx.sparerpauschbetrag - bereits_genutzt.get(jahr, Decimal("0"))
+        )
+        faktoren = {
+            uuid: (
+                1 - ctx.teilfreistellung_satz(securities[uuid].fonds_typ)
+                if securities[uuid].is_fond
+                else Decimal("1")
+            )
+            for uuid in uuids
+        }
+
+        kinder: list[_Zustand] = []
+        for zustand in strahl:
+            for aktion in _aktionen(zustand, kurse[i], faktoren, securities, frei):
+                kinder.append(
+                    _fuehre_aus(
+                        zustand, aktion, jahr, frei, kurse[i], faktoren, securities,
+                        ctx, kosten_pro_verkauf,
+                    )
+                )
+        # Stabile Sortierung: bei Gleichstand gewinnt die frühere (einfachere) Aktion
+        kinder.sort(key=lambda z: z.wert, reverse=True)
+        strahl = kinder[:strahlbreite]
+
+        # Vorabpauschale des Jahres auf alle (auch zurückgekaufte) Lots
+        if ctx.basiszins is not None and ctx.vorabpauschale_faktor is not None:
+            for uuid in uuids:
+                if not securities[uuid].is_fond:
+                    continue
+                vp_ps = vorabpauschale_pro_stueck(
+                    jahr, kurse[i][uuid], kurse[i + 1][uuid], ctx=ctx
+                )
+                if vp_ps <= 0:
+                    continue
+                for zustand in strahl + [ohne_plan]:
+                    fifo = zustand.bestaende[uuid].snapshot()
+                    fifo.add_vorabpauschale_pro_stueck(vp_ps, quantisierung=TWO_PLACES)
+                    zustand.bestaende[uuid] = fifo
+
+    ende, ctx_ende = kurse[-1], kontexte[-1]
+    latent_ohne = _latente_steuer(ohne_plan.bestaende, ende, securities, ctx_ende)
+    bester = max(
+        strahl,
+        key=lambda z: latent_ohne
+        - _latente_steuer(z.bestaende, ende, securities, ctx_ende)
+        - z.kosten,
+    )
+    latent_mit = _latente_steuer(bester.bestaende, ende, securities, ctx_ende)
+    return FreibetragMehrjahresPlan(
+        start_jahr=start_jahr,
+        jahre=bester.plan,
+        latente_steuer_ohne_plan=latent_ohne,
+        latente_steuer_mit_plan=latent_mit,
+        kosten_gesamt=bester.kosten,
+        steuerersparnis=latent_ohne - latent_mit - bester.kosten,
+    )
+
+
+def _aktionen(
+    zustand: _Zustand,
+    kurse: dict[str, Decimal],
+    faktoren: dict[str, Decimal],
+    securities: dict[str, Security],
+    frei: Decimal,
+) -> list[dict[str, Decimal]]:
+    """Mögliche Aktionen eines Jahres: Wertpapier -> zu realisierender Gewinn."""
+    aktionen: list[dict[str, Decimal]] = [{}]
+    if frei <= 0:
+        return aktionen
+
+    kapazitaet = {}
+    for uuid, fifo in zustand.bestaende.items():
+        _, gewinn = _ernte_menge(
+            fifo.bestand(), kurse[uuid], faktoren[uuid], securities[uuid].is_fond
+        )
+        if gewinn > 0:
+            kapazitaet[uuid] = gewinn
+    if not kapazitaet:
+        return aktionen
+
+    # Gierig: größte Kapazität zuerst, bis der Freibetrag ausgeschöpft ist
+    gierig: dict[str, Decimal] = {}
+    rest = frei
+    for uuid in sorted(kapazitaet, key=kapazitaet.get, reverse=True):
+        if rest <= 0:
+            break
+        gierig[uuid] = min(rest, kapazitaet[uuid])
+        rest -= gierig[uuid]
+    aktionen.append(gierig)
+
+    # Einzelne Wertpapiere (nur eine Transaktion, ggf. Freibetrag nicht voll)
+    for uuid, gewinn in kapazitaet.items():
+        einzeln = {uuid: min(frei, gewinn)}
+        if einzeln != gierig:
+            aktionen.append(einzeln)
+    return aktionen
+
+
+def _fuehre_aus(
+    zustand: _Zustand,
+    aktion: dict[str, Decimal],
+    jahr: int,
+    frei: Decimal,
+    kurse: dict[str, Decimal],
+    faktoren: dict[str, Decimal],
+    securities: dict[str, Security],
+    ctx: TaxContext,
+    kosten_pro_verkauf: Decimal,
+) -> _Zustand:
+    """Verkauf und Rückkauf zu Jahresbeginn auf Kopien der Bestände."""
+    datum = date(jahr, 1, 2)  # Erster Handelstag
+    bestaende = dict(zustand.bestaende)
+    verkaeufe: list[VerkaufsVorschlag] = []
+    genutzt = Decimal("0")
+
+    for uuid, ziel in aktion.items():
+        sec = securities[uuid]
+        kurs = kurse[uuid]
+        fifo = bestaende[uuid].snapshot()
+        stuecke, _ = _ernte_menge(fifo.bestand(), kurs, faktoren[uuid], sec.is_fond, ziel)
+        if stuecke <= 0:
+            continue
+        stuecke = min(stuecke, fifo.gesamtstuecke())
+        for pos in fifo.verkauf(datum, stuecke, kurs):
+            gewinn_steuerlich = pos.gewinn_brutto - pos.vorabpauschalen_angerechnet
+            # Abrunden: die Summe über die Lots überschreitet den Freibetrag nicht
+            gewinn_stpfl = (gewinn_steuerlich * faktoren[uuid]).quantize(
+                TWO_PLACES, ROUND_FLOOR
+            )
+            erloes = (pos.stuecke * kurs).quantize(TWO_PLACES, ROUND_HALF_UP)
+            verkaeufe.append(
+                VerkaufsVorschlag(
+                    security_uuid=uuid,
+                    security_name=sec.name,
+                    isin=sec.isin,
+                    stuecke=pos.stuecke,
+                    kaufdatum=pos.kaufdatum,
+                    einstandskurs=pos.einstandskurs,
+                    aktueller_kurs=kurs,
+                    brutto_erloes=erloes,
+                    gewinn_brutto=gewinn_steuerlich.quantize(TWO_PLACES, ROUND_HALF_UP),
+                    teilfreistellung_satz=1 - faktoren[uuid] if sec.is_fond else Decimal("0"),
+                    gewinn_steuerpflichtig=gewinn_stpfl,
+                    steuer=Decimal("0"),  # Innerhalb Freibetrag = keine Steuer
+                    netto_erloes=erloes,
+                )
+            )
+            genutzt += gewinn_stpfl
+        fifo.kauf(datum, stuecke, kurs)
+        bestaende[uuid] = fifo
+
+    kosten = kosten_pro_verkauf * len({v.security_uuid for v in verkaeufe})
+    # Nur der steuerfreie Teil zählt als Ersparnis
+    wert = min(genutzt, frei) * ctx.steuersatz
+    return _Zustand(
+        bestaende=bestaende,
+        plan=zustand.plan
+        + [
+            FreibetragJahresplan(
+                jahr=jahr,
+                freibetrag_verfuegbar=frei,
+                freibetrag_genutzt=genutzt,
+                kosten=kosten,
+                verkaeufe=verkaeufe,
+            )
+        ],
+        wert=zustand.wert + wert - kosten,
+        kosten=zustand.kosten + kosten,
+    )
@@ -0,0 +1,132 @@
+"""Aufgelöster Steuerkontext für ein Steuerjahr und eine Veranlagung."""
+
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
+
+from pptax.models.portfolio import FondsTyp
+from pptax.engine.tax_params import (
+    get_decimal_param,
+    get_gesamtsteuersatz,
+    parameter_sperre,
+    parameter_version,
+)
+
+
+@dataclass(frozen=True, eq=False)
+class TaxContext:
+    """Alle für ein (Jahr, Veranlagung, Kirchensteuer, Bundesland) gültigen
+    Steuerparameter, einmalig aus tax_parameters.json aufgelöst.
+
+    Parameter, die für das Jahr nicht existieren (z.B. Basiszins vor 2018),
+    sind None bzw. fehlen in der Teilfreistellungstabelle.
+    """
+
+    jahr: int
+    veranlagungstyp: str
+    kirchensteuer: bool
+    bundesland: str
+    steuersatz: Decimal
+    sparerpauschbetrag: Decimal | None
+    basiszins: Decimal | None
+    vorabpauschale_faktor: Decimal | None
+    teilfreistellung: Mapping[FondsTyp, Decimal]
+
+    def teilfreistellung_satz(self, fonds_typ: FondsTyp) -> Decimal:
+        """Teilfreistellungssatz für einen Fondstyp."""
+        try:
+            return self.teilfreistellung[fonds_typ]
+        except KeyError:
+            raise ValueError(
+                f"Keine Teilfreistellung für {fonds_typ.value} im Jahr {self.jahr}"
+            ) from None
+
+
+def _optional_param(param_name: str, jahr: int):
+    try:
+        return get_decimal_param(param_name, jahr)
+    except ValueError:
+        return None
+
+
+def get_tax_context(
+    jahr: int,
+    veranlagungstyp: str = "single",
+    kirchensteuer: bool = False,
+    bundesland: str = "default",
+) -> TaxContext:
+    """Liefere den (memoisierten) Steuerkontext für die gegebene Kombination.
+
+    Der Cache ist an die Parameterversion gebunden: nach einer Änderung der
+    Benutzer- oder Override-Schicht wird der Kontext neu aufgelöst.
+    Thread-sicher: Version und Werte stammen aus demselben Parameterstand.
+    """
+    with parameter_sperre:
+        return _resolve_context(
+            jahr, veranlagungstyp, kirchensteuer, bundesland, parameter_version()
+        )
+
+
+def resolve_tax_context(
+    ctx: TaxContext | None,
+    jahr: int,
+    veranlagungstyp: str = "single",
+    kirchensteuer: bool | None = None,
+    bundesland: str | None = None,
+) -> TaxContext:
+    """Übergebenen Steuerkontext prüfen bzw. für die Argumente auflösen.
+
+    Weicht ein übergebener Kontext in Jahr, Veranlagung, Kirchensteuer oder
+    Bundesland von den Argumenten ab, wird ValueError ausgelöst.
+    Kirchensteuer bzw. Bundesland None werden nicht geprüft (ohne Kontext:
+    keine Kirchensteuer, Bundesland "default").
+    """
+    if ctx is None:
+        return get_tax_context(
+            jahr,
+            veranlagungstyp,
+            bool(kirchensteuer),
+            bundesland if bundesland is not None else "default",
+        )
+    erwartet = {
+        "jahr": jahr,
+        "veranlagungstyp": veranlagungstyp,
+        "kirchensteuer": kirchensteuer,
+        "bundesland": bundesland,
+    }
+    abweichungen = [
+        f"{name} {getattr(ctx, name)!r} statt {wert!r}"
+        for name, wert in erwartet.items()
+        if wert is not None and getattr(ctx, name) != wert
+    ]
+    if abweichungen:
+        raise ValueError("Steuerkontext passt nicht: " + ", ".join(abweichungen))
+    return ctx
+
+
+@lru_cache(maxsize=512)
+def _resolve_context(
+    jahr: int,
+    veranlagungstyp: str,
+    kirchensteuer: bool,
+    bundesland: str,
+    version: int,
+) -> TaxContext:
+    spb = _optional_param("sparerpauschbetrag", jahr)
+    tfs_data = _optional_param("teilfreistellung", jahr) or {}
+    teilfreistellung = {
+        typ: tfs_data[typ.value] for typ in FondsTyp if typ.value in tfs_data
+    }
+    return TaxContext(
+        jahr=jahr,
+        veranlagungstyp=veranlagungstyp,
+        kirchensteuer=kirchensteuer,
+        bundesland=bundesland,
+        steuersatz=get_gesamtsteuersatz(jahr, kirchensteuer, bundesland),
+        sparerpauschbetrag=spb[veranlagungstyp] if spb is not None else None,
+        basiszins=_optional_param("basiszins_vorabpauschale", jahr),
+        vorabpauschale_faktor=_optional_param("vorabpauschale_faktor", jahr),
+        teilfreistellung=MappingProxyType(teilfreistellung),
+    )
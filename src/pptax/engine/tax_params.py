@@ -2,7 +2,10 @@
 
 import json
 import sys
-from decimal import Decimal
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
 from functools import lru_cache
 from pathlib import Path
 
@@ -13,45 +16,282 @@ else:
     _DATA_FILE = Path(__file__).parent.parent / "data" / "tax_parameters.json"
 
 
+@dataclass(frozen=True)
+class _ParameterTabelle:
+    """Dichte Jahrestabelle eines Parameters.
+
+    Position i enthält den gültigen Wert für das Jahr erstes_jahr + i,
+    Lücken zwischen zwei Einträgen sind mit dem Vorgängerwert aufgefüllt.
+    Jahre nach dem letzten Eintrag verwenden den letzten Wert.
+    """
+
+    name: str
+    erstes_jahr: int
+    werte: tuple
+    dezimalwerte: tuple
+
+    def index(self, year: int) -> int:
+        if not self.werte:
+            raise ValueError(f"Keine Jahresdaten für Parameter: {self.name}")
+        if year < self.erstes_jahr:
+            raise ValueError(
+                f"Kein gültiger Eintrag für {self.name} im Jahr {year} "
+                f"(frühester Eintrag: {self.erstes_jahr})"
+            )
+        return min(year - self.erstes_jahr, len(self.werte) - 1)
+
+
 @lru_cache(maxsize=1)
 def _load_parameters() -> dict:
-    """Lade tax_parameters.json (einmal, mit Caching)."""
+    """Lade die gebündelte tax_parameters.json (einmal, mit Caching)."""
     with open(_DATA_FILE, encoding="utf-8") as f:
         return json.load(f)
 
 
-def get_param(param_name: str, year: int):
-    """Hole den gültigen Steuerparameter für ein gegebenes Jahr.
+def _to_decimal(value):
+    """Konvertiere einen JSON-Wert (Zahl oder Dict von Zahlen) zu Decimal."""
+    if isinstance(value, dict):
+        return {k: _to_decimal(v) for k, v in value.items()}
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    return value
 
-    Sucht den letzten Eintrag mit Jahreszahl <= year.
-    Wirft ValueError wenn kein gültiger Eintrag existiert.
-    """
-    data = _load_parameters()
-    if param_name not in data:
-        raise ValueError(f"Unbekannter Parameter: {param_name}")
 
-    param_data = data[param_name]
+def _compile_parameter(name: str, param_data: dict) -> _ParameterTabelle:
     # Filtere nur numerische Keys (Jahre), ignoriere _comment etc.
     year_keys = sorted(int(k) for k in param_data if k.isdigit())
-
     if not year_keys:
-        raise ValueError(f"Keine Jahresdaten für Parameter: {param_name}")
+        return _ParameterTabelle(name, 0, (), ())
+
+    werte = []
+    dezimalwerte = []
+    aktuell = None
+    for jahr in range(year_keys[0], year_keys[-1] + 1):
+        if str(jahr) in param_data:
+            aktuell = param_data[str(jahr)]
+        werte.append(aktuell)
+        dezimalwerte.append(_to_decimal(aktuell))
+    return _ParameterTabelle(name, year_keys[0], tuple(werte), tuple(dezimalwerte))
+
+
+# Parameter-Schichten in aufsteigender Priorität: gebündelte JSON-Datei,
+# Benutzerdatei, In-Memory-Overrides (Was-wäre-wenn-Analysen).
+# Überschrieben wird auf Ebene einzelner Jahres-Keys.
+_user_layer: dict[str, dict] = {}
+_override_layer: dict[str, dict] = {}
+
+# Versionszähler je Parameter; wird erhöht, sobald sich der zusammengeführte
+# Inhalt des Parameters durch eine Schichtänderung tatsächlich ändert.
+_versionen: dict[str, int] = {}
+_version_gesamt = 0
+
+_tabellen: dict[str, _ParameterTabelle] = {}
+
+# Schützt Schichtwechsel und das Füllen der Caches: Parameter werden im
+# Worker-Thread geladen, aber auch im GUI-Thread gelesen. Wer Version und
+# Werte zusammen liest (z.B. get_tax_context), hält die Sperre über beides.
+parameter_sperre = threading.RLock()
 
-    # Finde den letzten Key <= year
-    valid_key = None
-    for k in year_keys:
-        if k <= year:
-            valid_key = k
+
+def _merged(param_name: str) -> dict | None:
+    layers = [
+        layer[param_name]
+        for layer in (_load_parameters(), _user_layer, _override_layer)
+        if param_name in layer
+    ]
+    if not layers:
+        return None
+    merged: dict = {}
+    for layer in layers:
+        merged.update(layer)
+    return merged
+
+
+def _aendere_schichten(aenderung) -> None:
+    """Führe eine Schichtänderung aus und erhöhe betroffene Versionen."""
+    global _version_gesamt
+    with parameter_sperre:
+        namen = set(_user_layer) | set(_override_layer)
+        vorher = {name: _merged(name) for name in namen}
+        aenderung()
+        namen |= set(_user_layer) | set(_override_layer)
+        geaendert = [
+            name for name in namen if vorher.get(name) != _merged(name)
+        ]
+        for name in geaendert:
+            _versionen[name] = _versionen.get(name, 0) + 1
+            _tabellen.pop(name, None)
+        if geaendert:
+            _version_gesamt += 1
+
+
+def parameter_version(*param_names: str) -> int:
+    """Versionszähler der Parameter (ohne Argument: über alle Parameter).
+
+    Der Wert steigt monoton und ändert sich nur, wenn sich mindestens einer
+    der genannten Parameter geändert hat. Geeignet als Cache-Schlüssel.
+    """
+    with parameter_sperre:
+        if not param_names:
+            return _version_gesamt
+        return sum(_versionen.get(name, 0) for name in param_names)
+
+
+def _pruefe_wert(wert, ort: str):
+    """Konvertiere einen Wert der Benutzerdatei (Zahl oder Dict von Zahlen)
+    nach Decimal; ValueError bei ungültigen Einträgen."""
+    if isinstance(wert, dict):
+        return {k: _pruefe_wert(v, f"{ort} ({k})") for k, v in wert.items()}
+    if not isinstance(wert, bool) and isinstance(wert, (int, float, str)):
+        try:
+            zahl = Decimal(str(wert))
+        except InvalidOperation:
+            pass
         else:
-            break
+            if zahl.is_finite():
+                return zahl
+    raise ValueError(f"Ungültiger Wert {wert!r} für {ort}")
+
+
+def load_user_parameters(path: str | Path) -> None:
+    """Lade eine Benutzer-Parameterdatei im Format von tax_parameters.json.
+
+    Ersetzt eine zuvor geladene Benutzerdatei. Einträge überschreiben die
+    gebündelten Werte jahresweise. Werte werden beim Laden nach Decimal
+    konvertiert; bei nicht numerischen Werten oder ungültigen Jahren wird
+    ValueError ausgelöst und die bisherige Benutzerschicht bleibt erhalten.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"Ungültige Parameterdatei: {path}")
+    neu = {}
+    for name, param_data in data.items():
+        if name.startswith("_"):
+            continue
+        if not isinstance(param_data, dict):
+            raise ValueError(f"Ungültiger Eintrag für Parameter {name} in {path}")
+        werte = {}
+        for jahr, wert in param_data.items():
+            if jahr.startswith("_"):
+                continue
+            if not jahr.isdigit():
+                raise ValueError(
+                    f"Ungültiges Jahr {jahr!r} für Parameter {name} in {path}"
+                )
+            werte[jahr] = _pruefe_wert(wert, f"{name} {jahr} in {path}")
+        neu[name] = werte
+
+    def aenderung():
+        _user_layer.clear()
+        _user_layer.update(neu)
+
+    _aendere_schichten(aenderung)
+
+
+def clear_user_parameters() -> None:
+    """Entferne die Benutzer-Parameterschicht."""
+    _aendere_schichten(_user_layer.clear)
 
-    if valid_key is None:
-        raise ValueError(
-            f"Kein gültiger Eintrag für {param_name} im Jahr {year} "
-            f"(frühester Eintrag: {year_keys[0]})"
+
+def set_parameter_override(param_name: str, year: int, value) -> None:
+    """Setze einen In-Memory-Override für einen Parameter ab einem Jahr."""
+
+    def aenderung():
+        _override_layer.setdefault(param_name, {})[str(year)] = value
+
+    _aendere_schichten(aenderung)
+
+
+def clear_parameter_overrides(param_name: str | None = None) -> None:
+    """Entferne alle Overrides (oder nur die eines Parameters)."""
+    if param_name is None:
+        _aendere_schichten(_override_layer.clear)
+    else:
+        _aendere_schichten(lambda: _override_layer.pop(param_name, None))
+
+
+def get_parameter_layers() -> tuple[dict[str, dict], dict[str, dict]]:
+    """Kopie der Benutzer- und Override-Schicht (z.B. für Worker-Prozesse)."""
+    with parameter_sperre:
+        return (
+            {name: dict(werte) for name, werte in _user_layer.items()},
+            {name: dict(werte) for name, werte in _override_layer.items()},
         )
 
-    return param_data[str(valid_key)]
+
+def set_parameter_layers(
+    user_layer: dict[str, dict], override_layer: dict[str, dict]
+) -> None:
+    """Ersetze Benutzer- und Override-Schicht (Gegenstück zu get_parameter_layers)."""
+
+    def aenderung():
+        _user_layer.clear()
+        _user_layer.update({name: dict(werte) for name, werte in user_layer.items()})
+        _override_layer.clear()
+        _override_layer.update(
+            {name: dict(werte) for name, werte in override_layer.items()}
+        )
+
+    _aendere_schichten(aenderung)
+
+
+@contextmanager
+def parameter_override(param_name: str, year: int, value):
+    """Temporärer Override für Was-wäre-wenn-Berechnungen."""
+    with parameter_sperre:
+        vorher = _override_layer.get(param_name, {}).copy()
+        set_parameter_override(param_name, year, value)
+    try:
+        yield
+    finally:
+
+        def aenderung():
+            if vorher:
+                _override_layer[param_name] = vorher
+            else:
+                _override_layer.pop(param_name, None)
+
+        _aendere_schichten(aenderung)
+
+
+def _tabelle(param_name: str) -> _ParameterTabelle:
+    with parameter_sperre:
+        tabelle = _tabellen.get(param_name)
+        if tabelle is None:
+            param_data = _merged(param_name)
+            if param_data is None:
+                raise ValueError(f"Unbekannter Parameter: {param_name}")
+            tabelle = _compile_parameter(param_name, param_data)
+            _tabellen[param_name] = tabelle
+        return tabelle
+
+
+def get_param(param_name: str, year: int):
+    """Hole den gültigen Steuerparameter für ein gegebenes Jahr.
+
+    Liefert den Rohwert des letzten Eintrags mit Jahreszahl <= year aus den
+    zusammengeführten Parameter-Schichten.
+    Wirft ValueError wenn kein gültiger Eintrag existiert.
+    """
+    tabelle = _tabelle(param_name)
+    return tabelle.werte[tabelle.index(year)]
+
+
+def get_decimal_param(param_name: str, year: int):
+    """Wie get_param, aber mit bereits nach Decimal konvertierten Werten.
+
+    Zahlen werden als Decimal, Dicts als dict[str, Decimal] geliefert.
+    """
+    tabelle = _tabelle(param_name)
+    return tabelle.dezimalwerte[tabelle.index(year)]
+
+
+_STEUERSATZ_PARAMETER = (
+    "abgeltungssteuer_satz",
+    "solidaritaetszuschlag_satz",
+    "kirchensteuer_saetze",
+)
 
 
 def get_gesamtsteuersatz(
@@ -62,14 +302,24 @@ def get_gesamtsteuersatz(
     Ohne Kirchensteuer: KESt + Soli = 0.25 + 0.25 * 0.055 = 0.26375
     Mit Kirchensteuer: Sonderberechnung gem. § 32d Abs. 1 Satz 3 EStG.
     """
-    e = Decimal(str(get_param("abgeltungssteuer_satz", year)))
-    s = Decimal(str(get_param("solidaritaetszuschlag_satz", year)))
+    with parameter_sperre:
+        return _gesamtsteuersatz(
+            year, kirchensteuer, bundesland, parameter_version(*_STEUERSATZ_PARAMETER)
+        )
+
+
+@lru_cache(maxsize=256)
+def _gesamtsteuersatz(
+    year: int, kirchensteuer: bool, bundesland: str, version: int
+) -> Decimal:
+    e = get_decimal_param("abgeltungssteuer_satz", year)
+    s = get_decimal_param("solidaritaetszuschlag_satz", year)
 
     if not kirchensteuer:
         return e + e * s
 
-    k_data = get_param("kirchensteuer_saetze", year)
-    k = Decimal(str(k_data.get(bundesland, k_data["default"])))
+    k_data = get_decimal_param("kirchensteuer_saetze", year)
+    k = k_data.get(bundesland, k_data["default"])
 
     # KESt_effektiv = e / (1 + k * e) gem. § 32d Abs. 1 Satz 3 EStG
     kest_eff = e / (1 + k * e)
@@ -1,12 +1,11 @@
 """Netto-Verkaufsplanung."""
 
-import copy
 from decimal import Decimal, ROUND_HALF_UP, ROUND_UP
 
 from pptax.models.portfolio import Security
 from pptax.models.tax import NettoBetragPlan, VerkaufsVorschlag
 from pptax.engine.fifo import FifoBestand
-from pptax.engine.tax_params import get_param, get_gesamtsteuersatz
+from pptax.engine.tax_context import TaxContext, resolve_tax_context
 from pptax.engine.bestandsschutz import ist_bestandsgeschuetzt
 
 TWO_PLACES = Decimal("0.01")
@@ -22,11 +21,14 @@ def plane_netto_verkauf(
     securities: dict[str, Security],
     kirchensteuer: bool = False,
     bundesland: str = "default",
+    ctx: TaxContext | None = None,
 ) -> NettoBetragPlan:
     """Berechne Verkaufsplan um einen Netto-Zielbetrag zu erhalten."""
-    steuersatz = get_gesamtsteuersatz(jahr, kirchensteuer, bundesland)
-    spb = get_param("sparerpauschbetrag", jahr)
-    freibetrag_gesamt = Decimal(str(spb[veranlagungstyp]))
+    ctx = resolve_tax_context(ctx, jahr, veranlagungstyp, kirchensteuer, bundesland)
+    if ctx.sparerpauschbetrag is None:
+        raise ValueError(f"Kein Sparerpauschbetrag für das Jahr {jahr} verfügbar")
+    steuersatz = ctx.steuersatz
+    freibetrag_gesamt = ctx.sparerpauschbetrag
     freibetrag_verbleibend = max(Decimal("0"), freibetrag_gesamt - freibetrag_genutzt)
 
     verkaufsplan: list[VerkaufsVorschlag] = []
@@ -49,13 +51,9 @@ def plane_netto_verkauf(
             continue
 
         kurs = aktuelle_kurse[uuid]
-        tfs_data = get_param("teilfreistellung", jahr)
-        tfs = Decimal(str(tfs_data[sec.fonds_typ.value]))
+        tfs = ctx.teilfreistellung_satz(sec.fonds_typ)
 
         # Simuliere lotweise
-        sim_fifo = FifoBestand(sec.uuid)
-        sim_fifo._lots = copy.deepcopy(fifo._lots)
-
         for lot in fifo.bestand():
             if noch_benoetigtes_netto <= 0:
                 break
@@ -3,9 +3,10 @@
 from datetime import date
 from decimal import Decimal, ROUND_HALF_UP
 
-from pptax.models.portfolio import Security, FondsTyp
+from pptax.models.portfolio import Security, FondsTyp, Transaction, TransaktionsTyp
 from pptax.models.tax import VorabpauschaleErgebnis
-from pptax.engine.tax_params import get_param, get_gesamtsteuersatz
+from pptax.engine.kurs_utils import find_nearest_kurs
+from pptax.engine.tax_context import TaxContext, get_tax_context
 
 TWO_PLACES = Decimal("0.01")
 
@@ -17,15 +18,17 @@ def berechne_vorabpauschale(
     wert_ende: Decimal,
     ausschuettungen: Decimal = Decimal("0"),
     kaufdatum: date | None = None,
+    ctx: TaxContext | None = None,
 ) -> VorabpauschaleErgebnis:
     """Berechne die Vorabpauschale für ein Wertpapier und ein Steuerjahr.
 
-    Implementiert alle 8 Regeln aus der Spezifikation.
+    Implementiert alle 8 Regeln aus der Spezifikation. Ohne ctx wird der
+    Steuerkontext des Jahres ohne Kirchensteuer verwendet.
     """
-    basiszins = Decimal(str(get_param("basiszins_vorabpauschale", jahr)))
-    faktor = Decimal(str(get_param("vorabpauschale_faktor", jahr)))
-    tfs_data = get_param("teilfreistellung", jahr)
-    tfs = Decimal(str(tfs_data[security.fonds_typ.value]))
+    ctx = _resolve_context(jahr, ctx)
+    basiszins = ctx.basiszins
+    faktor = ctx.vorabpauschale_faktor
+    tfs = ctx.teilfreistellung_satz(security.fonds_typ)
 
     # Regel: Negativer Basiszins -> Vorabpauschale = 0
     if basiszins < 0:
@@ -60,8 +63,7 @@ def berechne_vorabpauschale(
     vp_steuerpflichtig = (vp_brutto * (1 - tfs)).quantize(TWO_PLACES, ROUND_HALF_UP)
 
     # 8. Steuer = Steuerpflichtig × Gesamtsteuersatz
-    steuersatz = get_gesamtsteuersatz(jahr)
-    steuer = (vp_steuerpflichtig * steuersatz).quantize(TWO_PLACES, ROUND_HALF_UP)
+    steuer = (vp_steuerpflichtig * ctx.steuersatz).quantize(TWO_PLACES, ROUND_HALF_UP)
 
     return VorabpauschaleErgebnis(
         security_uuid=security.uuid,
@@ -79,6 +81,138 @@ def berechne_vorabpauschale(
     )
 
 
+def berechne_vorabpauschalen(
+    securities: list[Security],
+    jahre: list[int],
+    werte_anfang: list[Decimal],
+    werte_ende: list[Decimal],
+    ausschuettungen: list[Decimal] | None = None,
+    kaufdaten: list[date | None] | None = None,
+    kontexte: dict[int, TaxContext] | None = None,
+) -> list[VorabpauschaleErgebnis]:
+    """Berechne die Vorabpauschale für viele (Wertpapier, Jahr)-Zeilen.
+
+    Die Eingaben sind gleich lange Spalten; Zeile i entspricht
+    berechne_vorabpauschale(securities[i], jahre[i], ...). Die Regelkette
+    wird Spalte für Spalte angewendet, Steuerkontext und
+    Teilfreistellungssatz werden je Jahr bzw. (Jahr, Fondstyp) nur einmal
+    ermittelt. Ergebnisse und Rundung sind identisch mit der
+    Einzelberechnung.
+
+    Args:
+        kontexte: Optionale Steuerkontexte je Jahr; fehlende Jahre werden
+            wie in berechne_vorabpauschale ohne Kirchensteuer aufgelöst
+    """
+    n = len(securities)
+    if ausschuettungen is None:
+        ausschuettungen = [Decimal("0")] * n
+    if kaufdaten is None:
+        kaufdaten = [None] * n
+    spalten = (jahre, werte_anfang, werte_ende, ausschuettungen, kaufdaten)
+    if any(len(spalte) != n for spalte in spalten):
+        raise ValueError("Eingabespalten haben unterschiedliche Längen")
+
+    # Steuerkontext je Jahr und Teilfreistellung je (Jahr, Fondstyp) einmalig
+    kontexte = dict(kontexte or {})
+    for jahr in set(jahre):
+        kontexte[jahr] = _resolve_context(jahr, kontexte.get(jahr))
+    ctxs = [kontexte[jahr] for jahr in jahre]
+    tfs_cache: dict[tuple[int, FondsTyp], Decimal] = {}
+    for ctx, sec in zip(ctxs, securities):
+        key = (ctx.jahr, sec.fonds_typ)
+        if key not in tfs_cache:
+            tfs_cache[key] = ctx.teilfreistellung_satz(sec.fonds_typ)
+    tfs = [tfs_cache[(ctx.jahr, sec.fonds_typ)] for ctx, sec in zip(ctxs, securities)]
+
+    # Regel: Negativer Basiszins -> 0; 2. Wertsteigerung; 3. <= 0 -> 0
+    wertsteigerung = [e - a for a, e in zip(werte_anfang, werte_ende)]
+    aktiv = [
+        ctx.basiszins >= 0 and ws > 0 for ctx, ws in zip(ctxs, wertsteigerung)
+    ]
+
+    # 1. Basisertrag = Wert_1.Januar × Basiszins × 0,7
+    basisertrag = [
+        (a * ctx.basiszins * ctx.vorabpauschale_faktor).quantize(TWO_PLACES, ROUND_HALF_UP)
+        if ok
+        else Decimal("0")
+        for a, ctx, ok in zip(werte_anfang, ctxs, aktiv)
+    ]
+
+    # 4.-6. min(Basisertrag, Wertsteigerung) abzgl. Ausschüttungen, nicht negativ
+    vp_brutto = [
+        max(Decimal("0"), min(b, ws) - aus) if ok else Decimal("0")
+        for b, ws, aus, ok in zip(basisertrag, wertsteigerung, ausschuettungen, aktiv)
+    ]
+
+    # Unterjähriger Kauf: Vorabpauschale × (12 - volle_Monate_vor_Kauf) / 12
+    vp_brutto = [
+        (vp * (Decimal(12 - (kd.month - 1)) / Decimal(12))).quantize(TWO_PLACES, ROUND_HALF_UP)
+        if ok and kd is not None and kd.year == jahr
+        else vp
+        for vp, kd, jahr, ok in zip(vp_brutto, kaufdaten, jahre, aktiv)
+    ]
+
+    # 7. Steuerpflichtig = Vorabpauschale_brutto × (1 - Teilfreistellungssatz)
+    vp_stpfl = [
+        (vp * (1 - t)).quantize(TWO_PLACES, ROUND_HALF_UP) if ok else Decimal("0")
+        for vp, t, ok in zip(vp_brutto, tfs, aktiv)
+    ]
+
+    # 8. Steuer = Steuerpflichtig × Gesamtsteuersatz
+    steuer = [
+        (st * ctx.steuersatz).quantize(TWO_PLACES, ROUND_HALF_UP) if ok else Decimal("0")
+        for st, ctx, ok in zip(vp_stpfl, ctxs, aktiv)
+    ]
+
+    return [
+        VorabpauschaleErgebnis(
+            security_uuid=securities[i].uuid,
+            jahr=jahre[i],
+            wert_jahresanfang=werte_anfang[i],
+            wert_jahresende=werte_ende[i],
+            basiszins=ctxs[i].basiszins,
+            basisertrag=basisertrag[i],
+            wertsteigerung=wertsteigerung[i],
+            ausschuettungen=ausschuettungen[i],
+            vorabpauschale_brutto=vp_brutto[i],
+            teilfreistellung_satz=tfs[i],
+            vorabpauschale_steuerpflichtig=vp_stpfl[i],
+            steuer=steuer[i],
+        )
+        for i in range(n)
+    ]
+
+
+def vorabpauschale_pro_stueck(
+    jahr: int,
+    kurs_anfang: Decimal,
+    kurs_ende: Decimal,
+    ausschuettung_pro_stueck: Decimal = Decimal("0"),
+    kaufmonat: int | None = None,
+    ctx: TaxContext | None = None,
+) -> Decimal:
+    """Ungerundete Vorabpauschale (brutto) je Stück.
+
+    Bis auf die Rundung ist die Vorabpauschale linear in der Stückzahl.
+    Sie wird daher einmal je Wertpapier, Jahr und Kaufmonat berechnet und
+    erst nach Multiplikation mit den Stücken eines Lots gerundet.
+
+    Args:
+        kaufmonat: Monat eines unterjährigen Kaufs im Jahr (None = ganzes Jahr)
+    """
+    ctx = _resolve_context(jahr, ctx)
+    if ctx.basiszins < 0:
+        return Decimal("0")
+    wertsteigerung = kurs_ende - kurs_anfang
+    if wertsteigerung <= 0:
+        return Decimal("0")
+    basisertrag = kurs_anfang * ctx.basiszins * ctx.vorabpauschale_faktor
+    vp = max(Decimal("0"), min(basisertrag, wertsteigerung) - ausschuettung_pro_stueck)
+    if kaufmonat is not None:
+        vp = vp * Decimal(12 - (kaufmonat - 1)) / Decimal(12)
+    return vp
+
+
 def berechne_jahresuebersicht(
     securities: list[Security],
     jahr: int,
@@ -86,28 +220,122 @@ def berechne_jahresuebersicht(
     werte_ende: dict[str, Decimal],
     ausschuettungen: dict[str, Decimal] | None = None,
     kaufdaten: dict[str, date] | None = None,
+    ctx: TaxContext | None = None,
 ) -> list[VorabpauschaleErgebnis]:
     """Berechne die Vorabpauschale für alle Wertpapiere eines Jahres."""
     if ausschuettungen is None:
         ausschuettungen = {}
     if kaufdaten is None:
         kaufdaten = {}
+    ctx = _resolve_context(jahr, ctx)
+
+    zeilen = [
+        sec for sec in securities if sec.uuid in werte_anfang and sec.uuid in werte_ende
+    ]
+    return berechne_vorabpauschalen(
+        securities=zeilen,
+        jahre=[jahr] * len(zeilen),
+        werte_anfang=[werte_anfang[sec.uuid] for sec in zeilen],
+        werte_ende=[werte_ende[sec.uuid] for sec in zeilen],
+        ausschuettungen=[ausschuettungen.get(sec.uuid, Decimal("0")) for sec in zeilen],
+        kaufdaten=[kaufdaten.get(sec.uuid) for sec in zeilen],
+        kontexte={jahr: ctx},
+    )
 
-    ergebnisse = []
-    for sec in securities:
-        if sec.uuid not in werte_anfang or sec.uuid not in werte_ende:
+
+def ausschuettungen_je_jahr(
+    transactions: list[Transaction],
+) -> dict[str, dict[int, Decimal]]:
+    """Summiere die Ausschüttungen in einem Durchlauf: security_uuid -> jahr -> Betrag."""
+    result: dict[str, dict[int, Decimal]] = {}
+    for tx in transactions:
+        if tx.typ != TransaktionsTyp.DIVIDENDE:
             continue
-        ergebnisse.append(
-            berechne_vorabpauschale(
-                security=sec,
-                jahr=jahr,
-                wert_anfang=werte_anfang[sec.uuid],
-                wert_ende=werte_ende[sec.uuid],
-                ausschuettungen=ausschuettungen.get(sec.uuid, Decimal("0")),
-                kaufdatum=kaufdaten.get(sec.uuid),
-            )
-        )
-    return ergebnisse
+        je_jahr = result.setdefault(tx.security_uuid, {})
+        je_jahr[tx.datum.year] = je_jahr.get(tx.datum.year, Decimal("0")) + tx.gesamtbetrag
+    return result
+
+
+def berechne_mehrjahresuebersicht(
+    securities: list[Security],
+    jahre: list[int],
+    kurse_map: dict[str, dict[str, Decimal]],
+    ausschuettungen: dict[str, dict[int, Decimal]] | None = None,
+    kontexte: dict[int, TaxContext] | None = None,
+) -> list[VorabpauschaleErgebnis]:
+    """Berechne die Vorabpauschale aller Wertpapiere für mehrere Jahre.
+
+    Je (Jahr, Wertpapier) mit Kurs zum 1.1. und 31.12. entsteht eine Zeile;
+    die Ausschüttungen kommen aus dem vorab gebildeten Aggregat
+    (siehe ausschuettungen_je_jahr), Transaktionen werden nicht erneut
+    durchsucht.
+
+    Zeilen, für die kein Steuerkontext oder keine Teilfreistellung des
+    Fondstyps verfügbar ist, werden übersprungen; die übrigen Zeilen werden
+    trotzdem berechnet.
+
+    Args:
+        kurse_map: Verschachtelte Map security_uuid -> datum_iso -> kurs
+        ausschuettungen: security_uuid -> jahr -> Ausschüttungen
+        kontexte: Optionale Steuerkontexte je Jahr
+    """
+    if ausschuettungen is None:
+        ausschuettungen = {}
+    kontexte = dict(kontexte or {})
+    gueltig: dict[tuple[int, FondsTyp], bool] = {}
+
+    def ist_gueltig(jahr: int, fonds_typ: FondsTyp) -> bool:
+        key = (jahr, fonds_typ)
+        if key not in gueltig:
+            try:
+                ctx = _resolve_context(jahr, kontexte.get(jahr))
+                ctx.teilfreistellung_satz(fonds_typ)
+            except ValueError:
+                gueltig[key] = False
+            else:
+                kontexte[jahr] = ctx
+                gueltig[key] = True
+        return gueltig[key]
+
+    zeilen_sec: list[Security] = []
+    zeilen_jahr: list[int] = []
+    werte_anfang: list[Decimal] = []
+    werte_ende: list[Decimal] = []
+    zeilen_aus: list[Decimal] = []
+    for jahr in jahre:
+        for sec in securities:
+            sec_kurse = kurse_map.get(sec.uuid, {})
+            wert_anfang = find_nearest_kurs(sec_kurse, date(jahr, 1, 1))
+            wert_ende = find_nearest_kurs(sec_kurse, date(jahr, 12, 31))
+            if wert_anfang is None or wert_ende is None:
+                continue
+            if not ist_gueltig(jahr, sec.fonds_typ):
+                continue
+            zeilen_sec.append(sec)
+            zeilen_jahr.append(jahr)
+            werte_anfang.append(wert_anfang)
+            werte_ende.append(wert_ende)
+            zeilen_aus.append(ausschuettungen.get(sec.uuid, {}).get(jahr, Decimal("0")))
+
+    return berechne_vorabpauschalen(
+        securities=zeilen_sec,
+        jahre=zeilen_jahr,
+        werte_anfang=werte_anfang,
+        werte_ende=werte_ende,
+        ausschuettungen=zeilen_aus,
+        kontexte=kontexte,
+    )
+
+
+def _resolve_context(jahr: int, ctx: TaxContext | None) -> TaxContext:
+    """Steuerkontext prüfen bzw. für das Jahr auflösen."""
+    if ctx is None:
+        ctx = get_tax_context(jahr)
+    elif ctx.jahr != jahr:
+        raise ValueError(f"Steuerkontext für {ctx.jahr} passt nicht zum Jahr {jahr}")
+    if ctx.basiszins is None or ctx.vorabpauschale_faktor is None:
+        raise ValueError(f"Kein Basiszins für das Jahr {jahr} verfügbar")
+    return ctx
 
 
 def _zero_result(
@@ -5,41 +5,152 @@ Jahre vor dem Verkaufsjahr (§ 19 Abs. 1 Satz 3 InvStG).
 """
 
 from collections import defaultdict
-from decimal import Decimal
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
 
+from pptax.engine.bestandsverlauf import Bestandsverlauf
 from pptax.engine.fifo import FifoBestand
+from pptax.engine.fifo_replay import KAUF_TYPEN, VERKAUF_TYPEN
 from pptax.engine.kurs_utils import find_nearest_kurs
-from pptax.engine.tax_params import get_param
-from pptax.engine.vorabpauschale import berechne_vorabpauschale
-from pptax.models.portfolio import Security, Transaction, TransaktionsTyp
+from pptax.engine.tax_context import TaxContext, get_tax_context
+from pptax.engine.tax_params import parameter_version
+from pptax.engine.vorabpauschale import TWO_PLACES, vorabpauschale_pro_stueck
+from pptax.models.portfolio import FifoPosition, Security, Transaction, TransaktionsTyp
 
 from datetime import date
 
 
+class VorabpauschalenSpeicher:
+    """Memo der Lot-Vorabpauschalen je (Wertpapier, Jahr, Lot).
+
+    Beim Wechsel des Steuerjahres werden nur noch nicht gespeicherte Jahre
+    berechnet. Ein Lot wird über Kaufdatum, Einstandskurs und aktuelle
+    Stückzahl identifiziert. Die Einträge eines Jahres werden verworfen,
+    sobald sich eine ihrer Eingangsgrößen ändert: Kurs zum 1.1. bzw. 31.12.,
+    Ausschüttungen, Bestand am Jahresende oder Basiszins/Faktor. Ein
+    geänderter Fondstyp verwirft alle Einträge des Wertpapiers.
+    """
+
+    def __init__(self):
+        self._eintraege: dict[str, dict[int, dict[tuple, Decimal]]] = {}
+        self._fingerprints: dict[str, tuple] = {}
+        self._jahres_fingerprints: dict[str, dict[int, tuple]] = {}
+
+    def _fuer(self, sec_uuid: str, fingerprint: tuple) -> None:
+        """Wertpapier vormerken; bei geändertem Fingerprint alle Jahre leeren."""
+        if self._fingerprints.get(sec_uuid) != fingerprint:
+            self._fingerprints[sec_uuid] = fingerprint
+            self._eintraege[sec_uuid] = {}
+            self._jahres_fingerprints[sec_uuid] = {}
+
+    def _fuer_jahr(self, sec_uuid: str, jahr: int, fingerprint: tuple) -> dict[tuple, Decimal]:
+        """Einträge eines Jahres (Lot-Key -> VP); bei geändertem Fingerprint geleert."""
+        jahres_fps = self._jahres_fingerprints[sec_uuid]
+        if jahres_fps.get(jahr) != fingerprint:
+            jahres_fps[jahr] = fingerprint
+            self._eintraege[sec_uuid][jahr] = {}
+        return self._eintraege[sec_uuid][jahr]
+
+    def leeren(self) -> None:
+        """Alle Einträge verwerfen."""
+        self._eintraege.clear()
+        self._fingerprints.clear()
+        self._jahres_fingerprints.clear()
+
+    def anzahl_eintraege(self) -> int:
+        """Anzahl gespeicherter (Lot, Jahr)-Werte."""
+        return sum(len(j) for e in self._eintraege.values() for j in e.values())
+
+
+@dataclass
+class _JahresVP:
+    """Eingangsgrößen der VP eines Wertpapiers in einem Jahr."""
+
+    jahr: int
+    kurs_anfang: Decimal
+    kurs_ende: Decimal
+    div_pro_stueck: Decimal
+    ctx: TaxContext
+    # Kaufmonat (None = ganzes Jahr) -> ungerundete VP je Stück
+    je_monat: dict[int | None, Decimal] = field(default_factory=dict)
+
+    def vp_lot(self, lot: FifoPosition) -> Decimal:
+        """Gerundete VP des Lots: Stücke × VP je Stück (Kaufmonat im Jahr)."""
+        monat = lot.kaufdatum.month if lot.kaufdatum.year == self.jahr else None
+        if monat not in self.je_monat:
+            self.je_monat[monat] = vorabpauschale_pro_stueck(
+                self.jahr,
+                self.kurs_anfang,
+                self.kurs_ende,
+                self.div_pro_stueck,
+                monat,
+                self.ctx,
+            )
+        return (lot.stuecke * self.je_monat[monat]).quantize(TWO_PLACES, ROUND_HALF_UP)
+
+
+def _jahres_vp(
+    jahr: int,
+    kurs_jan1: Decimal | None,
+    kurs_dec31: Decimal | None,
+    div_jahr: Decimal,
+    gehalten: Decimal,
+) -> _JahresVP | None:
+    """Eingangsgrößen eines Jahres; None, wenn keine VP anfällt/berechenbar ist."""
+    # Basiszins prüfen
+    ctx = get_tax_context(jahr)
+    if ctx.basiszins is None or ctx.vorabpauschale_faktor is None or ctx.basiszins < 0:
+        return None
+    if kurs_jan1 is None or kurs_dec31 is None:
+        return None
+
+    div_pro_stueck = div_jahr / gehalten if gehalten > 0 else Decimal("0")
+    return _JahresVP(jahr, kurs_jan1, kurs_dec31, div_pro_stueck, ctx)
+
+
+def _lot_key(lot: FifoPosition) -> tuple:
+    return (lot.kaufdatum, lot.einstandskurs, lot.stuecke)
+
+
 def apply_vorabpauschalen(
     positionen: dict[str, FifoBestand],
     securities: dict[str, Security],
     kurse_map: dict[str, dict[str, Decimal]],
     transactions: list[Transaction],
     steuerjahr: int,
+    speicher: VorabpauschalenSpeicher | None = None,
 ) -> None:
     """Berechne und verteile Vorabpauschalen auf alle FIFO-Lots.
 
     Für jedes Lot wird die VP für jedes abgeschlossene Jahr von
-    lot.kaufdatum.year bis steuerjahr-1 berechnet und auf das Lot addiert.
+    lot.kaufdatum.year bis steuerjahr-1 auf das Lot addiert. Berechnet wird
+    die VP je Stück einmal pro Jahr (bzw. pro Kaufmonat bei unterjährigen
+    Käufen) und je Lot mit der Stückzahl multipliziert und gerundet.
 
     Args:
         positionen: FIFO-Bestände pro Security
         securities: Security-Objekte nach UUID
         kurse_map: Verschachtelte Map security_uuid -> datum_iso -> kurs
-        transactions: Alle Transaktionen (für Dividenden)
+        transactions: Alle Transaktionen (Dividenden und Bestandsverlauf)
         steuerjahr: Das Verkaufs-/Steuerjahr (VP nur bis steuerjahr-1)
+        speicher: Optionaler Memo-Speicher, der über Aufrufe hinweg bereits
+            berechnete (Lot, Jahr)-Werte wiederverwendet
     """
-    # Dividenden pro Security und Jahr sammeln
+    if speicher is None:
+        speicher = VorabpauschalenSpeicher()
+
+    # Dividenden pro Security und Jahr sowie Kauf-/Verkaufsströme sammeln
     dividenden: dict[str, dict[int, Decimal]] = defaultdict(lambda: defaultdict(Decimal))
-    for tx in transactions:
+    stroeme: dict[str, list[Transaction]] = defaultdict(list)
+    for tx in sorted(transactions, key=lambda t: t.datum):
         if tx.typ == TransaktionsTyp.DIVIDENDE:
             dividenden[tx.security_uuid][tx.datum.year] += tx.gesamtbetrag
+        elif tx.typ in KAUF_TYPEN or tx.typ in VERKAUF_TYPEN:
+            stroeme[tx.security_uuid].append(tx)
+
+    # Die Lot-VP (brutto) hängt nur von Basiszins und Faktor ab; die
+    # Teilfreistellung wird erst bei der Besteuerung angewendet
+    version = parameter_version("basiszins_vorabpauschale", "vorabpauschale_faktor")
 
     for sec_uuid, fifo in positionen.items():
         sec = securities.get(sec_uuid)
@@ -50,55 +161,49 @@ def apply_vorabpauschalen(
         sec_dividenden = dividenden.get(sec_uuid, {})
 
         lots = fifo.bestand()
-        # Gesamtstücke pro Jahr für anteilige Dividenden-Verteilung
-        # (wird pro Lot berechnet: lot.stuecke / gesamt_stuecke)
-        gesamt_stuecke = fifo.gesamtstuecke()
-        if gesamt_stuecke == 0:
+        if fifo.gesamtstuecke() == 0:
             continue
+        # Bestand je Jahresende für die anteilige Dividenden-Verteilung;
+        # ohne Kauftransaktionen gelten die offenen Lots als ungekürzt
+        strom = stroeme.get(sec_uuid)
+        verlauf = Bestandsverlauf(strom) if strom else None
+
+        speicher._fuer(sec_uuid, (sec.fonds_typ,))
 
+        # Je Jahr: Memo der Lot-VP, Eingangsgrößen erst bei einem Fehlschlag
+        jahre: dict[int, tuple[dict[tuple, Decimal], tuple]] = {}
+        jahresdaten: dict[int, _JahresVP | None] = {}
         for lot_idx, lot in enumerate(lots):
-            start_year = lot.kaufdatum.year
-            end_year = steuerjahr - 1  # nur abgeschlossene Jahre
-
-            for jahr in range(start_year, end_year + 1):
-                # Basiszins prüfen
-                try:
-                    basiszins = get_param("basiszins_vorabpauschale", jahr)
-                except ValueError:
-                    continue
-                if basiszins < 0:
-                    continue
-
-                # Kurse am Jahresanfang und -ende suchen
-                kurs_jan1 = find_nearest_kurs(sec_kurse, date(jahr, 1, 1))
-                kurs_dec31 = find_nearest_kurs(sec_kurse, date(jahr, 12, 31))
-                if kurs_jan1 is None or kurs_dec31 is None:
-                    continue
-
-                wert_anfang = kurs_jan1 * lot.stuecke
-                wert_ende = kurs_dec31 * lot.stuecke
-
-                # Dividenden anteilig nach Stückzahl des Lots
-                jahr_div_gesamt = sec_dividenden.get(jahr, Decimal("0"))
-                if gesamt_stuecke > 0:
-                    ausschuettungen = jahr_div_gesamt * lot.stuecke / gesamt_stuecke
-                else:
-                    ausschuettungen = Decimal("0")
-
-                # Kaufdatum nur übergeben wenn unterjähriger Kauf
-                kaufdatum = lot.kaufdatum if lot.kaufdatum.year == jahr else None
-
-                try:
-                    erg = berechne_vorabpauschale(
-                        security=sec,
-                        jahr=jahr,
-                        wert_anfang=wert_anfang,
-                        wert_ende=wert_ende,
-                        ausschuettungen=ausschuettungen,
-                        kaufdatum=kaufdatum,
+            key = _lot_key(lot)
+            summe = Decimal("0")
+            for jahr in range(lot.kaufdatum.year, steuerjahr):  # nur abgeschlossene Jahre
+                if jahr not in jahre:
+                    # Dividenden anteilig nach den am Jahresende gehaltenen Stücken
+                    if verlauf is not None:
+                        gehalten = verlauf.gesamtstuecke(jahr)
+                    else:
+                        gehalten = sum(
+                            (l.stuecke for l in lots if l.kaufdatum.year <= jahr),
+                            Decimal("0"),
+                        )
+                    eingaben = (
+                        find_nearest_kurs(sec_kurse, date(jahr, 1, 1)),
+                        find_nearest_kurs(sec_kurse, date(jahr, 12, 31)),
+                        sec_dividenden.get(jahr, Decimal("0")),
+                        gehalten,
                     )
-                except ValueError:
-                    continue
-
-                if erg.vorabpauschale_brutto > 0:
-                    fifo.add_vorabpauschale_to_lot(lot_idx, erg.vorabpauschale_brutto)
+                    jahre[jahr] = (
+                        speicher._fuer_jahr(sec_uuid, jahr, eingaben + (version,)),
+                        eingaben,
+                    )
+                memo, eingaben = jahre[jahr]
+                vp = memo.get(key)
+                if vp is None:
+                    if jahr not in jahresdaten:
+                        jahresdaten[jahr] = _jahres_vp(jahr, *eingaben)
+                    daten = jahresdaten[jahr]
+                    vp = daten.vp_lot(lot) if daten is not None else Decimal("0")
+                    memo[key] = vp
+                summe += vp
+            if summe > 0:
+                fifo.add_vorabpauschale_to_lot(lot_idx, summe)
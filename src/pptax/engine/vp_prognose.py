@@ -0,0 +1,242 @@
+"""Hochrechnung der Vorabpauschale für das laufende Jahr.
+
+Solange kein Kurs zum 31.12. vorliegt, wird die Vorabpauschale des
+laufenden Jahres mit dem letzten verfügbaren Kurs als Jahresendkurs
+geschätzt. Kurs zum 1.1., Steuerkontext, Ausschüttungen und Lots werden
+einmal vorbereitet; neue Kurse lösen nur noch die Neuberechnung des
+betroffenen Wertpapiers aus.
+"""
+
+from collections.abc import Iterable
+from dataclasses import dataclass, field, replace
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.kurs_utils import find_nearest_kurs
+from pptax.engine.tax_context import TaxContext, get_tax_context
+from pptax.engine.tax_params import parameter_version
+from pptax.engine.vorabpauschale import (
+    TWO_PLACES,
+    berechne_vorabpauschale,
+    vorabpauschale_pro_stueck,
+)
+from pptax.models.portfolio import (
+    FifoPosition,
+    HistorischerKurs,
+    Security,
+    Transaction,
+    TransaktionsTyp,
+)
+from pptax.models.tax import VorabpauschaleErgebnis
+
+
+# Parameter, aus denen Steuerkontext und Prognose abgeleitet werden
+_PARAMETER = (
+    "basiszins_vorabpauschale",
+    "vorabpauschale_faktor",
+    "teilfreistellung",
+    "abgeltungssteuer_satz",
+    "solidaritaetszuschlag_satz",
+    "kirchensteuer_saetze",
+)
+
+
+@dataclass
+class _Basis:
+    """Vorberechnete, kursunabhängige Größen eines Wertpapiers."""
+
+    security: Security
+    kurs_anfang: Decimal
+    lots: list[FifoPosition]
+    ausschuettungen: Decimal
+    tfs: Decimal
+    kursdatum: date | None = None
+    kurs_aktuell: Decimal | None = None
+    lot_vp: list[Decimal] = field(default_factory=list)
+    ergebnis: VorabpauschaleErgebnis | None = None
+    ergebnis_pro_stueck: VorabpauschaleErgebnis | None = None
+
+
+class VorabpauschalePrognose:
+    """Geschätzte Vorabpauschale des laufenden Jahres je Wertpapier und Lot."""
+
+    def __init__(
+        self,
+        positionen: dict[str, FifoBestand],
+        securities: dict[str, Security],
+        kurse_map: dict[str, dict[str, Decimal]],
+        transactions: list[Transaction],
+        jahr: int | None = None,
+        ctx: TaxContext | None = None,
+    ):
+        """
+        Args:
+            positionen: Aktuelle FIFO-Bestände pro Security
+            securities: Security-Objekte nach UUID
+            kurse_map: Verschachtelte Map security_uuid -> datum_iso -> kurs
+            transactions: Transaktionen (für Ausschüttungen im Jahr)
+            jahr: Zu schätzendes Jahr (Standard: laufendes Jahr)
+            ctx: Optionaler Steuerkontext des Jahres (z.B. mit Kirchensteuer)
+        """
+        self.jahr = jahr if jahr is not None else date.today().year
+        self.parameter_version = parameter_version(*_PARAMETER)
+        if ctx is not None and ctx.jahr != self.jahr:
+            raise ValueError(
+                f"Steuerkontext für {ctx.jahr} passt nicht zum Jahr {self.jahr}"
+            )
+        self.ctx = ctx if ctx is not None else get_tax_context(self.jahr)
+        self._basis: dict[str, _Basis] = {}
+        if self.ctx.basiszins is None or self.ctx.vorabpauschale_faktor is None:
+            return
+
+        ausschuettungen: dict[str, Decimal] = {}
+        for tx in transactions:
+            if tx.typ == TransaktionsTyp.DIVIDENDE and tx.datum.year == self.jahr:
+                ausschuettungen[tx.security_uuid] = (
+                    ausschuettungen.get(tx.security_uuid, Decimal("0")) + tx.gesamtbetrag
+                )
+
+        for sec_uuid, fifo in positionen.items():
+            sec = securities.get(sec_uuid)
+            if sec is None or fifo.gesamtstuecke() == 0:
+                continue
+            sec_kurse = kurse_map.get(sec_uuid, {})
+            kurs_anfang = find_nearest_kurs(sec_kurse, date(self.jahr, 1, 1))
+            if kurs_anfang is None:
+                continue
+            basis = _Basis(
+                security=sec,
+                kurs_anfang=kurs_anfang,
+                lots=[l for l in fifo.bestand() if l.kaufdatum.year <= self.jahr],
+                ausschuettungen=ausschuettungen.get(sec_uuid, Decimal("0")),
+                tfs=self.ctx.teilfreistellung_satz(sec.fonds_typ),
+            )
+            self._basis[sec_uuid] = basis
+
+            # Letzter Kurs im Jahr
+            praefix = f"{self.jahr}-"
+            im_jahr = [d for d in sec_kurse if d.startswith(praefix)]
+            if im_jahr:
+                letzter = max(im_jahr)
+                self._setze_kurs(basis, date.fromisoformat(letzter), sec_kurse[letzter])
+
+    def ist_aktuell(self) -> bool:
+        """False, sobald sich seit dem Aufbau ein Steuerparameter geändert hat
+        (z.B. neue Parameterdatei); die Prognose muss dann neu aufgebaut werden."""
+        return self.parameter_version == parameter_version(*_PARAMETER)
+
+    def kopie(self) -> "VorabpauschalePrognose":
+        """Unabhängige Kopie, deren Kursaktualisierungen das Original nicht
+        verändern (Lots werden geteilt, sie bleiben unverändert)."""
+        neu = object.__new__(VorabpauschalePrognose)
+        neu.jahr = self.jahr
+        neu.parameter_version = self.parameter_version
+        neu.ctx = self.ctx
+        neu._basis = {
+            uuid: replace(b, lot_vp=list(b.lot_vp)) for uuid, b in self._basis.items()
+        }
+        return neu
+
+    def aktualisiere_kurs(self, security_uuid: str, datum: date, kurs: Decimal) -> bool:
+        """Neuen Kurs übernehmen; nur neuere Kurse des Jahres zählen.
+
+        Returns:
+            True, wenn die Prognose des Wertpapiers neu berechnet wurde
+        """
+        basis = self._basis.get(security_uuid)
+        if basis is None or datum.year != self.jahr:
+            return False
+        if basis.kursdatum is not None and datum < basis.kursdatum:
+            return False
+        self._setze_kurs(basis, datum, kurs)
+        return True
+
+    def aktualisiere_kurse(self, kurse: Iterable[HistorischerKurs]) -> set[str]:
+        """Mehrere neue Kurse übernehmen; gibt die neu berechneten UUIDs zurück."""
+        neueste: dict[str, HistorischerKurs] = {}
+        for k in kurse:
+            if k.datum.year != self.jahr or k.security_uuid not in self._basis:
+                continue
+            bisher = neueste.get(k.security_uuid)
+            if bisher is None or k.datum >= bisher.datum:
+                neueste[k.security_uuid] = k
+        aktualisiert: set[str] = set()
+        for uuid, k in neueste.items():
+            basis = self._basis[uuid]
+            if basis.kursdatum == k.datum and basis.kurs_aktuell == k.kurs:
+                continue
+            if self.aktualisiere_kurs(uuid, k.datum, k.kurs):
+                aktualisiert.add(uuid)
+        return aktualisiert
+
+    def ergebnis(self, security_uuid: str) -> VorabpauschaleErgebnis | None:
+        """Prognose eines Wertpapiers (None ohne Kurs im Jahr)."""
+        basis = self._basis.get(security_uuid)
+        return basis.ergebnis if basis is not None else None
+
+    def ergebnisse(self) -> list[VorabpauschaleErgebnis]:
+        """Prognosen aller Wertpapiere mit Kurs im Jahr."""
+        return [b.ergebnis for b in self._basis.values() if b.ergebnis is not None]
+
+    def ergebnisse_pro_stueck(self) -> list[VorabpauschaleErgebnis]:
+        """Prognosen je Stück, in derselben Einheit wie
+        berechne_mehrjahresuebersicht (Kurse statt Positionswerte)."""
+        return [
+            b.ergebnis_pro_stueck for b in self._basis.values() if b.ergebnis_pro_stueck is not None
+        ]
+
+    def lot_vorabpauschalen(self, security_uuid: str) -> list[Decimal]:
+        """Geschätzte Vorabpauschale je offenem Lot (älteste zuerst)."""
+        basis = self._basis.get(security_uuid)
+        return list(basis.lot_vp) if basis is not None else []
+
+    def _setze_kurs(self, basis: _Basis, datum: date, kurs: Decimal) -> None:
+        basis.kursdatum = datum
+        basis.kurs_aktuell = kurs
+        ctx = self.ctx
+
+        gehalten = sum((l.stuecke for l in basis.lots), Decimal("0"))
+        div_pro_stueck = basis.ausschuettungen / gehalten if gehalten > 0 else Decimal("0")
+
+        # Je Kaufmonat eine Berechnung, je Lot multiplizieren und runden
+        je_monat: dict[int | None, Decimal] = {}
+        basis.lot_vp = []
+        for lot in basis.lots:
+            monat = lot.kaufdatum.month if lot.kaufdatum.year == self.jahr else None
+            if monat not in je_monat:
+                je_monat[monat] = vorabpauschale_pro_stueck(
+                    self.jahr, basis.kurs_anfang, kurs, div_pro_stueck, monat, ctx
+                )
+            basis.lot_vp.append(
+                (lot.stuecke * je_monat[monat]).quantize(TWO_PLACES, ROUND_HALF_UP)
+            )
+
+        wert_anfang = basis.kurs_anfang * gehalten
+        wert_ende = kurs * gehalten
+        vp_brutto = sum(basis.lot_vp, Decimal("0"))
+        vp_steuerpflichtig = (vp_brutto * (1 - basis.tfs)).quantize(TWO_PLACES, ROUND_HALF_UP)
+        basisertrag = (
+            (wert_anfang * ctx.basiszins * ctx.vorabpauschale_faktor).quantize(
+                TWO_PLACES, ROUND_HALF_UP
+            )
+            if ctx.basiszins >= 0
+            else Decimal("0")
+        )
+        basis.ergebnis = VorabpauschaleErgebnis(
+            security_uuid=basis.security.uuid,
+            jahr=self.jahr,
+            wert_jahresanfang=wert_anfang,
+            wert_jahresende=wert_ende,
+            basiszins=ctx.basiszins,
+            basisertrag=basisertrag,
+            wertsteigerung=wert_ende - wert_anfang,
+            ausschuettungen=basis.ausschuettungen,
+            vorabpauschale_brutto=vp_brutto,
+            teilfreistellung_satz=basis.tfs,
+            vorabpauschale_steuerpflichtig=vp_steuerpflichtig,
+            steuer=(vp_steuerpflichtig * ctx.steuersatz).quantize(TWO_PLACES, ROUND_HALF_UP),
+        )
+        basis.ergebnis_pro_stueck = berechne_vorabpauschale(
+            basis.security, self.jahr, basis.kurs_anfang, kurs, basis.ausschuettungen, ctx=ctx
+        )
@@ -0,0 +1,267 @@
+"""Monte-Carlo-Simulation künftiger Vorabpauschalen und Liquidationssteuer.
+
+Je Pfad wird für jedes Wertpapier ein Kursverlauf aus historischen
+Monatsrenditen (Bootstrap mit Zurücklegen) gezogen, optional zusammen mit
+einem Basiszins je Jahr aus einer Szenarioliste. Jahr für Jahr wird die
+Vorabpauschale je Stück berechnet, auf eine Kopie des FIFO-Bestands
+gebucht und am Ende der Verkauf aller Stücke inkl. VP-Anrechnung
+simuliert. Berichtet werden Perzentile über alle Pfade.
+
+Pfade werden in Blöcken fester Größe gerechnet; jeder Block hat einen aus
+Seed und Blocknummer abgeleiteten Zufallsgenerator. Das Ergebnis hängt
+daher nur vom Seed ab, nicht von der Anzahl der Worker-Prozesse.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from math import ceil
+from random import Random
+
+from pptax.engine import tax_params
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.tax_context import TaxContext, get_tax_context
+from pptax.engine.vorabpauschale import TWO_PLACES, vorabpauschale_pro_stueck
+from pptax.models.portfolio import Security
+from pptax.models.tax import SimulationsErgebnis
+
+BLOCKGROESSE = 250
+
+
+@dataclass
+class _Wertpapier:
+    """Kursunabhängige Eingaben eines Wertpapiers für die Simulation."""
+
+    fifo: FifoBestand
+    is_fond: bool
+    kurs_start: Decimal
+    renditen: list[Decimal]  # Monatliche Kursfaktoren (Kurs_t / Kurs_t-1)
+    tfs: list[Decimal]  # Teilfreistellung je Simulationsjahr
+
+
+@dataclass
+class _Modell:
+    """Alle Eingaben, die ein Worker für einen Block von Pfaden braucht."""
+
+    jahre: list[int]
+    kirchensteuer: bool
+    bundesland: str
+    basiszins_szenarien: list[Decimal] | None
+    wertpapiere: list[_Wertpapier]
+    seed: int
+
+
+def monatsrenditen(kurse: dict[str, Decimal]) -> list[Decimal]:
+    """Kursfaktoren zwischen aufeinanderfolgenden Monatsendkursen.
+
+    Je Monat zählt der letzte verfügbare Kurs; Monate ohne Kurs
+    unterbrechen die Reihe (keine Rendite über die Lücke).
+    """
+    monatsende: dict[tuple[int, int], Decimal] = {}
+    for datum_iso in sorted(kurse):
+        monatsende[(int(datum_iso[:4]), int(datum_iso[5:7]))] = kurse[datum_iso]
+
+    renditen: list[Decimal] = []
+    vorher: tuple[int, int] | None = None
+    for jahr, monat in monatsende:
+        if vorher is not None:
+            vj, vm = vorher
+            if (jahr * 12 + monat) - (vj * 12 + vm) == 1 and monatsende[vorher] > 0:
+                renditen.append(monatsende[(jahr, monat)] / monatsende[vorher])
+        vorher = (jahr, monat)
+    return renditen
+
+
+def _perzentil(werte: list[Decimal], p: int) -> Decimal:
+    """Perzentil nach der Nearest-Rank-Methode (werte aufsteigend sortiert)."""
+    rang = max(1, ceil(len(werte) * p / 100))
+    return werte[rang - 1]
+
+
+def _simuliere_block(auftrag: tuple[_Modell, int, int]) -> list[tuple]:
+    """Rechne anzahl Pfade des Blocks block.
+
+    Returns:
+        Je Pfad (VP je Jahr, VP-Steuer je Jahr, Liquidationssteuer)
+    """
+    modell, block, anzahl = auftrag
+    rng = Random(f"{modell.seed}/{block}")
+    # TaxContext ist nicht picklebar und wird daher im Worker aufgelöst
+    kontexte = [
+        get_tax_context(jahr, kirchensteuer=modell.kirchensteuer, bundesland=modell.bundesland)
+        for jahr in modell.jahre
+    ]
+    ctx_cache: dict[tuple[int, Decimal], TaxContext] = {}
+    pfade = []
+
+    for _ in range(anzahl):
+        vp_jahre: list[Decimal] = []
+        steuer_jahre: list[Decimal] = []
+        kurse = [wp.kurs_start for wp in modell.wertpapiere]
+        bestaende = [wp.fifo.snapshot() for wp in modell.wertpapiere]
+
+        for j, (jahr, ctx) in enumerate(zip(modell.jahre, kontexte)):
+            if modell.basiszins_szenarien:
+                basiszins = rng.choice(modell.basiszins_szenarien)
+                key = (jahr, basiszins)
+                if key not in ctx_cache:
+                    ctx_cache[key] = replace(ctx, basiszins=basiszins)
+                ctx = ctx_cache[key]
+
+            vp_jahr = Decimal("0")
+            steuer_jahr = Decimal("0")
+            for i, wp in enumerate(modell.wertpapiere):
+                kurs_anfang = kurse[i]
+                kurs_ende = kurs_anfang
+                for _monat in range(12):
+                    kurs_ende *= rng.choice(wp.renditen)
+                kurse[i] = kurs_ende
+                if not wp.is_fond:
+                    continue
+
+                vp_ps = vorabpauschale_pro_stueck(jahr, kurs_anfang, kurs_ende, ctx=ctx)
+                if vp_ps <= 0:
+                    continue
+                vp = bestaende[i].add_vorabpauschale_pro_stueck(
+                    vp_ps, quantisierung=TWO_PLACES
+                )
+                stpfl = (vp * (1 - wp.tfs[j])).quantize(TWO_PLACES, ROUND_HALF_UP)
+                vp_jahr += vp
+                steuer_jahr += (stpfl * ctx.steuersatz).quantize(TWO_PLACES, ROUND_HALF_UP)
+            vp_jahre.append(vp_jahr)
+            steuer_jahre.append(steuer_jahr)
+
+        # Verkauf aller Stücke zum letzten Kurs: Fonds nach Teilfreistellung
+        # in den allgemeinen Topf, Aktienverluste nur mit Aktiengewinnen
+        allgemein = Decimal("0")
+        aktien = Decimal("0")
+        for i, wp in enumerate(modell.wertpapiere):
+            stuecke = bestaende[i].gesamtstuecke()
+            if stuecke <= 0:
+                continue
+            (sim,) = bestaende[i].simuliere_verkaeufe(
+                [stuecke], kurse[i], wp.tfs[-1] if wp.is_fond else Decimal("0")
+            )
+            if wp.is_fond:
+                allgemein += sim.gewinn_steuerpflichtig
+            else:
+                aktien += sim.gewinn_steuerpflichtig
+        steuerpflichtig = max(Decimal("0"), allgemein + max(Decimal("0"), aktien))
+        liquidation = (steuerpflichtig * kontexte[-1].steuersatz).quantize(
+            TWO_PLACES, ROUND_HALF_UP
+        )
+        pfade.append((vp_jahre, steuer_jahre, liquidation))
+    return pfade
+
+
+def simuliere_steuerlast(
+    positionen: dict[str, FifoBestand],
+    securities: dict[str, Security],
+    kurse_map: dict[str, dict[str, Decimal]],
+    anzahl_jahre: int,
+    anzahl_pfade: int = 1000,
+    seed: int = 0,
+    start_jahr: int | None = None,
+    basiszins_szenarien: list[Decimal] | None = None,
+    perzentile: tuple[int, ...] = (5, 50, 95),
+    kirchensteuer: bool = False,
+    bundesland: str = "default",
+    max_workers: int = 1,
+) -> SimulationsErgebnis:
+    """Simuliere Vorabpauschalen und Liquidationssteuer künftiger Jahre.
+
+    Alle Lots gelten als ganzjährig gehalten; Ausschüttungen werden nicht
+    simuliert. Der Startkurs ist der letzte bekannte Kurs vor dem 1.1. des
+    Startjahres.
+
+    Args:
+        positionen: FIFO-Bestände pro Security (werden nicht verändert)
+        securities: Security-Objekte nach UUID
+        kurse_map: Verschachtelte Map security_uuid -> datum_iso -> kurs
+        anzahl_jahre: Anzahl simulierter Jahre ab start_jahr
+        anzahl_pfade: Anzahl Kurspfade
+        seed: Startwert des Zufallsgenerators (reproduzierbar)
+        start_jahr: Erstes simuliertes Jahr (Standard: Jahr nach dem
+            letzten bekannten Kurs)
+        basiszins_szenarien: Basiszinsen, aus denen je Pfad und Jahr gezogen
+            wird (None = Basiszins laut Steuerparametern)
+        perzentile: Zu berichtende Perzentile
+        max_workers: Anzahl Worker-Prozesse; bei 1 wird seriell gerechnet
+    """
+    if anzahl_jahre < 1 or anzahl_pfade < 1:
+        raise ValueError("Anzahl Jahre und Pfade müssen mindestens 1 sein")
+
+    uuids = [
+        uuid
+        for uuid, fifo in positionen.items()
+        if uuid in securities and fifo.gesamtstuecke() > 0
+    ]
+    if start_jahr is None:
+        letzte = [max(kurse_map[u]) for u in uuids if kurse_map.get(u)]
+        start_jahr = (
+            int(max(letzte)[:4]) + 1 if letzte else date.today().year + 1
+        )
+    jahre = list(range(start_jahr, start_jahr + anzahl_jahre))
+    kontexte = [
+        get_tax_context(jahr, kirchensteuer=kirchensteuer, bundesland=bundesland)
+        for jahr in jahre
+    ]
+    for ctx in kontexte:
+        if ctx.basiszins is None or ctx.vorabpauschale_faktor is None:
+            raise ValueError(f"Kein Basiszins für das Jahr {ctx.jahr} verfügbar")
+
+    stichtag = f"{start_jahr}-01-01"
+    wertpapiere: list[_Wertpapier] = []
+    for uuid in uuids:
+        sec = securities[uuid]
+        kurse = kurse_map.get(uuid, {})
+        vorher = [d for d in kurse if d < stichtag]
+        renditen = monatsrenditen(kurse)
+        if not vorher or not renditen:
+            raise ValueError(f"Keine historischen Renditen für {sec.name}")
+        wertpapiere.append(
+            _Wertpapier(
+                fifo=positionen[uuid],
+                is_fond=sec.is_fond,
+                kurs_start=kurse[max(vorher)],
+                renditen=renditen,
+                tfs=[ctx.teilfreistellung_satz(sec.fonds_typ) for ctx in kontexte],
+            )
+        )
+
+    modell = _Modell(
+        jahre=jahre,
+        kirchensteuer=kirchensteuer,
+        bundesland=bundesland,
+        basiszins_szenarien=basiszins_szenarien,
+        wertpapiere=wertpapiere,
+        seed=seed,
+    )
+    auftraege = [
+        (modell, block, min(BLOCKGROESSE, anzahl_pfade - start))
+        for block, start in enumerate(range(0, anzahl_pfade, BLOCKGROESSE))
+    ]
+    if max_workers <= 1 or len(auftraege) <= 1:
+        bloecke = [_simuliere_block(a) for a in auftraege]
+    else:
+        # spawn statt fork: der GUI-Prozess (Qt, Worker-Threads) wird nicht geklont
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(auftraege)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=tax_params.set_parameter_layers,
+            initargs=tax_params.get_parameter_layers(),
+        ) as pool:
+            bloecke = list(pool.map(_simuliere_block, auftraege))
+    pfade = [pfad for block in bloecke for pfad in block]
+
+    ergebnis = SimulationsErgebnis(anzahl_pfade=len(pfade), perzentile=tuple(perzentile))
+    for j, jahr in enumerate(jahre):
+        vp = sorted(pfad[0][j] for pfad in pfade)
+        steuer = sorted(pfad[1][j] for pfad in pfade)
+        ergebnis.vorabpauschale[jahr] = {p: _perzentil(vp, p) for p in perzentile}
+        ergebnis.vp_steuer[jahr] = {p: _perzentil(steuer, p) for p in perzentile}
+    liquidation = sorted(pfad[2] for pfad in pfade)
+    ergebnis.liquidationssteuer = {p: _perzentil(liquidation, p) for p in perzentile}
+    return ergebnis
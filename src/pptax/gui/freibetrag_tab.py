@@ -21,15 +21,16 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont, QColor
 
 from pptax.parser.pp_xml_parser import PortfolioData
-from pptax.models.portfolio import TransaktionsTyp
 from pptax.engine.fifo import FifoBestand
 from pptax.engine.freibetrag import optimiere_freibetrag
+from pptax.engine.fifo_ledger import FifoLedger
 from pptax.engine.kurs_utils import build_kurse_map
-from pptax.engine.vp_integration import apply_vorabpauschalen
-from pptax.engine.tax_params import get_param
+from pptax.engine.vp_integration import VorabpauschalenSpeicher, apply_vorabpauschalen
+from pptax.engine.tax_context import get_tax_context
 from pptax.models.tax import FreibetragOptimierungErgebnis, VerkaufsVorschlag
 from pptax.export.csv_export import export_freibetrag
 from pptax.gui import _fmt
+from pptax.gui.worker import AufgabenToken
 
 HEADERS = [
     "Wertpapier", "ISIN", "Stücke", "Kaufdatum",
@@ -59,6 +60,7 @@ class FreibetragTab(QWidget):
         current_year = date.today().year
         for y in range(current_year, 2017, -1):
             self.year_combo.addItem(str(y))
+        self.year_combo.currentIndexChanged.connect(self._on_year_changed)
         info_layout.addWidget(self.year_combo)
 
         btn_calc = QPushButton("Optimale Verkäufe berechnen")
@@ -94,9 +96,10 @@ class FreibetragTab(QWidget):
     def _update_freibetrag_display(self):
         config = self.main_window.config
         jahr = int(self.year_combo.currentText())
-        try:
-            spb = get_param("sparerpauschbetrag", jahr)
-            gesamt = Decimal(str(spb[config.veranlagungstyp]))
+        gesamt = get_tax_context(jahr, config.veranlagungstyp).sparerpauschbetrag
+        if gesamt is None:
+            self.freibetrag_label.setText("Freibetrag: nicht verfügbar")
+        else:
             genutzt = config.freibetrag_bereits_genutzt
             verbleibend = max(Decimal("0"), gesamt - genutzt)
             self.freibetrag_label.setText(
@@ -104,8 +107,6 @@ class FreibetragTab(QWidget):
                 f"{_fmt.euro(genutzt)} genutzt / "
                 f"{_fmt.euro(verbleibend)} verbleibend"
             )
-        except ValueError:
-            self.freibetrag_label.setText("Freibetrag: nicht verfügbar")
 
     def _calculate(self):
         if not self.data:
@@ -113,21 +114,43 @@ class FreibetragTab(QWidget):
 
         config = self.main_window.config
         jahr = int(self.year_combo.currentText())
+        data = self.data
+        main_window = self.main_window
+
+        def aufgabe(token: AufgabenToken) -> FreibetragOptimierungErgebnis:
+            # FIFO-Bestände aufbauen
+            token.fortschritt(f"Baue FIFO-Bestände für {jahr} auf…")
+            positionen, aktuelle_kurse = _build_fifo_from_data(
+                data,
+                steuerjahr=jahr,
+                ledger=main_window.fifo_ledger,
+                vp_speicher=main_window.vp_speicher,
+            )
 
-        # FIFO-Bestände aufbauen
-        positionen, aktuelle_kurse = _build_fifo_from_data(self.data, steuerjahr=jahr)
-
-        sec_map = {s.uuid: s for s in self.data.securities}
+            token.fortschritt("Optimiere Freibetrag…")
+            sec_map = {s.uuid: s for s in data.securities}
+            ctx = get_tax_context(jahr, config.veranlagungstyp)
+            return optimiere_freibetrag(
+                jahr=jahr,
+                veranlagungstyp=config.veranlagungstyp,
+                bereits_genutzt=config.freibetrag_bereits_genutzt,
+                positionen=positionen,
+                aktuelle_kurse=aktuelle_kurse,
+                securities=sec_map,
+                ctx=ctx,
+            )
 
-        self._ergebnis = optimiere_freibetrag(
-            jahr=jahr,
-            veranlagungstyp=config.veranlagungstyp,
-            bereits_genutzt=config.freibetrag_bereits_genutzt,
-            positionen=positionen,
-            aktuelle_kurse=aktuelle_kurse,
-            securities=sec_map,
+        main_window.runner.starte(
+            "freibetrag", aufgabe, self._on_ergebnis, text="Berechne Freibetrag…"
         )
 
+    def _on_year_changed(self):
+        """Eine laufende Berechnung gilt nur für das alte Steuerjahr."""
+        self.main_window.runner.abbrechen("freibetrag")
+        self._update_freibetrag_display()
+
+    def _on_ergebnis(self, ergebnis: FreibetragOptimierungErgebnis):
+        self._ergebnis = ergebnis
         self._update_freibetrag_display()
         self._update_tree()
 
@@ -241,35 +264,33 @@ class FreibetragTab(QWidget):
 def _build_fifo_from_data(
     data: PortfolioData,
     steuerjahr: int | None = None,
+    ledger: FifoLedger | None = None,
+    vp_speicher: VorabpauschalenSpeicher | None = None,
 ) -> tuple[dict[str, FifoBestand], dict[str, Decimal]]:
     """Baue FIFO-Bestände und aktuelle Kurse aus den Portfolio-Daten.
 
-    Wenn steuerjahr angegeben, werden Vorabpauschalen für alle
-    abgeschlossenen Jahre vor dem Steuerjahr auf die Lots angewendet.
+    Wenn steuerjahr angegeben, wird der Bestand am Ende des Steuerjahres
+    verwendet und Vorabpauschalen für alle abgeschlossenen Jahre vor dem
+    Steuerjahr werden auf die Lots angewendet. Ein übergebener Ledger muss
+    die Transaktionen aus data enthalten; seine Checkpoints bleiben
+    unverändert.
     """
-    positionen: dict[str, FifoBestand] = {}
-
-    # Transaktionen nach Datum sortieren
-    sorted_tx = sorted(data.transactions, key=lambda t: t.datum)
-    for tx in sorted_tx:
-        if tx.typ == TransaktionsTyp.KAUF or tx.typ == TransaktionsTyp.EINLIEFERUNG:
-            if tx.security_uuid not in positionen:
-                positionen[tx.security_uuid] = FifoBestand(tx.security_uuid)
-            positionen[tx.security_uuid].kauf(tx.datum, tx.stuecke, tx.kurs)
-        elif tx.typ == TransaktionsTyp.VERKAUF or tx.typ == TransaktionsTyp.AUSLIEFERUNG:
-            if tx.security_uuid in positionen:
-                try:
-                    positionen[tx.security_uuid].verkauf(
-                        tx.datum, tx.stuecke, tx.kurs
-                    )
-                except ValueError:
-                    pass
+    sec_map = {s.uuid: s for s in data.securities}
+    kurse_map = build_kurse_map(data.kurse)
+    if ledger is None:
+        ledger = FifoLedger(data.transactions)
+    positionen = ledger.positionen(steuerjahr)
 
     # Vorabpauschalen anwenden
     if steuerjahr is not None:
-        sec_map = {s.uuid: s for s in data.securities}
-        kurse_map = build_kurse_map(data.kurse)
-        apply_vorabpauschalen(positionen, sec_map, kurse_map, data.transactions, steuerjahr)
+        apply_vorabpauschalen(
+            positionen,
+            sec_map,
+            kurse_map,
+            data.transactions,
+            steuerjahr,
+            speicher=vp_speicher,
+        )
 
     # Aktuelle Kurse: neuester verfügbarer Kurs pro Security
     aktuelle_kurse: dict[str, Decimal] = {}
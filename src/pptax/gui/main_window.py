@@ -18,13 +18,20 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt
 
-from pptax.config import AppConfig
+from pptax.config import AppConfig, USER_PARAMETER_FILE
+from pptax.engine.fifo_ledger import FifoLedger
+from pptax.engine.vp_integration import VorabpauschalenSpeicher
+from pptax.engine.tax_params import load_user_parameters
 from pptax.models.portfolio import PortfolioData, PortfolioInfo
 from pptax.parser.pp_xml_parser import parse_portfolio_file
 from pptax.gui.dashboard_tab import DashboardTab
 from pptax.gui.vorabpauschale_tab import VorabpauschaleTab
 from pptax.gui.freibetrag_tab import FreibetragTab
 from pptax.gui.verkauf_tab import VerkaufTab
+from pptax.gui.worker import AufgabenRunner
+
+# Aufgaben, deren Ergebnis von den (gefilterten) Portfolio-Daten abhängt
+BERECHNUNGEN = ("daten", "vorabpauschale", "freibetrag", "verkauf")
 
 DISCLAIMER = (
     "Dieses Tool dient der Orientierung und ersetzt keine Steuerberatung. "
@@ -41,10 +48,17 @@ class MainWindow(QMainWindow):
 
         self.config = AppConfig()
         self.portfolio_data: PortfolioData | None = None
+        # FIFO-Bestände mit Jahres-Checkpoints, gemeinsam für alle Tabs
+        self.fifo_ledger = FifoLedger()
+        # Lot-Vorabpauschalen je Jahr, wiederverwendet beim Wechsel des Steuerjahres
+        self.vp_speicher = VorabpauschalenSpeicher()
         self._depot_checkboxes: list[tuple[QCheckBox, str]] = []
 
         self._setup_ui()
+        # Parser- und Engine-Aufrufe laufen im Hintergrund
+        self.runner = AufgabenRunner(self.status_bar, self)
         self._setup_menu()
+        self._load_default_user_parameters()
         self._show_disclaimer()
 
     def _setup_ui(self):
@@ -92,6 +106,8 @@ class MainWindow(QMainWindow):
         open_action = file_menu.addAction("&Öffnen...")
         open_action.setShortcut("Ctrl+O")
         open_action.triggered.connect(self._open_file_dialog)
+        params_action = file_menu.addAction("&Steuerparameter laden...")
+        params_action.triggered.connect(self._open_parameter_dialog)
         file_menu.addSeparator()
         quit_action = file_menu.addAction("&Beenden")
         quit_action.setShortcut("Ctrl+Q")
@@ -166,6 +182,17 @@ class MainWindow(QMainWindow):
     def _propagate_data(self):
         """Sende gefilterte Daten an alle Tabs."""
         filtered = self._get_filtered_data()
+        # Laufende Berechnungen beziehen sich auf die alten Daten; der Ledger
+        # wird im Worker-Thread vor allen später gestarteten Berechnungen
+        # aktualisiert
+        for schluessel in BERECHNUNGEN:
+            self.runner.abbrechen(schluessel)
+        self.runner.starte(
+            "daten",
+            lambda token: self.fifo_ledger.setze_transaktionen(filtered.transactions),
+            lambda _geaendert: None,
+            text="Aktualisiere FIFO-Bestände…",
+        )
         self.dashboard_tab.update_data(filtered)
         self.vorabpauschale_tab.update_data(filtered)
         self.freibetrag_tab.update_data(filtered)
@@ -191,20 +218,81 @@ class MainWindow(QMainWindow):
             self.load_file(filepath)
 
     def load_file(self, filepath: str):
+        self.runner.starte(
+            "laden",
+            lambda token: parse_portfolio_file(filepath),
+            lambda data: self._on_file_loaded(filepath, data),
+            self._on_load_error,
+            text=f"Lade {Path(filepath).name}…",
+        )
+
+    def _on_file_loaded(self, filepath: str, data: PortfolioData):
+        self.portfolio_data = data
+        self.status_bar.showMessage(
+            f"Geladen: {Path(filepath).name} – "
+            f"{len(self.portfolio_data.securities)} Wertpapiere, "
+            f"{len(self.portfolio_data.transactions)} Transaktionen"
+        )
+        self._setup_depot_filter()
+        self._propagate_data()
+
+    def _on_load_error(self, e: Exception):
+        self.status_bar.showMessage("Laden fehlgeschlagen")
+        QMessageBox.critical(
+            self, "Fehler beim Laden", f"Datei konnte nicht geladen werden:\n{e}"
+        )
+
+    def _load_default_user_parameters(self):
+        """Lade die Benutzer-Steuerparameter aus dem Standardpfad, falls vorhanden."""
+        if not USER_PARAMETER_FILE.exists():
+            return
         try:
-            self.portfolio_data = parse_portfolio_file(filepath)
+            load_user_parameters(USER_PARAMETER_FILE)
             self.status_bar.showMessage(
-                f"Geladen: {Path(filepath).name} – "
-                f"{len(self.portfolio_data.securities)} Wertpapiere, "
-                f"{len(self.portfolio_data.transactions)} Transaktionen"
+                f"Benutzer-Steuerparameter geladen: {USER_PARAMETER_FILE}"
             )
-            self._setup_depot_filter()
-            self._propagate_data()
-        except Exception as e:
-            QMessageBox.critical(
-                self, "Fehler beim Laden", f"Datei konnte nicht geladen werden:\n{e}"
+        except (OSError, ValueError) as e:
+            self.status_bar.showMessage(
+                f"Benutzer-Steuerparameter ungültig: {e}"
             )
 
+    def _open_parameter_dialog(self):
+        filepath, _ = QFileDialog.getOpenFileName(
+            self,
+            "Steuerparameter laden",
+            str(USER_PARAMETER_FILE.parent),
+            "JSON Dateien (*.json);;Alle Dateien (*)",
+        )
+        if not filepath:
+            return
+        # Im Worker-Thread, damit keine laufende Berechnung die
+        # Parameterschichten während des Ladens liest
+        self.runner.starte(
+            "parameter",
+            lambda token: load_user_parameters(filepath),
+            lambda _: self._on_parameters_loaded(filepath),
+            self._on_parameter_error,
+            text="Lade Steuerparameter…",
+        )
+
+    def _on_parameters_loaded(self, filepath: str):
+        self.status_bar.showMessage(
+            f"Steuerparameter geladen: {Path(filepath).name}"
+        )
+        self._propagate_data()
+
+    def _on_parameter_error(self, e: Exception):
+        QMessageBox.critical(
+            self, "Fehler beim Laden",
+            f"Steuerparameter konnten nicht geladen werden:\n{e}",
+        )
+
+    def closeEvent(self, event):
+        # Laufende Aufgaben abbrechen und auf den Worker-Thread warten
+        self.runner.abbrechen()
+        self.runner.warte()
+        super().closeEvent(event)
+
     def _show_disclaimer(self):
         QMessageBox.information(self, "Disclaimer", DISCLAIMER)
 
@@ -23,10 +23,12 @@ from PyQt6.QtGui import QColor, QFont
 
 from pptax.parser.pp_xml_parser import PortfolioData
 from pptax.engine.verkauf import plane_netto_verkauf
+from pptax.engine.tax_context import get_tax_context
 from pptax.models.tax import NettoBetragPlan, VerkaufsVorschlag
 from pptax.export.csv_export import export_verkaufsplan
 from pptax.gui import _fmt
 from pptax.gui.freibetrag_tab import _build_fifo_from_data
+from pptax.gui.worker import AufgabenToken
 
 HEADERS = [
     "Wertpapier", "ISIN", "Stücke", "Kauf am",
@@ -59,6 +61,10 @@ class VerkaufTab(QWidget):
         current_year = date.today().year
         for y in range(current_year, 2017, -1):
             self.year_combo.addItem(str(y))
+        # Eine laufende Berechnung gilt nur für das alte Steuerjahr
+        self.year_combo.currentIndexChanged.connect(
+            lambda _index: self.main_window.runner.abbrechen("verkauf")
+        )
         input_layout.addWidget(self.year_combo)
 
         btn_calc = QPushButton("Berechnen")
@@ -98,22 +104,42 @@ class VerkaufTab(QWidget):
 
         config = self.main_window.config
         jahr = int(self.year_combo.currentText())
+        data = self.data
+        main_window = self.main_window
+
+        def aufgabe(token: AufgabenToken) -> NettoBetragPlan:
+            token.fortschritt(f"Baue FIFO-Bestände für {jahr} auf…")
+            positionen, aktuelle_kurse = _build_fifo_from_data(
+                data,
+                steuerjahr=jahr,
+                ledger=main_window.fifo_ledger,
+                vp_speicher=main_window.vp_speicher,
+            )
+            sec_map = {s.uuid: s for s in data.securities}
+            ctx = get_tax_context(
+                jahr, config.veranlagungstyp, config.kirchensteuer, config.bundesland
+            )
+
+            token.fortschritt("Plane Verkäufe…")
+            return plane_netto_verkauf(
+                ziel_netto=ziel,
+                jahr=jahr,
+                veranlagungstyp=config.veranlagungstyp,
+                freibetrag_genutzt=config.freibetrag_bereits_genutzt,
+                positionen=positionen,
+                aktuelle_kurse=aktuelle_kurse,
+                securities=sec_map,
+                kirchensteuer=config.kirchensteuer,
+                bundesland=config.bundesland,
+                ctx=ctx,
+            )
 
-        positionen, aktuelle_kurse = _build_fifo_from_data(self.data, steuerjahr=jahr)
-        sec_map = {s.uuid: s for s in self.data.securities}
-
-        self._plan = plane_netto_verkauf(
-            ziel_netto=ziel,
-            jahr=jahr,
-            veranlagungstyp=config.veranlagungstyp,
-            freibetrag_genutzt=config.freibetrag_bereits_genutzt,
-            positionen=positionen,
-            aktuelle_kurse=aktuelle_kurse,
-            securities=sec_map,
-            kirchensteuer=config.kirchensteuer,
-            bundesland=config.bundesland,
+        main_window.runner.starte(
+            "verkauf", aufgabe, self._on_ergebnis, text="Berechne Verkaufsplan…"
         )
 
+    def _on_ergebnis(self, plan: NettoBetragPlan):
+        self._plan = plan
         self._update_display()
 
     def _update_display(self):
@@ -1,6 +1,5 @@
 """Vorabpauschale Tab."""
 
-from datetime import date
 from decimal import Decimal
 
 from PyQt6.QtWidgets import (
@@ -9,23 +8,178 @@ from PyQt6.QtWidgets import (
     QHBoxLayout,
     QLabel,
     QPushButton,
-    QTableWidget,
-    QTableWidgetItem,
+    QCheckBox,
+    QTableView,
+    QAbstractItemView,
     QHeaderView,
     QFileDialog,
     QMessageBox,
 )
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QColor
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt6.QtGui import QColor, QFont, QPalette
 
 from pptax.parser.pp_xml_parser import PortfolioData
-from pptax.engine.vorabpauschale import berechne_vorabpauschale
-from pptax.engine.kurs_utils import build_kurse_map, find_nearest_kurs
-from pptax.engine.tax_params import get_param
-from pptax.models.portfolio import TransaktionsTyp
+from pptax.engine.vorabpauschale import (
+    ausschuettungen_je_jahr,
+    berechne_mehrjahresuebersicht,
+)
+from pptax.engine.kurs_utils import build_kurse_map
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.vp_prognose import VorabpauschalePrognose
+from pptax.models.portfolio import Security
 from pptax.models.tax import VorabpauschaleErgebnis
 from pptax.export.csv_export import export_vorabpauschale
 from pptax.gui import _fmt
+from pptax.gui.worker import AufgabenToken
+
+HEADERS = [
+    "Jahr", "Wertpapier", "ISIN", "Wert 01.01.", "Wert 31.12.",
+    "Basisertrag", "Vorabpauschale", "Teilfreistellung",
+    "Steuerpflichtig", "Steuer",
+]
+
+# Spalte -> Feld von VorabpauschaleErgebnis (Euro-Beträge)
+_BETRAG_SPALTEN = {
+    3: "wert_jahresanfang",
+    4: "wert_jahresende",
+    5: "basisertrag",
+    6: "vorabpauschale_brutto",
+    8: "vorabpauschale_steuerpflichtig",
+    9: "steuer",
+}
+
+
+def _zwischensummen_farbe(palette: QPalette) -> QColor:
+    """Hintergrund der Zwischensummen-Zeilen passend zum Theme."""
+    base = palette.base().color()
+    # Subtile Abdunklung/Aufhellung je nach Theme-Helligkeit
+    if base.lightness() > 128:
+        return base.darker(110)
+    return base.lighter(140)
+
+
+class VorabpauschaleModel(QAbstractTableModel):
+    """Tabellenmodell direkt auf der Ergebnisliste.
+
+    Sortierung (Jahr absteigend, Wertpapier aufsteigend) und
+    Jahres-Zwischensummen werden beim Setzen der Ergebnisse einmal
+    berechnet; Zelltexte entstehen erst, wenn die View sie anfragt.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._ergebnisse: list[VorabpauschaleErgebnis] = []
+        self._namen: list[str] = []
+        self._isins: list[str] = []
+        # Je Tabellenzeile: Index in _ergebnisse oder ~jahr_index für eine
+        # Zwischensumme (negativ)
+        self._zeilen: list[int] = []
+        self._summen: list[tuple[int, Decimal]] = []  # (Jahr, Steuer)
+        self.steuer_gesamt = Decimal("0")
+        self._zwischensummen_farbe: QColor | None = None
+        self._fett = QFont()
+        self._fett.setBold(True)
+
+    def setze_zwischensummen_farbe(self, farbe: QColor) -> None:
+        self._zwischensummen_farbe = farbe
+
+    def setze_ergebnisse(
+        self,
+        ergebnisse: list[VorabpauschaleErgebnis],
+        sec_map: dict[str, Security],
+    ) -> None:
+        self.beginResetModel()
+        # Sortierung: Jahr DESC, Wertpapier-Name ASC
+        namen_je_uuid = {
+            uuid: (sec.name, sec.isin or "") for uuid, sec in sec_map.items()
+        }
+        sortiert = sorted(
+            ergebnisse,
+            key=lambda e: (
+                -e.jahr,
+                namen_je_uuid.get(e.security_uuid, (e.security_uuid,))[0].lower(),
+            ),
+        )
+        self._ergebnisse = sortiert
+        self._namen = []
+        self._isins = []
+        self._zeilen = []
+        self._summen = []
+        self.steuer_gesamt = Decimal("0")
+
+        # Ergebnisse nach Jahr gruppieren, Zwischensumme nach jedem Jahr
+        jahr_steuer = Decimal("0")
+        for i, e in enumerate(sortiert):
+            if i > 0 and e.jahr != sortiert[i - 1].jahr:
+                self._summen.append((sortiert[i - 1].jahr, jahr_steuer))
+                self._zeilen.append(~(len(self._summen) - 1))
+                jahr_steuer = Decimal("0")
+            name, isin = namen_je_uuid.get(e.security_uuid, (e.security_uuid, ""))
+            self._namen.append(name)
+            self._isins.append(isin)
+            self._zeilen.append(i)
+            jahr_steuer += e.steuer
+            self.steuer_gesamt += e.steuer
+        if sortiert:
+            self._summen.append((sortiert[-1].jahr, jahr_steuer))
+            self._zeilen.append(~(len(self._summen) - 1))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._zeilen)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if (
+            role == Qt.ItemDataRole.DisplayRole
+            and orientation == Qt.Orientation.Horizontal
+        ):
+            return HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        zeile = self._zeilen[index.row()]
+        col = index.column()
+
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            if col >= 3:
+                return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+            return None
+
+        if zeile < 0:
+            # Fett formatierte Zwischensummen-Zeile
+            jahr, steuer = self._summen[~zeile]
+            if role == Qt.ItemDataRole.DisplayRole:
+                if col == 0:
+                    return f"Summe {jahr}"
+                if col == 9:
+                    return _fmt.euro(steuer)
+                return ""
+            if role == Qt.ItemDataRole.FontRole and col in (0, 9):
+                return self._fett
+            if role == Qt.ItemDataRole.BackgroundRole:
+                return self._zwischensummen_farbe
+            return None
+
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        e = self._ergebnisse[zeile]
+        if col == 0:
+            return str(e.jahr)
+        if col == 1:
+            return self._namen[zeile]
+        if col == 2:
+            return self._isins[zeile]
+        if col == 7:
+            return _fmt.percent(e.teilfreistellung_satz)
+        return _fmt.euro(getattr(e, _BETRAG_SPALTEN[col]))
 
 
 class VorabpauschaleTab(QWidget):
@@ -34,6 +188,10 @@ class VorabpauschaleTab(QWidget):
         self.main_window = main_window
         self.data: PortfolioData | None = None
         self._ergebnisse: list[VorabpauschaleErgebnis] = []
+        # Hochrechnung des laufenden Jahres (bleibt bei reinen Kursupdates erhalten)
+        self._prognose: VorabpauschalePrognose | None = None
+        self._prognose_transactions: list | None = None
+        self._prognose_kurse_offen = False
         self._setup_ui()
 
     def _setup_ui(self):
@@ -44,6 +202,12 @@ class VorabpauschaleTab(QWidget):
         btn_calc = QPushButton("Berechnen")
         btn_calc.clicked.connect(self._calculate)
         top_layout.addWidget(btn_calc)
+        self.prognose_check = QCheckBox("Prognose laufendes Jahr")
+        self.prognose_check.setToolTip(
+            "Schätzt die Vorabpauschale des laufenden Jahres mit dem letzten Kurs"
+        )
+        self.prognose_check.toggled.connect(lambda _checked: self._calculate())
+        top_layout.addWidget(self.prognose_check)
         top_layout.addStretch()
         layout.addLayout(top_layout)
 
@@ -52,18 +216,17 @@ class VorabpauschaleTab(QWidget):
         self.warning_label.setStyleSheet("color: orange; font-weight: bold;")
         layout.addWidget(self.warning_label)
 
-        # Tabelle
-        self.table = QTableWidget()
+        # Tabelle (Zeilen werden vom Modell bei Bedarf erzeugt)
+        self.model = VorabpauschaleModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.setAlternatingRowColors(False)
-        self.table.setColumnCount(10)
-        self.table.setHorizontalHeaderLabels([
-            "Jahr", "Wertpapier", "ISIN", "Wert 01.01.", "Wert 31.12.",
-            "Basisertrag", "Vorabpauschale", "Teilfreistellung",
-            "Steuerpflichtig", "Steuer",
-        ])
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.table.horizontalHeader().setSectionResizeMode(
             1, QHeaderView.ResizeMode.Stretch
         )
+        # Feste Zeilenhöhe: keine Messung aller Zeilen beim Scrollen
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
         layout.addWidget(self.table)
 
         # Summe
@@ -73,176 +236,140 @@ class VorabpauschaleTab(QWidget):
 
     def update_data(self, data: PortfolioData):
         self.data = data
+        if self._prognose is None:
+            return
+        if data.transactions is self._prognose_transactions and self._prognose.ist_aktuell():
+            # Gleiche Bestände und Parameter: nur neue Kurse übernehmen (bei
+            # der nächsten Berechnung im Worker-Thread)
+            self._prognose_kurse_offen = True
+        else:
+            self._prognose = None
+            self._prognose_transactions = None
+
+    def _get_prognose(
+        self,
+        data: PortfolioData,
+        prognose: VorabpauschalePrognose | None,
+        kurse_offen: bool,
+    ) -> VorabpauschalePrognose:
+        """Prognose des laufenden Jahres (läuft im Worker-Thread).
+
+        Verändert keinen Zustand des Tabs: neue Kurse werden auf einer Kopie
+        übernommen, das Ergebnis setzt erst _on_ergebnis im GUI-Thread.
+        """
+        if prognose is None or not prognose.ist_aktuell():
+            return VorabpauschalePrognose(
+                self.main_window.fifo_ledger.positionen(),
+                {s.uuid: s for s in data.securities},
+                build_kurse_map(data.kurse),
+                data.transactions,
+            )
+        if kurse_offen:
+            prognose = prognose.kopie()
+            prognose.aktualisiere_kurse(data.kurse)
+        return prognose
 
-    def _get_available_years(self) -> list[int]:
+    def _get_available_years(self, data: PortfolioData) -> list[int]:
         """Ermittle alle Jahre, für die Kursdaten vorhanden sind."""
-        if not self.data:
-            return []
         years: set[int] = set()
-        for k in self.data.kurse:
+        for k in data.kurse:
             years.add(k.datum.year)
         return sorted(years, reverse=True)
 
     def _calculate(self):
         if not self.data:
             return
+        data = self.data
+        mit_prognose = self.prognose_check.isChecked()
+        # Zustand im GUI-Thread lesen, der Worker bekommt nur Referenzen
+        prognose = self._prognose
+        kurse_offen = self._prognose_kurse_offen
+        self.main_window.runner.starte(
+            "vorabpauschale",
+            lambda token: self._berechne(data, mit_prognose, prognose, kurse_offen, token),
+            lambda ergebnis: self._on_ergebnis(data, ergebnis),
+            text="Berechne Vorabpauschalen…",
+        )
 
-        kurse_map = build_kurse_map(self.data.kurse)
-        available_years = self._get_available_years()
+    def _berechne(
+        self,
+        data: PortfolioData,
+        mit_prognose: bool,
+        prognose: VorabpauschalePrognose | None,
+        kurse_offen: bool,
+        token: AufgabenToken,
+    ) -> tuple[list[VorabpauschaleErgebnis], list[str], VorabpauschalePrognose | None]:
+        """Vorabpauschalen aller Jahre berechnen (läuft im Worker-Thread)."""
+        kurse_map = build_kurse_map(data.kurse)
+        available_years = self._get_available_years(data)
 
         # Warnungen für Jahre mit negativem Basiszins sammeln
         negative_years: list[str] = []
 
-        self._ergebnisse = []
+        jahre: list[int] = []
+        kontexte = {}
         for jahr in available_years:
-            try:
-                basiszins = get_param("basiszins_vorabpauschale", jahr)
-            except ValueError:
+            ctx = get_tax_context(jahr)
+            basiszins = ctx.basiszins
+            if basiszins is None:
                 continue
+            jahre.append(jahr)
+            kontexte[jahr] = ctx
 
             if basiszins < 0:
                 negative_years.append(f"{jahr} ({basiszins})")
 
-            for sec in self.data.securities:
-                sec_kurse = kurse_map.get(sec.uuid, {})
-
-                wert_anfang = find_nearest_kurs(sec_kurse, date(jahr, 1, 1))
-                wert_ende = find_nearest_kurs(sec_kurse, date(jahr, 12, 31))
-
-                if wert_anfang is None or wert_ende is None:
-                    continue
-
-                # Ausschüttungen im Jahr
-                ausschuettungen = Decimal("0")
-                for tx in self.data.transactions:
-                    if (
-                        tx.security_uuid == sec.uuid
-                        and tx.typ == TransaktionsTyp.DIVIDENDE
-                        and tx.datum.year == jahr
-                    ):
-                        ausschuettungen += tx.gesamtbetrag
-
-                try:
-                    erg = berechne_vorabpauschale(
-                        security=sec,
-                        jahr=jahr,
-                        wert_anfang=wert_anfang,
-                        wert_ende=wert_ende,
-                        ausschuettungen=ausschuettungen,
+        # Ausschüttungen je (Wertpapier, Jahr) in einem Durchlauf
+        ausschuettungen = ausschuettungen_je_jahr(data.transactions)
+        token.pruefe()
+        # Ungültige Zeilen (z.B. Fondstyp ohne Teilfreistellung) werden
+        # einzeln übersprungen
+        ergebnisse = berechne_mehrjahresuebersicht(
+            data.securities, jahre, kurse_map, ausschuettungen, kontexte
+        )
+
+        hinweise: list[str] = []
+        if mit_prognose:
+            token.fortschritt("Hochrechnung des laufenden Jahres…")
+            prognose = self._get_prognose(data, prognose, kurse_offen)
+            # Jahre mit Kurs zum 31.12. sind bereits exakt berechnet
+            if not any(e.jahr == prognose.jahr for e in ergebnisse):
+                # Je Stück wie die übrigen Zeilen, sonst wäre die Gesamtsumme gemischt
+                prognosen = prognose.ergebnisse_pro_stueck()
+                ergebnisse.extend(prognosen)
+                if prognosen:
+                    hinweise.append(
+                        f"{prognose.jahr}: Prognose auf Basis des letzten Kurses"
                     )
-                    self._ergebnisse.append(erg)
-                except ValueError:
-                    continue
 
         if negative_years:
-            self.warning_label.setText(
+            hinweise.append(
                 "Negativer Basiszins (keine VP fällig): "
                 + ", ".join(negative_years)
             )
-        else:
-            self.warning_label.setText("")
-
+        return ergebnisse, hinweise, prognose if mit_prognose else None
+
+    def _on_ergebnis(
+        self,
+        data: PortfolioData,
+        ergebnis: tuple[list[VorabpauschaleErgebnis], list[str], VorabpauschalePrognose | None],
+    ):
+        self._ergebnisse, hinweise, prognose = ergebnis
+        # Prognose nur übernehmen, wenn sie zu den aktuellen Daten gehört
+        if prognose is not None and data is self.data:
+            self._prognose = prognose
+            self._prognose_transactions = data.transactions
+            self._prognose_kurse_offen = False
+        self.warning_label.setText("\n".join(hinweise))
         self._update_table()
 
     def _update_table(self):
         sec_map = {}
         if self.data:
             sec_map = {s.uuid: s for s in self.data.securities}
-
-        # Sortierung: Jahr DESC, Wertpapier-Name ASC
-        def sort_key(e: VorabpauschaleErgebnis):
-            sec = sec_map.get(e.security_uuid)
-            name = sec.name if sec else e.security_uuid
-            return (-e.jahr, name.lower())
-
-        sorted_ergebnisse = sorted(self._ergebnisse, key=sort_key)
-
-        # Ergebnisse nach Jahr gruppieren für Zwischensummen
-        jahre_in_order: list[int] = []
-        for e in sorted_ergebnisse:
-            if not jahre_in_order or jahre_in_order[-1] != e.jahr:
-                jahre_in_order.append(e.jahr)
-
-        # Zähle Zeilen: Ergebnisse + Zwischensummen pro Jahr
-        row_count = len(sorted_ergebnisse) + len(jahre_in_order)
-        self.table.setRowCount(row_count)
-
-        steuer_gesamt = Decimal("0")
-        row = 0
-        current_jahr = None
-        jahr_steuer = Decimal("0")
-
-        for e in sorted_ergebnisse:
-            # Zwischensumme für vorheriges Jahr einfügen
-            if current_jahr is not None and e.jahr != current_jahr:
-                self._insert_subtotal_row(row, current_jahr, jahr_steuer)
-                row += 1
-                jahr_steuer = Decimal("0")
-
-            current_jahr = e.jahr
-            sec = sec_map.get(e.security_uuid)
-            name = sec.name if sec else e.security_uuid
-            isin = sec.isin if sec else ""
-
-            items = [
-                str(e.jahr),
-                name,
-                isin or "",
-                _fmt.euro(e.wert_jahresanfang),
-                _fmt.euro(e.wert_jahresende),
-                _fmt.euro(e.basisertrag),
-                _fmt.euro(e.vorabpauschale_brutto),
-                _fmt.percent(e.teilfreistellung_satz),
-                _fmt.euro(e.vorabpauschale_steuerpflichtig),
-                _fmt.euro(e.steuer),
-            ]
-            for j, text in enumerate(items):
-                item = QTableWidgetItem(text)
-                item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-                if j >= 3:
-                    item.setTextAlignment(
-                        Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
-                    )
-                self.table.setItem(row, j, item)
-
-            jahr_steuer += e.steuer
-            steuer_gesamt += e.steuer
-            row += 1
-
-        # Letzte Zwischensumme
-        if current_jahr is not None:
-            self._insert_subtotal_row(row, current_jahr, jahr_steuer)
-
-        self.sum_label.setText(f"Steuer gesamt: {_fmt.euro(steuer_gesamt)}")
-
-    def _insert_subtotal_row(self, row: int, jahr: int, steuer: Decimal):
-        """Fügt eine fett formatierte Zwischensummen-Zeile ein."""
-        base = self.palette().base().color()
-        # Subtile Abdunklung/Aufhellung je nach Theme-Helligkeit
-        if base.lightness() > 128:
-            bg_color = base.darker(110)
-        else:
-            bg_color = base.lighter(140)
-        bold_font_items = [
-            (0, f"Summe {jahr}"),
-            (9, _fmt.euro(steuer)),
-        ]
-        for col in range(self.table.columnCount()):
-            item = QTableWidgetItem("")
-            item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-            item.setBackground(bg_color)
-            self.table.setItem(row, col, item)
-
-        for col, text in bold_font_items:
-            item = self.table.item(row, col)
-            item.setText(text)
-            font = item.font()
-            font.setBold(True)
-            item.setFont(font)
-            if col >= 3:
-                item.setTextAlignment(
-                    Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
-                )
+        self.model.setze_zwischensummen_farbe(_zwischensummen_farbe(self.palette()))
+        self.model.setze_ergebnisse(self._ergebnisse, sec_map)
+        self.sum_label.setText(f"Steuer gesamt: {_fmt.euro(self.model.steuer_gesamt)}")
 
     def export_csv(self):
         if not self._ergebnisse:
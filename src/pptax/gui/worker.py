@@ -0,0 +1,180 @@
+"""Hintergrund-Ausführung von Parser- und Engine-Aufrufen.
+
+Alle Aufgaben laufen nacheinander in einem eigenen Worker-Thread, damit
+gemeinsam genutzte Zustände (FifoLedger, VP-Speicher, Steuerparameter)
+nie gleichzeitig verändert werden. Steuerparameter liest auch der
+GUI-Thread (z.B. get_tax_context); Schichtwechsel und Caches schützt
+tax_params.parameter_sperre. Je Schlüssel (z.B. "freibetrag") ist
+höchstens eine Aufgabe aktuell: eine neue Aufgabe bricht die vorherige ab,
+deren Ergebnis wird verworfen. Der Abbruch ist kooperativ; Aufgaben prüfen
+ihr Token zwischen den Rechenschritten.
+"""
+
+import threading
+from itertools import count
+from typing import Any, Callable
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtWidgets import QProgressBar, QStatusBar
+
+
+class Abbruch(Exception):
+    """Die Aufgabe wurde abgebrochen."""
+
+
+class AufgabenToken:
+    """Abbruch-Flag und Fortschrittsmeldung einer laufenden Aufgabe."""
+
+    def __init__(self, aufgabe_id: int, signale: "_Signale"):
+        self._id = aufgabe_id
+        self._signale = signale
+        self._abgebrochen = threading.Event()
+
+    def abbrechen(self) -> None:
+        self._abgebrochen.set()
+
+    def abgebrochen(self) -> bool:
+        return self._abgebrochen.is_set()
+
+    def pruefe(self) -> None:
+        """Beende die Aufgabe mit Abbruch, falls sie abgebrochen wurde."""
+        if self._abgebrochen.is_set():
+            raise Abbruch()
+
+    def fortschritt(self, text: str) -> None:
+        """Fortschritt an die Statusleiste melden (und Abbruch prüfen)."""
+        self.pruefe()
+        self._signale.fortschritt.emit(self._id, text)
+
+
+class _Signale(QObject):
+    fertig = pyqtSignal(int, object)
+    fehler = pyqtSignal(int, object)
+    abgebrochen = pyqtSignal(int)
+    fortschritt = pyqtSignal(int, str)
+
+
+class _Aufgabe(QRunnable):
+    def __init__(self, aufgabe_id: int, fn: Callable, token: AufgabenToken, signale: _Signale):
+        super().__init__()
+        self._id = aufgabe_id
+        self._fn = fn
+        self._token = token
+        self._signale = signale
+
+    def run(self):
+        try:
+            # Bereits vor dem Start abgebrochene Aufgaben nicht ausführen
+            self._token.pruefe()
+            ergebnis = self._fn(self._token)
+        except Abbruch:
+            self._signale.abgebrochen.emit(self._id)
+        except Exception as e:
+            self._signale.fehler.emit(self._id, e)
+        else:
+            self._signale.fertig.emit(self._id, ergebnis)
+
+
+class AufgabenRunner(QObject):
+    """Startet Aufgaben im Hintergrund und liefert Ergebnisse im GUI-Thread."""
+
+    def __init__(self, status_bar: QStatusBar, parent: QObject | None = None):
+        super().__init__(parent)
+        self._status_bar = status_bar
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._ids = count(1)
+        self._aktuell: dict[str, int] = {}
+        self._laufend: dict[int, tuple[str, AufgabenToken, Callable, Callable | None]] = {}
+        # Statusmeldung vor Beginn der Aufgaben, wird danach wiederhergestellt
+        self._status_vorher = ""
+
+        self._signale = _Signale(self)
+        self._signale.fertig.connect(self._on_fertig)
+        self._signale.fehler.connect(self._on_fehler)
+        self._signale.abgebrochen.connect(self._on_abgebrochen)
+        self._signale.fortschritt.connect(self._on_fortschritt)
+
+        self._progress = QProgressBar()
+        self._progress.setRange(0, 0)  # Unbestimmter Fortschritt
+        self._progress.setMaximumWidth(120)
+        self._progress.hide()
+        status_bar.addPermanentWidget(self._progress)
+
+    def starte(
+        self,
+        schluessel: str,
+        fn: Callable[[AufgabenToken], Any],
+        on_fertig: Callable[[Any], None],
+        on_fehler: Callable[[Exception], None] | None = None,
+        text: str = "Berechne…",
+    ) -> int:
+        """Starte fn(token) im Hintergrund; eine laufende Aufgabe mit
+        demselben Schlüssel wird abgebrochen.
+
+        on_fertig bzw. on_fehler werden im GUI-Thread aufgerufen, aber nur,
+        wenn die Aufgabe dann noch die aktuelle ihres Schlüssels ist.
+        """
+        self.abbrechen(schluessel)
+        if not self._laufend:
+            self._status_vorher = self._status_bar.currentMessage()
+        aufgabe_id = next(self._ids)
+        token = AufgabenToken(aufgabe_id, self._signale)
+        self._aktuell[schluessel] = aufgabe_id
+        self._laufend[aufgabe_id] = (schluessel, token, on_fertig, on_fehler)
+        self._pool.start(_Aufgabe(aufgabe_id, fn, token, self._signale))
+        self._status_bar.showMessage(text)
+        self._progress.show()
+        return aufgabe_id
+
+    def abbrechen(self, schluessel: str | None = None) -> None:
+        """Aufgabe eines Schlüssels (None = alle) abbrechen."""
+        for schl, token, _, _ in self._laufend.values():
+            if schluessel is None or schl == schluessel:
+                token.abbrechen()
+        if schluessel is None:
+            self._aktuell.clear()
+        else:
+            self._aktuell.pop(schluessel, None)
+
+    def warte(self) -> None:
+        """Blockierend auf alle gestarteten Aufgaben warten (z.B. beim Beenden)."""
+        self._pool.waitForDone()
+
+    def _beende(self, aufgabe_id: int):
+        """Aufgabe austragen; liefert die Callbacks, wenn das Ergebnis gilt."""
+        eintrag = self._laufend.pop(aufgabe_id, None)
+        if not self._laufend:
+            self._progress.hide()
+        if eintrag is None:
+            return None
+        schluessel, token, on_fertig, on_fehler = eintrag
+        if token.abgebrochen() or self._aktuell.get(schluessel) != aufgabe_id:
+            return None  # Veraltetes Ergebnis verwerfen
+        del self._aktuell[schluessel]
+        return on_fertig, on_fehler
+
+    def _on_fertig(self, aufgabe_id: int, ergebnis: object):
+        callbacks = self._beende(aufgabe_id)
+        if callbacks is not None:
+            if not self._laufend:
+                self._status_bar.showMessage(self._status_vorher)
+            callbacks[0](ergebnis)
+
+    def _on_fehler(self, aufgabe_id: int, fehler: object):
+        callbacks = self._beende(aufgabe_id)
+        if callbacks is None:
+            return
+        if callbacks[1] is not None:
+            callbacks[1](fehler)
+        else:
+            self._status_bar.showMessage(f"Fehler bei der Berechnung: {fehler}")
+
+    def _on_abgebrochen(self, aufgabe_id: int):
+        self._beende(aufgabe_id)
+        if not self._laufend:
+            self._status_bar.showMessage("Berechnung abgebrochen")
+
+    def _on_fortschritt(self, aufgabe_id: int, text: str):
+        if aufgabe_id in self._laufend:
+            self._status_bar.showMessage(text)
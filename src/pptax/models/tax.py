@@ -37,6 +37,16 @@ class VerkauftePosition:
     vorabpauschalen_angerechnet: Decimal
 
 
+@dataclass
+class VerkaufsSimulation:
+    """Ergebnis eines simulierten FIFO-Verkaufs einer Stückzahl."""
+
+    stuecke: Decimal
+    gewinn_brutto: Decimal
+    vorabpauschalen_angerechnet: Decimal
+    gewinn_steuerpflichtig: Decimal
+
+
 @dataclass
 class VerkaufsVorschlag:
     """Ein konkreter Verkaufsvorschlag."""
@@ -90,3 +100,40 @@ class VerlustverrechnungsErgebnis:
     verrechnet_aktien: Decimal = Decimal("0")
     vortrag_allgemein: Decimal = Decimal("0")
     vortrag_aktien: Decimal = Decimal("0")
+
+
+@dataclass
+class SimulationsErgebnis:
+    """Perzentile einer Monte-Carlo-Simulation künftiger Steuerlasten."""
+
+    anzahl_pfade: int
+    perzentile: tuple[int, ...]
+    # jahr -> perzentil -> Summe über alle Wertpapiere
+    vorabpauschale: dict[int, dict[int, Decimal]] = field(default_factory=dict)
+    vp_steuer: dict[int, dict[int, Decimal]] = field(default_factory=dict)
+    # perzentil -> Steuer bei Verkauf aller Bestände am Ende des letzten Jahres
+    liquidationssteuer: dict[int, Decimal] = field(default_factory=dict)
+
+
+@dataclass
+class FreibetragJahresplan:
+    """Verkauf und sofortiger Rückkauf in einem Jahr des Mehrjahresplans."""
+
+    jahr: int
+    freibetrag_verfuegbar: Decimal
+    freibetrag_genutzt: Decimal
+    kosten: Decimal = Decimal("0")
+    verkaeufe: list[VerkaufsVorschlag] = field(default_factory=list)
+
+
+@dataclass
+class FreibetragMehrjahresPlan:
+    """Plan zum Ausnutzen des Sparerpauschbetrags über mehrere Jahre."""
+
+    start_jahr: int
+    jahre: list[FreibetragJahresplan] = field(default_factory=list)
+    # Steuer bei Verkauf aller Bestände am Ende des letzten Jahres
+    latente_steuer_ohne_plan: Decimal = Decimal("0")
+    latente_steuer_mit_plan: Decimal = Decimal("0")
+    kosten_gesamt: Decimal = Decimal("0")
+    steuerersparnis: Decimal = Decimal("0")
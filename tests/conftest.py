@@ -1,6 +1,7 @@
-"""Shared pytest fixtures."""
+"""Shared pytest fixtures und Hilfsfunktionen der FIFO-Tests."""
 
-from datetime import date
+import random
+from datetime import date, timedelta
 from decimal import Decimal
 
 import pytest
@@ -13,6 +14,25 @@ from pptax.models.portfolio import (
     FondsTyp,
     HistorischerKurs,
 )
+from pptax.engine.fifo import FifoBestand
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="Laufzeit-Benchmarks ausführen (auf ausgelasteten Rechnern unzuverlässig)",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    ueberspringen = pytest.mark.skip(reason="Benchmark, nur mit --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(ueberspringen)
 
 
 @pytest.fixture
@@ -66,3 +86,60 @@ def sample_fifo_position():
         einstandskurs=Decimal("95.00"),
         security_uuid="sec-001",
     )
+
+
+def make_tx(
+    datum, typ, stuecke, kurs="50", uuid="sec-001", betrag=None, depot=None
+) -> Transaction:
+    """Transaktion mit Gesamtbetrag Stücke × Kurs (sofern kein Betrag angegeben)."""
+    return Transaction(
+        datum=datum,
+        typ=typ,
+        security_uuid=uuid,
+        stuecke=Decimal(stuecke),
+        kurs=Decimal(kurs),
+        gesamtbetrag=betrag if betrag is not None else Decimal(stuecke) * Decimal(kurs),
+        portfolio_uuid=depot,
+    )
+
+
+def zufallsstrom(
+    rng: random.Random,
+    anzahl: int,
+    uuids: tuple[str, ...] = ("sec-001",),
+    start: date = date(2015, 1, 1),
+    mit_ein_auslieferungen: bool = False,
+) -> list[Transaction]:
+    """Zufälliger Kauf-/Verkaufsstrom inkl. nicht gedeckter Verkäufe."""
+    kauf_typen = [TransaktionsTyp.KAUF]
+    verkauf_typen = [TransaktionsTyp.VERKAUF]
+    if mit_ein_auslieferungen:
+        kauf_typen.append(TransaktionsTyp.EINLIEFERUNG)
+        verkauf_typen.append(TransaktionsTyp.AUSLIEFERUNG)
+    datum = start
+    txs = []
+    for _ in range(anzahl):
+        datum += timedelta(days=rng.randint(1, 40))
+        uuid = rng.choice(uuids)
+        kurs = str(Decimal(rng.randint(1000, 20000)) / 100)
+        if rng.random() < 0.6:
+            typ = rng.choice(kauf_typen)
+            stuecke = str(Decimal(rng.randint(0, 5000)) / 100)
+        else:
+            typ = rng.choice(verkauf_typen)
+            stuecke = str(Decimal(rng.randint(0, 8000)) / 100)
+        txs.append(make_tx(datum, typ, stuecke, kurs, uuid))
+    return txs
+
+
+def lots(fifo: FifoBestand) -> list[tuple]:
+    """Offene Lots als (Kaufdatum, Stücke, Einstandskurs, kumulierte VP)."""
+    return [
+        (l.kaufdatum, l.stuecke, l.einstandskurs, l.vorabpauschalen_kumuliert)
+        for l in fifo.bestand()
+    ]
+
+
+def stand(positionen: dict[str, FifoBestand]) -> dict[str, list[tuple]]:
+    """Offene Lots aller Bestände je Wertpapier."""
+    return {uuid: lots(fifo) for uuid, fifo in positionen.items()}
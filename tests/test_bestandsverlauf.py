@@ -0,0 +1,46 @@
+"""Tests für den Bestandsverlauf je Jahresende."""
+
+import random
+from datetime import date
+from decimal import Decimal
+
+from pptax.engine.bestandsverlauf import Bestandsverlauf
+from pptax.engine.fifo_ledger import FifoLedger
+from pptax.models.portfolio import TransaktionsTyp
+from tests.conftest import make_tx, zufallsstrom
+
+
+class TestBestandsverlauf:
+    def test_lot_stuecke_je_jahr(self):
+        verlauf = Bestandsverlauf([
+            make_tx(date(2020, 3, 1), TransaktionsTyp.KAUF, "10"),
+            make_tx(date(2021, 3, 1), TransaktionsTyp.KAUF, "20"),
+            make_tx(date(2023, 5, 1), TransaktionsTyp.VERKAUF, "15"),
+        ])
+        assert verlauf.gesamtstuecke(2019) == Decimal("0")
+        assert verlauf.gesamtstuecke(2020) == Decimal("10")
+        assert verlauf.gesamtstuecke(2022) == Decimal("30")
+        assert verlauf.gesamtstuecke(2030) == Decimal("15")
+        assert [verlauf.lot_stuecke(i, 2020) for i in range(2)] == [Decimal("10"), 0]
+        assert [verlauf.lot_stuecke(i, 2022) for i in range(2)] == [Decimal("10"), Decimal("20")]
+        assert [verlauf.lot_stuecke(i, 2023) for i in range(2)] == [0, Decimal("15")]
+        assert verlauf.anzahl_lots(2023) == 2
+
+    def test_identisch_mit_ledger(self):
+        txs = zufallsstrom(random.Random(8), 300, start=date(2012, 1, 1))
+
+        verlauf = Bestandsverlauf(txs)
+        ledger = FifoLedger(txs)
+        for jahr in range(2012, 2040):
+            fifo = ledger.bestand("sec-001", jahr)
+            assert verlauf.gesamtstuecke(jahr) == fifo.gesamtstuecke()
+            anzahl = verlauf.anzahl_lots(jahr)
+            offen = [
+                verlauf.lot_stuecke(nr, jahr)
+                for nr in range(anzahl - fifo.anzahl_lots(), anzahl)
+            ]
+            assert offen == [l.stuecke for l in fifo.bestand()]
+            assert all(
+                verlauf.lot_stuecke(nr, jahr) == 0
+                for nr in range(anzahl - fifo.anzahl_lots())
+            )
@@ -1,5 +1,6 @@
 """Tests für FIFO-Bestandsführung."""
 
+import time
 from datetime import date
 from decimal import Decimal
 
@@ -105,3 +106,243 @@ class TestFifoBestand:
         lots = fifo.bestand()
         assert lots[0].vorabpauschalen_kumuliert == Decimal("30.00")
         assert lots[1].vorabpauschalen_kumuliert == Decimal("10.00")
+
+    def test_lot_index_nach_verkauf(self):
+        """Lot-Indizes beziehen sich auf den aktuellen Bestand."""
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2021, 1, 1), Decimal("10"), Decimal("40.00"))
+        fifo.kauf(date(2022, 1, 1), Decimal("10"), Decimal("50.00"))
+        fifo.kauf(date(2023, 1, 1), Decimal("10"), Decimal("60.00"))
+        fifo.verkauf(date(2023, 6, 1), Decimal("15"), Decimal("70.00"))
+
+        fifo.add_vorabpauschale_to_lot(1, Decimal("5.00"))
+        lots = fifo.bestand()
+        assert len(lots) == fifo.anzahl_lots() == 2
+        assert lots[0].stuecke == Decimal("5")
+        assert lots[1].einstandskurs == Decimal("60.00")
+        assert lots[1].vorabpauschalen_kumuliert == Decimal("5.00")
+        with pytest.raises(IndexError):
+            fifo.add_vorabpauschale_to_lot(2, Decimal("1.00"))
+
+    def test_laufende_summen(self):
+        """Summen über Stücke, Einstand und VP folgen Kauf, Verkauf und VP."""
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2021, 1, 1), Decimal("10"), Decimal("40.00"))
+        fifo.kauf(date(2022, 1, 1), Decimal("20"), Decimal("50.00"))
+        fifo.add_vorabpauschale_to_lot(0, Decimal("6.00"))
+        fifo.add_vorabpauschale(Decimal("3.00"))
+        assert fifo.gesamtstuecke() == Decimal("30")
+        assert fifo.einstandswert_gesamt() == Decimal("1400.00")
+        assert fifo.vorabpauschalen_gesamt() == Decimal("9.00")
+
+        fifo.verkauf(date(2023, 1, 1), Decimal("15"), Decimal("60.00"))
+        lots = fifo.bestand()
+        assert fifo.gesamtstuecke() == sum(l.stuecke for l in lots)
+        assert fifo.einstandswert_gesamt() == sum(l.stuecke * l.einstandskurs for l in lots)
+        assert fifo.vorabpauschalen_gesamt() == sum(l.vorabpauschalen_kumuliert for l in lots)
+
+        fifo.verkauf(date(2023, 2, 1), Decimal("15"), Decimal("60.00"))
+        assert fifo.gesamtstuecke() == Decimal("0")
+        assert fifo.einstandswert_gesamt() == Decimal("0")
+        assert fifo.vorabpauschalen_gesamt() == Decimal("0")
+
+
+class TestFifoSnapshot:
+    def _bestand(self) -> FifoBestand:
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2021, 1, 1), Decimal("10"), Decimal("40.00"))
+        fifo.kauf(date(2022, 1, 1), Decimal("10"), Decimal("50.00"))
+        fifo.kauf(date(2023, 1, 1), Decimal("10"), Decimal("60.00"))
+        fifo.add_vorabpauschale_to_lot(0, Decimal("4.00"))
+        return fifo
+
+    def test_verkauf_auf_snapshot_laesst_original_unveraendert(self):
+        fifo = self._bestand()
+        vorher = [(l.stuecke, l.vorabpauschalen_kumuliert) for l in fifo.bestand()]
+
+        sim = fifo.snapshot()
+        sim.verkauf(date(2024, 1, 1), Decimal("15"), Decimal("70.00"))
+
+        assert [(l.stuecke, l.vorabpauschalen_kumuliert) for l in fifo.bestand()] == vorher
+        assert fifo.gesamtstuecke() == Decimal("30")
+        assert sim.gesamtstuecke() == Decimal("15")
+        assert sim.bestand()[0].stuecke == Decimal("5")
+
+    def test_snapshot_teilt_unberuehrte_lots(self):
+        fifo = self._bestand()
+        sim = fifo.snapshot()
+        sim.verkauf(date(2024, 1, 1), Decimal("5"), Decimal("70.00"))
+        # Nur das angebrochene Kopf-Lot ist neu, die Spalten sind geteilt
+        assert sim.bestand()[0].stuecke == Decimal("5")
+        assert fifo.bestand()[0].stuecke == Decimal("10")
+        assert sim._stuecke is fifo._stuecke
+        assert sim._vp is fifo._vp
+
+    def test_viele_was_waere_wenn_verkaeufe(self):
+        fifo = self._bestand()
+        for menge in ("5", "10", "25", "30"):
+            erwartet = fifo.gewinn_bei_verkauf(Decimal(menge), Decimal("70.00"))
+            sim = fifo.snapshot()
+            positionen = sim.verkauf(date(2024, 1, 1), Decimal(menge), Decimal("70.00"))
+            assert sum(p.gewinn_brutto - p.vorabpauschalen_angerechnet for p in positionen) == erwartet
+        assert fifo.gesamtstuecke() == Decimal("30")
+        assert fifo.vorabpauschalen_gesamt() == Decimal("4.00")
+
+    def test_aenderungen_nach_snapshot_unabhaengig(self):
+        fifo = self._bestand()
+        sim = fifo.snapshot()
+
+        fifo.kauf(date(2024, 1, 1), Decimal("5"), Decimal("65.00"))
+        sim.kauf(date(2024, 2, 1), Decimal("7"), Decimal("66.00"))
+        sim.add_vorabpauschale_to_lot(2, Decimal("1.00"))
+        fifo.add_vorabpauschale(Decimal("7.00"))
+
+        assert [l.stuecke for l in fifo.bestand()][-1] == Decimal("5")
+        assert [l.stuecke for l in sim.bestand()][-1] == Decimal("7")
+        assert sim.bestand()[2].vorabpauschalen_kumuliert == Decimal("1.00")
+        assert fifo.bestand()[2].vorabpauschalen_kumuliert == Decimal("2.00")
+        assert sim.vorabpauschalen_gesamt() == Decimal("5.00")
+        assert fifo.vorabpauschalen_gesamt() == Decimal("11.00")
+
+
+class TestFifoSpaltenOperationen:
+    def _bestand(self) -> FifoBestand:
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2021, 1, 1), Decimal("10"), Decimal("40.00"))
+        fifo.kauf(date(2021, 7, 1), Decimal("10"), Decimal("50.00"))
+        fifo.kauf(date(2022, 3, 1), Decimal("10"), Decimal("60.00"))
+        fifo.add_vorabpauschale_to_lot(0, Decimal("3.00"))
+        fifo.add_vorabpauschale_to_lot(1, Decimal("2.00"))
+        return fifo
+
+    def test_verbrauche_wie_verkauf(self):
+        for menge in ("0", "4", "10", "15", "30"):
+            fifo = self._bestand()
+            sim = fifo.snapshot()
+            positionen = sim.verkauf(date(2023, 1, 1), Decimal(menge), Decimal("70"))
+            einstand, vp = fifo.verbrauche(Decimal(menge))
+            assert einstand == sum(
+                (p.stuecke * p.einstandskurs for p in positionen), Decimal("0")
+            )
+            assert vp == sum(
+                (p.vorabpauschalen_angerechnet for p in positionen), Decimal("0")
+            )
+            assert fifo.bestand() == sim.bestand()
+            assert fifo.vorabpauschalen_gesamt() == sim.vorabpauschalen_gesamt()
+
+    def test_verbrauche_zu_viel(self):
+        with pytest.raises(ValueError, match="Nicht genügend Stücke"):
+            self._bestand().verbrauche(Decimal("31"))
+
+    def test_vp_pro_stueck_vor_stichtag(self):
+        fifo = self._bestand()
+        fifo.verkauf(date(2022, 6, 1), Decimal("4"), Decimal("70"))
+        summe = fifo.add_vorabpauschale_pro_stueck(
+            Decimal("0.123"), gekauft_vor=date(2022, 1, 1), quantisierung=Decimal("0.01")
+        )
+        lots = fifo.bestand()
+        # 6 × 0,123 = 0,738 → 0,74; 10 × 0,123 = 1,23; Lot aus 2022 unberührt
+        assert summe == Decimal("1.97")
+        assert lots[0].vorabpauschalen_kumuliert == Decimal("1.80") + Decimal("0.74")
+        assert lots[1].vorabpauschalen_kumuliert == Decimal("3.23")
+        assert lots[2].vorabpauschalen_kumuliert == Decimal("0")
+        assert fifo.vorabpauschalen_gesamt() == sum(
+            l.vorabpauschalen_kumuliert for l in lots
+        )
+
+    def test_vp_pro_stueck_auf_snapshot(self):
+        fifo = self._bestand()
+        sim = fifo.snapshot()
+        sim.add_vorabpauschale_pro_stueck(Decimal("1"))
+        assert [l.vorabpauschalen_kumuliert for l in sim.bestand()] == [
+            Decimal("13.00"), Decimal("12.00"), Decimal("10"),
+        ]
+        assert fifo.vorabpauschalen_gesamt() == Decimal("5.00")
+        assert fifo.add_vorabpauschale_pro_stueck(
+            Decimal("1"), gekauft_vor=date(2020, 1, 1)
+        ) == Decimal("0")
+
+
+class TestSimuliereVerkaeufe:
+    def test_identisch_mit_gewinn_bei_verkauf(self):
+        import random
+
+        rng = random.Random(31)
+        for _ in range(20):
+            fifo = FifoBestand("sec-001")
+            for i in range(rng.randint(1, 15)):
+                fifo.kauf(
+                    date(2015 + i, 1, 1),
+                    Decimal(rng.randint(1, 3000)) / 100,
+                    Decimal(rng.randint(1000, 9000)) / 100,
+                )
+                fifo.add_vorabpauschale_to_lot(i, Decimal(rng.randint(0, 5000)) / 100)
+            teilverkauf = (fifo.gesamtstuecke() / 3).quantize(Decimal("0.01"))
+            fifo.verkauf(date(2030, 1, 1), teilverkauf, Decimal("50"))
+
+            mengen = sorted(
+                Decimal(rng.randint(0, int(fifo.gesamtstuecke() * 100))) / 100
+                for _ in range(25)
+            ) + [fifo.gesamtstuecke()]
+            kurs = Decimal(rng.randint(1000, 9000)) / 100
+            ergebnisse = fifo.simuliere_verkaeufe(mengen, kurs, Decimal("0.3"))
+
+            for menge, erg in zip(mengen, ergebnisse):
+                positionen = fifo.snapshot().verkauf(date(2030, 6, 1), menge, kurs)
+                netto = fifo.gewinn_bei_verkauf(menge, kurs)
+                assert erg.stuecke == menge
+                assert erg.gewinn_brutto == sum(
+                    (p.gewinn_brutto for p in positionen), Decimal("0")
+                )
+                assert erg.vorabpauschalen_angerechnet == sum(
+                    (p.vorabpauschalen_angerechnet for p in positionen), Decimal("0")
+                )
+                assert erg.gewinn_steuerpflichtig == netto * Decimal("0.7")
+
+    def test_ungueltige_mengen(self):
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2021, 1, 1), Decimal("10"), Decimal("40.00"))
+        with pytest.raises(ValueError, match="aufsteigend"):
+            fifo.simuliere_verkaeufe([Decimal("5"), Decimal("2")], Decimal("50"))
+        with pytest.raises(ValueError, match="Nicht genügend Stücke"):
+            fifo.simuliere_verkaeufe([Decimal("11")], Decimal("50"))
+        assert fifo.simuliere_verkaeufe([], Decimal("50")) == []
+
+
+def _sparplan_replay(jahre: int, kaeufe_pro_jahr: int) -> tuple[FifoBestand, Decimal]:
+    """Sparplan mit regelmäßigen Käufen und vierteljährlichen Teilverkäufen."""
+    fifo = FifoBestand("sec-001")
+    verkauft = Decimal("0")
+    for jahr in range(2005, 2005 + jahre):
+        for i in range(kaeufe_pro_jahr):
+            monat = i * 12 // kaeufe_pro_jahr + 1
+            fifo.kauf(date(jahr, monat, 1), Decimal("1.5"), Decimal(50 + i))
+            if (i + 1) % (kaeufe_pro_jahr // 4) == 0:
+                menge = Decimal("1.2") * (kaeufe_pro_jahr // 4)
+                fifo.verkauf(date(jahr, monat, 15), menge, Decimal("80"))
+                verkauft += menge
+    return fifo, verkauft
+
+
+class TestFifoSparplanBenchmark:
+    def test_sparplan_20_jahre_monatlich(self):
+        """20 Jahre Monatssparplan mit periodischen Verkäufen."""
+        fifo, verkauft = _sparplan_replay(jahre=20, kaeufe_pro_jahr=12)
+        gekauft = Decimal("1.5") * 240
+        assert fifo.gesamtstuecke() == gekauft - verkauft
+        assert sum(l.stuecke for l in fifo.bestand()) == fifo.gesamtstuecke()
+        # Älteste offene Lots liegen vorne
+        kaufdaten = [l.kaufdatum for l in fifo.bestand()]
+        assert kaufdaten == sorted(kaufdaten)
+
+    @pytest.mark.benchmark
+    def test_sparplan_tausende_lots_linear(self):
+        """Replay mit ~10.000 Lots bleibt linear (kein pop(0) pro Lot)."""
+        start = time.perf_counter()
+        fifo, verkauft = _sparplan_replay(jahre=20, kaeufe_pro_jahr=500)
+        dauer = time.perf_counter() - start
+
+        assert fifo.gesamtstuecke() == Decimal("1.5") * 10000 - verkauft
+        fifo.verkauf(date(2030, 1, 1), fifo.gesamtstuecke(), Decimal("90"))
+        assert fifo.anzahl_lots() == 0
+        assert dauer < 5.0
@@ -0,0 +1,220 @@
+"""Tests für den FIFO-Ledger mit Jahres-Checkpoints."""
+
+import random
+from datetime import date
+from decimal import Decimal
+
+from pptax.engine.fifo_ledger import FifoLedger
+from pptax.engine.fifo_replay import replay_fifo
+from pptax.engine.verlustverrechnung import VerlustverrechnungsManager
+from pptax.models.portfolio import FondsTyp, Security, TransaktionsTyp
+from tests.conftest import make_tx, stand, zufallsstrom
+
+UUIDS = ("sec-a", "sec-b", "sec-c")
+
+
+def _replay_positionen(txs):
+    """Referenz: kompletter Replay je Wertpapier ab dem ersten Kauf."""
+    stroeme = {}
+    for tx in sorted(txs, key=lambda t: t.datum):
+        if tx.typ == TransaktionsTyp.KAUF or tx.security_uuid in stroeme:
+            stroeme.setdefault(tx.security_uuid, []).append(tx)
+    return {uuid: replay_fifo(uuid, strom)[0] for uuid, strom in stroeme.items()}
+
+
+def _referenz(txs, bis_jahr):
+    return stand(_replay_positionen([t for t in txs if t.datum.year <= bis_jahr]))
+
+
+class TestFifoLedger:
+    def test_identisch_mit_replay(self):
+        rng = random.Random(1234)
+        txs = zufallsstrom(rng, 300, UUIDS)
+        ledger = FifoLedger(txs)
+        # Absichtlich nicht chronologisch, damit Checkpoints wiederverwendet werden
+        for jahr in [2020, 2016, 2030, 2014, 2018, 2021, 2017]:
+            assert stand(ledger.positionen(jahr)) == _referenz(txs, jahr)
+        assert stand(ledger.positionen()) == stand(_replay_positionen(txs))
+
+    def test_bestand_vor_erstem_kauf(self):
+        ledger = FifoLedger([make_tx(date(2022, 3, 1), TransaktionsTyp.KAUF, "10", "50")])
+        assert ledger.bestand("sec-001", 2021) is None
+        assert ledger.bestand("sec-unbekannt", 2022) is None
+        assert ledger.positionen(2021) == {}
+        assert ledger.bestand("sec-001", 2025).gesamtstuecke() == Decimal("10")
+
+    def test_snapshots_unabhaengig(self):
+        """Änderungen an gelieferten Beständen erreichen die Checkpoints nicht."""
+        ledger = FifoLedger([
+            make_tx(date(2020, 1, 1), TransaktionsTyp.KAUF, "10", "50"),
+            make_tx(date(2021, 1, 1), TransaktionsTyp.KAUF, "10", "60"),
+        ])
+        fifo = ledger.bestand("sec-001", 2021)
+        fifo.add_vorabpauschale_to_lot(0, Decimal("5.00"))
+        fifo.verkauf(date(2022, 1, 1), Decimal("15"), Decimal("70"))
+
+        frisch = ledger.bestand("sec-001", 2021)
+        assert frisch.gesamtstuecke() == Decimal("20")
+        assert frisch.vorabpauschalen_gesamt() == Decimal("0")
+
+    def test_checkpoints_werden_wiederverwendet(self):
+        txs = [
+            make_tx(date(2019, 1, 1), TransaktionsTyp.KAUF, "10", "50"),
+            make_tx(date(2021, 1, 1), TransaktionsTyp.VERKAUF, "4", "60"),
+            make_tx(date(2023, 1, 1), TransaktionsTyp.KAUF, "5", "70"),
+        ]
+        ledger = FifoLedger(txs)
+        ledger.positionen(2024)
+        checkpoint_2020 = ledger._checkpoints["sec-001"][2020]
+        ledger.positionen(2020)
+        assert ledger._checkpoints["sec-001"][2020] is checkpoint_2020
+
+
+class TestFifoLedgerInvalidierung:
+    def test_aenderung_verwirft_nur_spaetere_jahre(self):
+        txs = [
+            make_tx(date(2019, 1, 1), TransaktionsTyp.KAUF, "10", "50"),
+            make_tx(date(2019, 1, 1), TransaktionsTyp.KAUF, "7", "20", "sec-b"),
+            make_tx(date(2021, 1, 1), TransaktionsTyp.VERKAUF, "4", "60"),
+        ]
+        ledger = FifoLedger(txs)
+        ledger.positionen(2022)
+        checkpoint_2020 = ledger._checkpoints["sec-001"][2020]
+        checkpoint_b = ledger._checkpoints["sec-b"][2022]
+
+        neu = txs + [make_tx(date(2021, 6, 1), TransaktionsTyp.VERKAUF, "2", "65")]
+        assert ledger.setze_transaktionen(neu) == {"sec-001"}
+        assert ledger._checkpoints["sec-001"][2020] is checkpoint_2020
+        assert 2021 not in ledger._checkpoints["sec-001"]
+        assert ledger._checkpoints["sec-b"][2022] is checkpoint_b
+        assert stand(ledger.positionen(2022)) == _referenz(neu, 2022)
+
+    def test_unveraenderte_transaktionen(self):
+        rng = random.Random(7)
+        txs = zufallsstrom(rng, 50, UUIDS)
+        ledger = FifoLedger(txs)
+        ledger.positionen(2020)
+        assert ledger.setze_transaktionen(list(reversed(txs))) == set()
+        assert stand(ledger.positionen(2020)) == _referenz(txs, 2020)
+
+    def test_neues_jahr_nach_letzter_transaktion(self):
+        """Über das letzte Transaktionsjahr hinaus geteilte Checkpoints."""
+        txs = [make_tx(date(2019, 1, 1), TransaktionsTyp.KAUF, "10", "50")]
+        ledger = FifoLedger(txs)
+        assert ledger.bestand("sec-001", 2025).gesamtstuecke() == Decimal("10")
+
+        neu = txs + [make_tx(date(2023, 5, 1), TransaktionsTyp.VERKAUF, "3", "60")]
+        ledger.setze_transaktionen(neu)
+        assert ledger.bestand("sec-001", 2022).gesamtstuecke() == Decimal("10")
+        assert ledger.bestand("sec-001", 2025).gesamtstuecke() == Decimal("7")
+
+    def test_wertpapier_entfernt(self):
+        txs = [
+            make_tx(date(2019, 1, 1), TransaktionsTyp.KAUF, "10", "50"),
+            make_tx(date(2019, 1, 1), TransaktionsTyp.KAUF, "7", "20", "sec-b"),
+        ]
+        ledger = FifoLedger(txs)
+        ledger.positionen(2020)
+        assert ledger.setze_transaktionen(txs[:1]) == {"sec-b"}
+        assert list(ledger.positionen(2020)) == ["sec-001"]
+
+
+class TestRealisierteGewinne:
+    def test_identisch_mit_replay(self):
+        rng = random.Random(99)
+        txs = zufallsstrom(rng, 300, UUIDS)
+        ledger = FifoLedger(txs)
+        for uuid in UUIDS:
+            strom = sorted((t for t in txs if t.security_uuid == uuid), key=lambda t: t.datum)
+            _, positionen = replay_fifo(uuid, strom)
+            for jahr in range(2015, 2050):
+                erwartet = [p for p in positionen if p.verkaufsdatum.year == jahr]
+                assert ledger.realisiert(jahr, uuid) == erwartet
+
+    def test_filter_nach_depot(self):
+        txs = [
+            make_tx(date(2020, 1, 1), TransaktionsTyp.KAUF, "10", "50", depot="d1"),
+            make_tx(date(2021, 3, 1), TransaktionsTyp.VERKAUF, "4", "60", depot="d1"),
+            make_tx(date(2021, 5, 1), TransaktionsTyp.VERKAUF, "2", "40", depot="d2"),
+        ]
+        ledger = FifoLedger(txs)
+        assert ledger.realisierter_gewinn(2021) == Decimal("20")
+        assert ledger.realisierter_gewinn(2021, depot_uuid="d1") == Decimal("40")
+        assert ledger.realisierter_gewinn(2021, depot_uuid="d2") == Decimal("-20")
+        assert ledger.realisiert(2020) == []
+
+    def test_verkauf_in_anderes_depot_verschoben(self):
+        txs = [
+            make_tx(date(2020, 1, 1), TransaktionsTyp.KAUF, "10", "50", depot="d1"),
+            make_tx(date(2021, 3, 1), TransaktionsTyp.VERKAUF, "4", "60", depot="d1"),
+        ]
+        ledger = FifoLedger(txs)
+        assert ledger.realisierter_gewinn(2021, depot_uuid="d1") == Decimal("40")
+
+        ledger.setze_transaktionen(
+            [txs[0], make_tx(date(2021, 3, 1), TransaktionsTyp.VERKAUF, "4", "60", depot="d2")]
+        )
+        assert ledger.realisierter_gewinn(2021, depot_uuid="d1") == Decimal("0")
+        assert ledger.realisierter_gewinn(2021, depot_uuid="d2") == Decimal("40")
+
+    def test_aenderung_aktualisiert_realisierte_gewinne(self):
+        txs = [
+            make_tx(date(2020, 1, 1), TransaktionsTyp.KAUF, "10", "50"),
+            make_tx(date(2021, 3, 1), TransaktionsTyp.VERKAUF, "4", "60"),
+        ]
+        ledger = FifoLedger(txs)
+        assert ledger.realisierter_gewinn(2021) == Decimal("40")
+        ledger.setze_transaktionen(
+            txs + [make_tx(date(2021, 9, 1), TransaktionsTyp.VERKAUF, "1", "70")]
+        )
+        assert ledger.realisierter_gewinn(2021) == Decimal("60")
+
+    def test_verlustverrechnung(self):
+        """Aktienverlust nur gegen Aktiengewinn, Fondsgewinn nach TFS."""
+        txs = [
+            make_tx(date(2020, 1, 1), TransaktionsTyp.KAUF, "10", "100", "etf"),
+            make_tx(date(2020, 1, 1), TransaktionsTyp.KAUF, "10", "100", "aktie"),
+            make_tx(date(2022, 3, 1), TransaktionsTyp.VERKAUF, "10", "200", "etf"),
+            make_tx(date(2022, 3, 1), TransaktionsTyp.VERKAUF, "10", "50", "aktie"),
+        ]
+        securities = {
+            "etf": Security(uuid="etf", name="ETF", fonds_typ=FondsTyp.AKTIENFONDS),
+            "aktie": Security(uuid="aktie", name="Aktie", is_fond=False),
+        }
+        ledger = FifoLedger(txs)
+        mgr = VerlustverrechnungsManager()
+        steuerpflichtig = ledger.verrechne_verluste(2022, securities, mgr, {})
+        # 1000 Gewinn * 70 % (Aktienfonds), Aktienverlust 500 nicht verrechenbar
+        assert steuerpflichtig == Decimal("700")
+        assert mgr.get_vortrag() == (Decimal("0"), Decimal("500"))
+
+    def test_verlustverrechnung_mit_vorabpauschale(self):
+        """Die VP der Vorjahre mindert den Fondsgewinn vor der Teilfreistellung."""
+        txs = [
+            make_tx(date(2022, 6, 1), TransaktionsTyp.KAUF, "10", "100", "etf", depot="d1"),
+            make_tx(date(2024, 3, 1), TransaktionsTyp.VERKAUF, "4", "120", "etf", depot="d1"),
+            make_tx(date(2024, 4, 1), TransaktionsTyp.VERKAUF, "6", "120", "etf", depot="d2"),
+        ]
+        securities = {
+            "etf": Security(uuid="etf", name="ETF", fonds_typ=FondsTyp.AKTIENFONDS),
+        }
+        # 2023: Basiszins 2,55 % -> VP je Stück 100 × 2,55 % × 0,7 = 1,785
+        kurse_map = {"etf": {"2023-01-01": Decimal("100"), "2023-12-31": Decimal("110")}}
+        ledger = FifoLedger(txs)
+
+        positionen = ledger.realisiert_mit_vorabpauschalen(2024, securities["etf"], kurse_map)
+        assert [p.vorabpauschalen_angerechnet for p in positionen] == [
+            Decimal("7.14"), Decimal("10.71")
+        ]
+        assert [
+            p.vorabpauschalen_angerechnet
+            for p in ledger.realisiert_mit_vorabpauschalen(
+                2024, securities["etf"], kurse_map, depot_uuid="d2"
+            )
+        ] == [Decimal("10.71")]
+        # Ohne Anrechnung unverändert
+        assert ledger.realisierter_gewinn(2024) == Decimal("200")
+
+        mgr = VerlustverrechnungsManager()
+        steuerpflichtig = ledger.verrechne_verluste(2024, securities, mgr, kurse_map)
+        assert steuerpflichtig == (Decimal("200") - Decimal("17.85")) * Decimal("0.7")
@@ -0,0 +1,104 @@
+"""Tests für den parallelen FIFO-Aufbau je Wertpapier."""
+
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from pptax.engine.fifo_ledger import FifoLedger
+from pptax.engine.fifo_parallel import baue_positionen
+from pptax.engine.tax_params import parameter_override
+from pptax.engine.vp_integration import apply_vorabpauschalen
+from pptax.models.portfolio import FondsTyp, Security, TransaktionsTyp
+from tests.conftest import make_tx, stand
+
+UUIDS = ["sec-a", "sec-b", "sec-c", "sec-d"]
+
+
+def _portfolio(seed: int):
+    rng = random.Random(seed)
+    txs = []
+    datum = date(2018, 1, 1)
+    for _ in range(250):
+        datum += timedelta(days=rng.randint(1, 12))
+        uuid = rng.choice(UUIDS)
+        kurs = str(Decimal(rng.randint(5000, 15000)) / 100)
+        r = rng.random()
+        if r < 0.6:
+            txs.append(make_tx(datum, TransaktionsTyp.KAUF, rng.randint(1, 40), kurs, uuid))
+        elif r < 0.9:
+            txs.append(make_tx(datum, TransaktionsTyp.VERKAUF, rng.randint(1, 60), kurs, uuid))
+        else:
+            txs.append(make_tx(datum, TransaktionsTyp.DIVIDENDE, "0", "0", uuid, Decimal(rng.randint(1, 500))))
+    securities = {
+        uuid: Security(uuid=uuid, name=uuid, fonds_typ=FondsTyp.AKTIENFONDS)
+        for uuid in UUIDS
+    }
+    kurse_map = {
+        uuid: {
+            f"{jahr}-{monat:02d}-01": Decimal(rng.randint(5000, 15000)) / 100
+            for jahr in range(2018, 2026)
+            for monat in (1, 12)
+        }
+        for uuid in UUIDS
+    }
+    return txs, securities, kurse_map
+
+
+def _seriell_ueber_ledger(txs, securities, kurse_map, steuerjahr):
+    positionen = FifoLedger(txs).positionen(steuerjahr)
+    apply_vorabpauschalen(positionen, securities, kurse_map, txs, steuerjahr)
+    return positionen
+
+
+class TestBauePositionen:
+    def test_identisch_mit_ledger(self):
+        txs, securities, kurse_map = _portfolio(5)
+        for steuerjahr in (2021, 2024):
+            erwartet = stand(_seriell_ueber_ledger(txs, securities, kurse_map, steuerjahr))
+            assert stand(baue_positionen(txs, securities, kurse_map, steuerjahr)) == erwartet
+
+    def test_parallel_deterministisch(self):
+        txs, securities, kurse_map = _portfolio(11)
+        seriell = baue_positionen(txs, securities, kurse_map, 2025, max_workers=1)
+        parallel = baue_positionen(txs, securities, kurse_map, 2025, max_workers=3)
+        assert list(parallel) == list(seriell)
+        assert stand(parallel) == stand(seriell)
+
+    def test_parameter_overrides_im_worker(self):
+        """Overrides des Hauptprozesses gelten auch in den Worker-Prozessen."""
+        txs, securities, kurse_map = _portfolio(23)
+        with parameter_override("basiszins_vorabpauschale", 2021, 0.03):
+            seriell = baue_positionen(txs, securities, kurse_map, 2025)
+            parallel = baue_positionen(txs, securities, kurse_map, 2025, max_workers=2)
+        ohne = baue_positionen(txs, securities, kurse_map, 2025)
+        assert stand(parallel) == stand(seriell)
+        assert stand(parallel) != stand(ohne)
+
+    def test_ohne_steuerjahr_keine_vp(self):
+        txs, securities, kurse_map = _portfolio(3)
+        positionen = baue_positionen(txs, securities, kurse_map, max_workers=2)
+        assert stand(positionen) == stand(FifoLedger(txs).positionen())
+        assert all(f.vorabpauschalen_gesamt() == 0 for f in positionen.values())
+
+    def test_teilverkauf_nach_dividende(self):
+        """Dividende wird auf die am Jahresende gehaltenen Stücke verteilt,
+        nicht auf den heutigen Restbestand – seriell wie parallel."""
+        sec = Security(uuid="sec-a", name="sec-a", fonds_typ=FondsTyp.AKTIENFONDS)
+        sec_b = Security(uuid="sec-b", name="sec-b", fonds_typ=FondsTyp.AKTIENFONDS)
+        txs = []
+        for uuid in ("sec-a", "sec-b"):
+            txs += [
+                make_tx(date(2020, 1, 10), TransaktionsTyp.KAUF, "100", "50", uuid),
+                make_tx(date(2023, 6, 1), TransaktionsTyp.DIVIDENDE, "0", "0", uuid, Decimal("100")),
+                make_tx(date(2024, 6, 1), TransaktionsTyp.VERKAUF, "50", "60", uuid),
+            ]
+        kurse = {f"{j}-01-01": Decimal(50 + (j - 2020) * 10) for j in range(2020, 2026)}
+        kurse.update({f"{j}-12-31": Decimal(60 + (j - 2020) * 10) for j in range(2020, 2026)})
+        securities = {"sec-a": sec, "sec-b": sec_b}
+        kurse_map = {"sec-a": kurse, "sec-b": kurse}
+
+        erwartet = stand(_seriell_ueber_ledger(txs, securities, kurse_map, 2025))
+        seriell = baue_positionen(txs, securities, kurse_map, 2025, max_workers=1)
+        parallel = baue_positionen(txs, securities, kurse_map, 2025, max_workers=2)
+        assert stand(seriell) == erwartet
+        assert stand(parallel) == erwartet
@@ -0,0 +1,92 @@
+"""Tests für den FIFO-Replay-Kernel."""
+
+import random
+from datetime import date
+from decimal import Decimal
+
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.fifo_replay import replay_fifo, replay_verkaeufe
+from pptax.models.portfolio import TransaktionsTyp
+from tests.conftest import lots, make_tx, zufallsstrom
+
+
+def _sequentiell(transaktionen, bestand=None):
+    """Referenz: Lot für Lot über FifoBestand.verkauf."""
+    fifo = bestand.snapshot() if bestand else FifoBestand("sec-001")
+    positionen = []
+    for tx in transaktionen:
+        if tx.typ in (TransaktionsTyp.KAUF, TransaktionsTyp.EINLIEFERUNG):
+            fifo.kauf(tx.datum, tx.stuecke, tx.kurs)
+        elif tx.typ in (TransaktionsTyp.VERKAUF, TransaktionsTyp.AUSLIEFERUNG):
+            try:
+                positionen.extend(fifo.verkauf(tx.datum, tx.stuecke, tx.kurs))
+            except ValueError:
+                pass
+    return fifo, positionen
+
+
+class TestReplayFifo:
+    def test_cross_lot_verkauf(self):
+        txs = [
+            make_tx(date(2021, 1, 1), TransaktionsTyp.KAUF, "30", "40"),
+            make_tx(date(2022, 1, 1), TransaktionsTyp.KAUF, "30", "60"),
+            make_tx(date(2023, 6, 1), TransaktionsTyp.VERKAUF, "50", "70"),
+        ]
+        fifo, positionen = replay_fifo("sec-001", txs)
+        assert [p.stuecke for p in positionen] == [Decimal("30"), Decimal("20")]
+        assert [p.gewinn_brutto for p in positionen] == [Decimal("900"), Decimal("200")]
+        assert fifo.gesamtstuecke() == Decimal("10")
+
+    def test_ueberverkauf_wird_uebersprungen(self):
+        txs = [
+            make_tx(date(2021, 1, 1), TransaktionsTyp.KAUF, "10", "40"),
+            make_tx(date(2021, 6, 1), TransaktionsTyp.VERKAUF, "11", "50"),
+            make_tx(date(2021, 7, 1), TransaktionsTyp.VERKAUF, "4", "50"),
+        ]
+        fifo, positionen = replay_fifo("sec-001", txs)
+        assert len(positionen) == 1
+        assert fifo.gesamtstuecke() == Decimal("6")
+
+    def test_identisch_mit_fifobestand(self):
+        rng = random.Random(4711)
+        for _ in range(40):
+            txs = zufallsstrom(rng, rng.randint(1, 120), mit_ein_auslieferungen=True)
+            fifo_ref, pos_ref = _sequentiell(txs)
+            fifo, pos = replay_fifo("sec-001", txs)
+            assert pos == pos_ref
+            assert lots(fifo) == lots(fifo_ref)
+            assert fifo.gesamtstuecke() == fifo_ref.gesamtstuecke()
+
+    def test_ausgangsbestand_mit_vorabpauschale(self):
+        """Anteilige VP-Reduktion wie in FifoBestand.verkauf."""
+        rng = random.Random(42)
+        for _ in range(20):
+            basis = FifoBestand("sec-001")
+            for i in range(rng.randint(1, 8)):
+                basis.kauf(date(2008 + i, 1, 1), Decimal(rng.randint(1, 90)), Decimal("50"))
+                basis.add_vorabpauschale_to_lot(i, Decimal(rng.randint(0, 9999)) / 100)
+            txs = zufallsstrom(rng, rng.randint(1, 60), mit_ein_auslieferungen=True)
+
+            fifo_ref, pos_ref = _sequentiell(txs, basis)
+            fifo, pos = replay_fifo("sec-001", txs, bestand=basis)
+            assert pos == pos_ref
+            assert lots(fifo) == lots(fifo_ref)
+            assert fifo.vorabpauschalen_gesamt() == sum(
+                l.vorabpauschalen_kumuliert for l in fifo_ref.bestand()
+            )
+
+
+class TestReplayVerkaeufe:
+    def test_positionen_mit_verkaufstransaktion(self):
+        txs = [
+            make_tx(date(2021, 1, 1), TransaktionsTyp.KAUF, "30", "40"),
+            make_tx(date(2022, 1, 1), TransaktionsTyp.KAUF, "30", "60"),
+            make_tx(date(2023, 6, 1), TransaktionsTyp.VERKAUF, "50", "70"),
+            make_tx(date(2023, 7, 1), TransaktionsTyp.VERKAUF, "20", "70"),
+            make_tx(date(2023, 8, 1), TransaktionsTyp.AUSLIEFERUNG, "5", "70"),
+        ]
+        fifo, verkauft = replay_verkaeufe("sec-001", txs)
+        # Der nicht gedeckte Verkauf vom 1.7. liefert keine Position
+        assert [tx for tx, _ in verkauft] == [txs[2], txs[2], txs[4]]
+        assert [pos for _, pos in verkauft] == replay_fifo("sec-001", txs)[1]
+        assert fifo.gesamtstuecke() == Decimal("5")
@@ -1,13 +1,21 @@
 """Tests für Freibetrag-Optimierung."""
 
+import random
 from datetime import date
 from decimal import Decimal
 
 import pytest
 
 from pptax.models.portfolio import Security, FondsTyp
+from pptax.engine import freibetrag
+from pptax.engine.bestandsschutz import ist_bestandsgeschuetzt
 from pptax.engine.fifo import FifoBestand
-from pptax.engine.freibetrag import optimiere_freibetrag
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.freibetrag import (
+    FreibetragIndex,
+    optimiere_freibetrag,
+    optimiere_freibetrag_sweep,
+)
 
 
 def _make_position(uuid, kaufdatum, stuecke, kurs):
@@ -102,3 +110,234 @@ class TestFreibetragOptimierung:
         # Sonstige (TFS 0%) hat höheren stpfl. Gewinn pro Stück -> wird bevorzugt
         assert len(result.verkaufsempfehlungen) >= 1
         assert result.verkaufsempfehlungen[0].security_uuid == "s2"
+
+
+def _zaehle_aufrufe(monkeypatch, ziel, name):
+    """Ersetze ziel.name durch eine zählende Hülle; liefert den Zähler."""
+    original = getattr(ziel, name)
+    zaehler = [0]
+
+    def huelle(*args, **kwargs):
+        zaehler[0] += 1
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(ziel, name, huelle)
+    return zaehler
+
+
+def _zufallsportfolio(anzahl_lots, seed=11, wertpapiere=5):
+    rng = random.Random(seed)
+    typen = [FondsTyp.AKTIENFONDS, FondsTyp.MISCHFONDS, FondsTyp.SONSTIGE]
+    securities, positionen, kurse = {}, {}, {}
+    for nr in range(wertpapiere):
+        uuid = f"s{nr}"
+        securities[uuid] = Security(
+            uuid=uuid, name=f"Fonds {nr}", fonds_typ=typen[nr % 3], is_fond=nr != 4
+        )
+        positionen[uuid] = FifoBestand(uuid)
+        kurse[uuid] = Decimal(rng.randint(80, 160))
+    for i in range(anzahl_lots):
+        uuid = f"s{rng.randrange(wertpapiere)}"
+        jahr = rng.randint(2005, 2023)
+        # Wenige verschiedene Kurse erzeugen viele Gleichstände
+        positionen[uuid].kauf(
+            date(jahr, rng.randint(1, 12), rng.randint(1, 28)),
+            Decimal(rng.randint(1, 20)) / 10,
+            Decimal(rng.randint(50, 150)),
+        )
+    for uuid, fifo in positionen.items():
+        if fifo.anzahl_lots():
+            fifo.add_vorabpauschale(Decimal(rng.randint(0, 500)))
+    return positionen, kurse, securities
+
+
+def _referenz(positionen, kurse, securities, noch_frei):
+    """Bisheriges Verfahren: alle Kandidaten stabil sortieren, dann füllen."""
+    ctx = get_tax_context(2023)
+    kandidaten = []
+    for uuid, fifo in positionen.items():
+        tfs = ctx.teilfreistellung_satz(securities[uuid].fonds_typ)
+        for lot in fifo.bestand():
+            if ist_bestandsgeschuetzt(lot.kaufdatum, securities[uuid].is_fond):
+                continue
+            kurs = kurse[uuid]
+            g = (kurs - lot.einstandskurs - lot.vorabpauschalen_kumuliert / lot.stuecke) * (1 - tfs)
+            if g > 0:
+                kandidaten.append((uuid, lot, g))
+    kandidaten.sort(key=lambda x: x[2], reverse=True)
+    ergebnis = []
+    for uuid, lot, g in kandidaten:
+        if noch_frei <= 0:
+            break
+        stuecke = min((noch_frei / g).quantize(Decimal("0.00000001")), lot.stuecke)
+        stpfl = (stuecke * g).quantize(Decimal("0.01"))
+        ergebnis.append((uuid, lot.kaufdatum, stuecke, stpfl))
+        noch_frei -= stpfl
+    return ergebnis
+
+
+class TestFreibetragHeap:
+    @pytest.mark.parametrize("genutzt", ["0", "600", "995"])
+    def test_identisch_mit_vollstaendiger_sortierung(self, genutzt):
+        positionen, kurse, securities = _zufallsportfolio(400)
+        result = optimiere_freibetrag(
+            jahr=2023,
+            veranlagungstyp="single",
+            bereits_genutzt=Decimal(genutzt),
+            positionen=positionen,
+            aktuelle_kurse=kurse,
+            securities=securities,
+        )
+        erwartet = _referenz(
+            positionen, kurse, securities, Decimal("1000") - Decimal(genutzt)
+        )
+        assert [
+            (v.security_uuid, v.kaufdatum, v.stuecke, v.gewinn_steuerpflichtig)
+            for v in result.verkaufsempfehlungen
+        ] == erwartet
+
+    def test_100k_lots(self, monkeypatch):
+        """100.000 Lots: Kandidaten einmal sammeln, Heap nur anteilig abbauen."""
+        positionen, kurse, securities = _zufallsportfolio(100_000, wertpapiere=20)
+        entnommen = _zaehle_aufrufe(monkeypatch, freibetrag, "_vorschlag")
+        result = optimiere_freibetrag(
+            jahr=2023,
+            veranlagungstyp="joint",
+            bereits_genutzt=Decimal("0"),
+            positionen=positionen,
+            aktuelle_kurse=kurse,
+            securities=securities,
+        )
+
+        summe = sum(v.gewinn_steuerpflichtig for v in result.verkaufsempfehlungen)
+        assert Decimal("1999.99") <= summe <= Decimal("2000.01")
+        # Nur die verkauften Lots werden aus dem Heap entnommen
+        assert entnommen[0] == len(result.verkaufsempfehlungen) < 100
+
+
+def _tupel(ergebnis):
+    return (
+        ergebnis.freibetrag_bereits_genutzt,
+        ergebnis.freibetrag_verbleibend,
+        [
+            (v.security_uuid, v.kaufdatum, v.stuecke, v.gewinn_steuerpflichtig)
+            for v in ergebnis.verkaufsempfehlungen
+        ],
+    )
+
+
+class TestFreibetragSweep:
+    def test_identisch_mit_einzelberechnung(self):
+        """Jeder Wert des Sweeps entspricht einem vollen optimiere_freibetrag-Lauf."""
+        positionen, kurse, securities = _zufallsportfolio(400)
+        werte = [Decimal(c) / 100 for c in range(0, 210_000, 731)] + [
+            Decimal("1999.99"), Decimal("2000"), Decimal("2500"),
+        ]
+        sweep = optimiere_freibetrag_sweep(2023, "joint", werte, positionen, kurse, securities)
+
+        assert len(sweep) == len(werte)
+        for genutzt, ergebnis in zip(werte, sweep):
+            einzeln = optimiere_freibetrag(
+                2023, "joint", genutzt, positionen, kurse, securities
+            )
+            assert _tupel(ergebnis) == _tupel(einzeln)
+
+    def test_grenzen_an_lotsummen(self):
+        """Verbleibender Freibetrag genau auf und neben den Präfixsummen."""
+        positionen, kurse, securities = _zufallsportfolio(60, seed=3)
+        voll = optimiere_freibetrag(
+            2023, "joint", Decimal("0"), positionen, kurse, securities
+        ).verkaufsempfehlungen
+        werte = []
+        summe = Decimal("0")
+        for v in voll:
+            summe += v.gewinn_steuerpflichtig
+            for delta in ("-0.01", "0", "0.01"):
+                werte.append(Decimal("2000") - summe - Decimal(delta))
+        werte = [w for w in werte if w >= 0]
+
+        sweep = optimiere_freibetrag_sweep(2023, "joint", werte, positionen, kurse, securities)
+        for genutzt, ergebnis in zip(werte, sweep):
+            einzeln = optimiere_freibetrag(
+                2023, "joint", genutzt, positionen, kurse, securities
+            )
+            assert _tupel(ergebnis) == _tupel(einzeln)
+
+    def test_ohne_kandidaten(self):
+        (ergebnis,) = optimiere_freibetrag_sweep(2023, "single", [Decimal("0")], {}, {}, {})
+        assert ergebnis.freibetrag_verbleibend == Decimal("1000")
+        assert ergebnis.verkaufsempfehlungen == []
+
+    def test_ein_angebrochenes_lot_je_wert(self, monkeypatch):
+        """Voll verkaufte Lots kommen aus der Präfixsumme; je Wert wird nur
+        das angebrochene Lot einzeln gerechnet."""
+        positionen, kurse, securities = _zufallsportfolio(20_000, wertpapiere=10)
+        werte = [Decimal(w) for w in range(0, 2000, 10)]
+
+        einzeln = _zaehle_aufrufe(monkeypatch, freibetrag, "_vorschlag")
+        sweep = optimiere_freibetrag_sweep(2023, "joint", werte, positionen, kurse, securities)
+
+        assert len(sweep) == len(werte)
+        assert einzeln[0] <= len(werte)
+        assert sum(len(e.verkaufsempfehlungen) for e in sweep) > 5 * einzeln[0]
+
+
+class TestFreibetragIndex:
+    def test_identisch_nach_kursaenderungen(self):
+        positionen, kurse, securities = _zufallsportfolio(400)
+        index = FreibetragIndex(2023, "joint", positionen, kurse, securities)
+        rng = random.Random(5)
+        for _ in range(30):
+            uuid = rng.choice(list(kurse))
+            kurse[uuid] = Decimal(rng.randint(40, 200)) + Decimal(rng.randint(0, 99)) / 100
+            index.setze_kurs(uuid, kurs=kurse[uuid])
+            for genutzt in ("0", "1234.56"):
+                einzeln = optimiere_freibetrag(
+                    2023, "joint", Decimal(genutzt), positionen, kurse, securities
+                )
+                assert _tupel(index.optimiere(Decimal(genutzt))) == _tupel(einzeln)
+
+    def test_bestand_aktualisieren(self):
+        positionen, kurse, securities = _zufallsportfolio(100)
+        index = FreibetragIndex(2023, "single", positionen, kurse, securities)
+        positionen["s1"].kauf(date(2023, 6, 1), Decimal("5"), Decimal("20"))
+        positionen["s0"].verkauf(date(2023, 6, 1), Decimal("1"), kurse["s0"])
+        index.setze_bestand("s1", positionen["s1"])
+        index.setze_bestand("s0", positionen["s0"])
+
+        einzeln = optimiere_freibetrag(2023, "single", Decimal("0"), positionen, kurse, securities)
+        assert _tupel(index.optimiere(Decimal("0"))) == _tupel(einzeln)
+
+    def test_nur_lots_im_gewinn(self):
+        sec = Security(uuid="s1", name="ETF", fonds_typ=FondsTyp.AKTIENFONDS)
+        fifo = FifoBestand("s1")
+        for kurs in ("50", "80", "120"):
+            fifo.kauf(date(2020, 1, 1), Decimal("1"), Decimal(kurs))
+        index = FreibetragIndex(2023, "single", {"s1": fifo}, {"s1": Decimal("80")}, {"s1": sec})
+        (vorschlag,) = index.optimiere(Decimal("0")).verkaufsempfehlungen
+        assert vorschlag.einstandskurs == Decimal("50")
+        index.setze_kurs("s1", Decimal("200"))
+        vorschlaege = index.optimiere(Decimal("0")).verkaufsempfehlungen
+        assert [v.einstandskurs for v in vorschlaege] == [Decimal("50"), Decimal("80"), Decimal("120")]
+        assert index.optimiere(Decimal("1000")).verkaufsempfehlungen == []
+
+    def test_kursupdate_ohne_neusortierung(self, monkeypatch):
+        """Nach einem Kurs-Tick werden nur wenige Lot-Gewinne neu gerechnet."""
+        positionen, kurse, securities = _zufallsportfolio(100_000, wertpapiere=20)
+        index = FreibetragIndex(2023, "joint", positionen, kurse, securities)
+
+        def nicht_sammeln(*args):
+            raise AssertionError("Kandidaten neu gesammelt")
+
+        monkeypatch.setattr(freibetrag, "_kandidaten", nicht_sammeln)
+        gewinne = _zaehle_aufrufe(monkeypatch, freibetrag._LotIndex, "gewinn")
+        for _ in range(5):
+            kurse["s3"] += Decimal("0.5")
+            index.setze_kurs("s3", kurse["s3"])
+            gewinne[0] = 0
+            ergebnis = index.optimiere(Decimal("0"))
+            assert gewinne[0] < 2_000
+        monkeypatch.undo()
+
+        einzeln = optimiere_freibetrag(2023, "joint", Decimal("0"), positionen, kurse, securities)
+        assert _tupel(ergebnis) == _tupel(einzeln)
@@ -0,0 +1,154 @@
+"""Tests für die mehrjährige Freibetrag-Planung."""
+
+import random
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+import pytest
+
+from pptax.engine import freibetrag_planer
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.freibetrag_planer import plane_freibetrag_mehrjahre
+from pptax.engine.tax_context import get_tax_context
+from pptax.models.portfolio import FondsTyp, Security
+
+
+def _fifo(uuid, *lots):
+    fifo = FifoBestand(uuid)
+    for kaufdatum, stuecke, kurs in lots:
+        fifo.kauf(kaufdatum, Decimal(stuecke), Decimal(kurs))
+    return fifo
+
+
+ETF = Security(uuid="etf", name="ETF", isin="IE001", fonds_typ=FondsTyp.AKTIENFONDS)
+
+
+class TestFreibetragPlaner:
+    def test_ein_jahr_voll_ausgeschoepft(self):
+        fifo = _fifo("etf", (date(2020, 1, 1), "100", "50"))
+        plan = plane_freibetrag_mehrjahre(
+            {"etf": fifo}, {"etf": Decimal("100")}, {"etf": ETF},
+            start_jahr=2025, anzahl_jahre=1, rendite=Decimal("0"),
+        )
+        steuersatz = get_tax_context(2025).steuersatz
+
+        (jahr,) = plan.jahre
+        assert jahr.jahr == 2025
+        assert jahr.freibetrag_verfuegbar == Decimal("1000")
+        assert Decimal("999.99") <= jahr.freibetrag_genutzt <= Decimal("1000")
+        # Latent: 100 × 50 × 70 % = 3.500 € stpfl.; nach Plan 1.000 € weniger
+        assert plan.latente_steuer_ohne_plan == (Decimal("3500") * steuersatz).quantize(
+            Decimal("0.01"), ROUND_HALF_UP
+        )
+        assert abs(plan.steuerersparnis - Decimal("1000") * steuersatz) <= Decimal("0.01")
+        assert fifo.gesamtstuecke() == Decimal("100")
+        assert fifo.anzahl_lots() == 1
+
+    def test_cent_rundung_ueberschreitet_freibetrag_nicht(self):
+        """Mehrere Lots, deren kaufmännisch gerundete Gewinne 1.000,01 € ergäben."""
+        fifo = _fifo(
+            "etf",
+            (date(2020, 1, 1), "11", "65.16"),
+            (date(2020, 2, 1), "7", "51.83"),
+            (date(2020, 3, 1), "22", "37.89"),
+        )
+        plan = plane_freibetrag_mehrjahre(
+            {"etf": fifo}, {"etf": Decimal("100.37")}, {"etf": ETF},
+            start_jahr=2025, anzahl_jahre=1, rendite=Decimal("0"),
+        )
+        (jahr,) = plan.jahre
+        assert len(jahr.verkaeufe) == 3
+        assert jahr.freibetrag_genutzt == sum(v.gewinn_steuerpflichtig for v in jahr.verkaeufe)
+        assert Decimal("999.97") <= jahr.freibetrag_genutzt <= jahr.freibetrag_verfuegbar
+
+    def test_rueckkauf_am_ende_der_fifo_reihe(self):
+        """Im Folgejahr wird das nächstälteste Lot verkauft, nicht der Rückkauf."""
+        fifo = _fifo(
+            "etf",
+            (date(2020, 1, 1), "20", "50"),
+            (date(2021, 1, 1), "100", "60"),
+        )
+        plan = plane_freibetrag_mehrjahre(
+            {"etf": fifo}, {"etf": Decimal("100")}, {"etf": ETF},
+            start_jahr=2025, anzahl_jahre=2, rendite=Decimal("0"),
+        )
+        jahr1, jahr2 = plan.jahre
+        assert [v.kaufdatum for v in jahr1.verkaeufe] == [date(2020, 1, 1), date(2021, 1, 1)]
+        assert {v.kaufdatum for v in jahr2.verkaeufe} == {date(2021, 1, 1)}
+        assert abs(jahr2.freibetrag_genutzt - Decimal("1000")) <= Decimal("0.01")
+
+    def test_kosten_verhindern_kleine_verkaeufe(self):
+        fifo = _fifo("etf", (date(2020, 1, 1), "100", "99"))
+        plan = plane_freibetrag_mehrjahre(
+            {"etf": fifo}, {"etf": Decimal("100")}, {"etf": ETF},
+            start_jahr=2025, anzahl_jahre=2, rendite=Decimal("0"),
+            kosten_pro_verkauf=Decimal("25"),
+        )
+        # 70 € stpfl. Gewinn sparen ~18 € Steuer, weniger als die Kosten
+        assert all(not j.verkaeufe for j in plan.jahre)
+        assert plan.steuerersparnis == Decimal("0")
+
+    def test_bestandsschutz_bleibt_erhalten(self):
+        aktie = Security(uuid="a", name="Aktie", is_fond=False)
+        fifo = _fifo("a", (date(2005, 1, 1), "100", "10"), (date(2015, 1, 1), "10", "50"))
+        plan = plane_freibetrag_mehrjahre(
+            {"a": fifo}, {"a": Decimal("100")}, {"a": aktie},
+            start_jahr=2025, anzahl_jahre=3, rendite=Decimal("0"),
+        )
+        assert all(not j.verkaeufe for j in plan.jahre)
+
+    def test_bereits_genutzt_je_jahr(self):
+        fifo = _fifo("etf", (date(2020, 1, 1), "100", "50"))
+        plan = plane_freibetrag_mehrjahre(
+            {"etf": fifo}, {"etf": Decimal("100")}, {"etf": ETF},
+            start_jahr=2025, anzahl_jahre=2, rendite=Decimal("0"),
+            bereits_genutzt={2025: Decimal("1000"), 2026: Decimal("400")},
+        )
+        assert [j.freibetrag_verfuegbar for j in plan.jahre] == [Decimal("0"), Decimal("600")]
+        assert not plan.jahre[0].verkaeufe
+
+    def test_hunderte_lots_zehn_jahre(self, monkeypatch):
+        """300 Lots in 8 Wertpapieren über 10 Jahre; die Zahl der
+        durchgerechneten Zustände bleibt durch die Strahlbreite begrenzt."""
+        rng = random.Random(4)
+        securities, positionen, kurse = {}, {}, {}
+        for nr in range(8):
+            uuid = f"s{nr}"
+            securities[uuid] = Security(
+                uuid=uuid, name=uuid, fonds_typ=[FondsTyp.AKTIENFONDS, FondsTyp.MISCHFONDS][nr % 2]
+            )
+            positionen[uuid] = FifoBestand(uuid)
+            kurse[uuid] = Decimal(rng.randint(60, 140))
+        for _ in range(300):
+            uuid = f"s{rng.randrange(8)}"
+            positionen[uuid].kauf(
+                date(rng.randint(2010, 2024), rng.randint(1, 12), 1),
+                Decimal(rng.randint(1, 10)),
+                Decimal(rng.randint(40, 120)),
+            )
+        original = freibetrag_planer._fuehre_aus
+        zustaende = []
+
+        def zaehle(*args):
+            zustaende.append(args[2])  # Jahr
+            return original(*args)
+
+        monkeypatch.setattr(freibetrag_planer, "_fuehre_aus", zaehle)
+        plan = plane_freibetrag_mehrjahre(
+            positionen, kurse, securities, start_jahr=2025, anzahl_jahre=10,
+            veranlagungstyp="joint", kosten_pro_verkauf=Decimal("1"), strahlbreite=8,
+        )
+
+        assert [j.jahr for j in plan.jahre] == list(range(2025, 2035))
+        for j in plan.jahre:
+            assert j.freibetrag_genutzt <= j.freibetrag_verfuegbar
+        assert plan.steuerersparnis > 0
+        assert plan.latente_steuer_mit_plan < plan.latente_steuer_ohne_plan
+        assert all(f.vorabpauschalen_gesamt() == 0 for f in positionen.values())
+        # Je Jahr höchstens Strahlbreite × (nichts, gierig, je Wertpapier)
+        for jahr in range(2025, 2035):
+            assert zustaende.count(jahr) <= 8 * (2 + 8)
+
+    def test_ungueltige_parameter(self):
+        with pytest.raises(ValueError):
+            plane_freibetrag_mehrjahre({}, {}, {}, start_jahr=2025, anzahl_jahre=0)
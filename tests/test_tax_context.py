@@ -0,0 +1,138 @@
+"""Tests für den aufgelösten Steuerkontext."""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from pptax.models.portfolio import Security, FondsTyp
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.freibetrag import (
+    FreibetragIndex,
+    optimiere_freibetrag,
+    optimiere_freibetrag_sweep,
+)
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.tax_params import get_gesamtsteuersatz
+from pptax.engine.verkauf import plane_netto_verkauf
+from pptax.engine.vorabpauschale import berechne_vorabpauschale
+
+
+class TestTaxContext:
+    def test_werte_aufgeloest(self):
+        ctx = get_tax_context(2023, "joint")
+        assert ctx.sparerpauschbetrag == Decimal("2000")
+        assert ctx.basiszins == Decimal("0.0255")
+        assert ctx.vorabpauschale_faktor == Decimal("0.7")
+        assert ctx.steuersatz == get_gesamtsteuersatz(2023)
+        assert ctx.teilfreistellung_satz(FondsTyp.MISCHFONDS) == Decimal("0.15")
+
+    def test_kirchensteuer(self):
+        ctx = get_tax_context(2023, kirchensteuer=True, bundesland="bayern")
+        assert ctx.steuersatz == get_gesamtsteuersatz(2023, True, "bayern")
+
+    def test_memoisiert(self):
+        assert get_tax_context(2024, "single") is get_tax_context(2024, "single")
+        assert get_tax_context(2024, "single") is not get_tax_context(2024, "joint")
+
+    def test_unveraenderlich(self):
+        ctx = get_tax_context(2023)
+        with pytest.raises(AttributeError):
+            ctx.basiszins = Decimal("0")
+        with pytest.raises(TypeError):
+            ctx.teilfreistellung[FondsTyp.AKTIENFONDS] = Decimal("0")
+
+    def test_fehlende_parameter(self):
+        """Vor 2018 gibt es weder Basiszins noch Teilfreistellung."""
+        ctx = get_tax_context(2015)
+        assert ctx.basiszins is None
+        assert ctx.sparerpauschbetrag == Decimal("801")
+        with pytest.raises(ValueError, match="Keine Teilfreistellung"):
+            ctx.teilfreistellung_satz(FondsTyp.AKTIENFONDS)
+
+
+class TestEnginesMitContext:
+    def test_vorabpauschale_jahr_muss_passen(self):
+        sec = Security(uuid="s1", name="ETF")
+        with pytest.raises(ValueError, match="passt nicht"):
+            berechne_vorabpauschale(
+                sec, 2023, Decimal("100"), Decimal("110"), ctx=get_tax_context(2024)
+            )
+
+    def test_vorabpauschale_ohne_basiszins(self):
+        sec = Security(uuid="s1", name="ETF")
+        with pytest.raises(ValueError):
+            berechne_vorabpauschale(sec, 2017, Decimal("100"), Decimal("110"))
+
+    def test_vorabpauschale_mit_kirchensteuer_context(self):
+        sec = Security(uuid="s1", name="ETF")
+        ohne = berechne_vorabpauschale(sec, 2023, Decimal("10000"), Decimal("12000"))
+        mit = berechne_vorabpauschale(
+            sec, 2023, Decimal("10000"), Decimal("12000"),
+            ctx=get_tax_context(2023, kirchensteuer=True),
+        )
+        assert mit.vorabpauschale_steuerpflichtig == ohne.vorabpauschale_steuerpflichtig
+        assert mit.steuer > ohne.steuer
+
+    def test_freibetrag_und_verkauf_identisch(self):
+        sec = Security(uuid="s1", name="ETF", fonds_typ=FondsTyp.AKTIENFONDS)
+        fifo = FifoBestand("s1")
+        fifo.kauf(date(2020, 1, 1), Decimal("1000"), Decimal("50"))
+        args = dict(
+            positionen={"s1": fifo},
+            aktuelle_kurse={"s1": Decimal("100")},
+            securities={"s1": sec},
+        )
+        ctx = get_tax_context(2023, "single")
+
+        assert optimiere_freibetrag(
+            jahr=2023, veranlagungstyp="single", bereits_genutzt=Decimal("0"), **args
+        ) == optimiere_freibetrag(
+            jahr=2023, veranlagungstyp="single", bereits_genutzt=Decimal("0"),
+            ctx=ctx, **args
+        )
+        assert plane_netto_verkauf(
+            ziel_netto=Decimal("5000"), jahr=2023, veranlagungstyp="single",
+            freibetrag_genutzt=Decimal("0"), **args
+        ) == plane_netto_verkauf(
+            ziel_netto=Decimal("5000"), jahr=2023, veranlagungstyp="single",
+            freibetrag_genutzt=Decimal("0"), ctx=ctx, **args
+        )
+
+    @pytest.mark.parametrize(
+        "ctx, feld",
+        [
+            (get_tax_context(2024, "single"), "jahr"),
+            (get_tax_context(2023, "joint"), "veranlagungstyp"),
+            (get_tax_context(2023, "single", kirchensteuer=True), "kirchensteuer"),
+            (get_tax_context(2023, "single", True, "bayern"), "bundesland"),
+        ],
+    )
+    def test_verkauf_kontext_muss_passen(self, ctx, feld):
+        sec = Security(uuid="s1", name="ETF", fonds_typ=FondsTyp.AKTIENFONDS)
+        fifo = FifoBestand("s1")
+        fifo.kauf(date(2020, 1, 1), Decimal("1000"), Decimal("50"))
+        with pytest.raises(ValueError, match=f"passt nicht: {feld}"):
+            plane_netto_verkauf(
+                ziel_netto=Decimal("5000"), jahr=2023, veranlagungstyp="single",
+                freibetrag_genutzt=Decimal("0"), positionen={"s1": fifo},
+                aktuelle_kurse={"s1": Decimal("100")}, securities={"s1": sec},
+                kirchensteuer=feld == "bundesland", ctx=ctx,
+            )
+
+    @pytest.mark.parametrize(
+        "ctx", [get_tax_context(2024, "single"), get_tax_context(2023, "joint")]
+    )
+    def test_freibetrag_kontext_muss_passen(self, ctx):
+        with pytest.raises(ValueError, match="passt nicht"):
+            optimiere_freibetrag(2023, "single", Decimal("0"), {}, {}, {}, ctx=ctx)
+        with pytest.raises(ValueError, match="passt nicht"):
+            optimiere_freibetrag_sweep(2023, "single", [Decimal("0")], {}, {}, {}, ctx=ctx)
+        with pytest.raises(ValueError, match="passt nicht"):
+            FreibetragIndex(2023, "single", {}, {}, {}, ctx=ctx)
+
+    def test_freibetrag_ignoriert_kirchensteuer(self):
+        """Der Sparerpauschbetrag hängt nicht von der Kirchensteuer ab."""
+        ctx = get_tax_context(2023, "single", kirchensteuer=True)
+        ergebnis = optimiere_freibetrag(2023, "single", Decimal("0"), {}, {}, {}, ctx=ctx)
+        assert ergebnis.freibetrag_gesamt == Decimal("1000")
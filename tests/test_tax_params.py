@@ -1,10 +1,32 @@
 """Tests für tax_params Lookup-Logik."""
 
+import json
+import threading
 from decimal import Decimal
 
 import pytest
 
-from pptax.engine.tax_params import get_param, get_gesamtsteuersatz
+from pptax.engine import tax_context
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.tax_params import (
+    get_param,
+    get_decimal_param,
+    get_gesamtsteuersatz,
+    load_user_parameters,
+    clear_user_parameters,
+    set_parameter_override,
+    clear_parameter_overrides,
+    parameter_override,
+    parameter_version,
+    set_parameter_layers,
+)
+
+
+@pytest.fixture
+def clean_layers():
+    yield
+    clear_user_parameters()
+    clear_parameter_overrides()
 
 
 class TestGetParam:
@@ -46,6 +68,31 @@ class TestGetParam:
         assert result["sonstige"] == 0.00
 
 
+class TestGetDecimalParam:
+    def test_skalar_als_decimal(self):
+        assert get_decimal_param("basiszins_vorabpauschale", 2023) == Decimal("0.0255")
+        assert get_decimal_param("basiszins_vorabpauschale", 2021) == Decimal("-0.0045")
+
+    def test_dict_als_decimal(self):
+        result = get_decimal_param("teilfreistellung", 2023)
+        assert result["aktienfonds"] == Decimal("0.3")
+        assert result["immobilienfonds_ausland"] == Decimal("0.8")
+
+    def test_luecken_und_folgejahre(self):
+        """Jahre zwischen und nach Einträgen nutzen den Vorgängerwert."""
+        assert get_decimal_param("sparerpauschbetrag", 2015) == {
+            "single": Decimal("801"), "joint": Decimal("1602"),
+        }
+        assert get_decimal_param("sparerpauschbetrag", 2040)["single"] == Decimal("1000")
+        assert get_decimal_param("basiszins_vorabpauschale", 2040) == Decimal("0.0320")
+
+    def test_gleiche_fehler_wie_get_param(self):
+        with pytest.raises(ValueError, match="Kein gültiger Eintrag"):
+            get_decimal_param("teilfreistellung", 2017)
+        with pytest.raises(ValueError, match="Unbekannter Parameter"):
+            get_decimal_param("nonexistent_param", 2023)
+
+
 class TestGetGesamtsteuersatz:
     def test_ohne_kirchensteuer(self):
         """Standard: KESt + Soli = 26,375%."""
@@ -68,3 +115,133 @@ class TestGetGesamtsteuersatz:
         satz_default = get_gesamtsteuersatz(2023, kirchensteuer=True)
         # Bayern hat niedrigeren Kirchensteuersatz -> niedrigerer Gesamtsatz
         assert satz < satz_default
+
+
+class TestParameterSchichten:
+    def test_user_datei_ueberschreibt_jahresweise(self, tmp_path, clean_layers):
+        path = tmp_path / "params.json"
+        path.write_text(json.dumps({
+            "_meta": {"description": "test"},
+            "basiszins_vorabpauschale": {"2027": 0.0275},
+        }), encoding="utf-8")
+
+        load_user_parameters(path)
+        assert get_decimal_param("basiszins_vorabpauschale", 2027) == Decimal("0.0275")
+        # Gebündelte Jahre bleiben erhalten
+        assert get_decimal_param("basiszins_vorabpauschale", 2023) == Decimal("0.0255")
+
+        clear_user_parameters()
+        assert get_decimal_param("basiszins_vorabpauschale", 2027) == Decimal("0.0320")
+
+    def test_ungueltige_user_datei(self, tmp_path, clean_layers):
+        path = tmp_path / "params.json"
+        path.write_text(json.dumps({"basiszins_vorabpauschale": 0.01}), encoding="utf-8")
+        with pytest.raises(ValueError, match="Ungültiger Eintrag"):
+            load_user_parameters(path)
+
+    @pytest.mark.parametrize(
+        "eintrag, meldung",
+        [
+            ({"basiszins_vorabpauschale": {"2027": "viel"}}, "Ungültiger Wert 'viel'"),
+            ({"basiszins_vorabpauschale": {"2027": None}}, "Ungültiger Wert None"),
+            ({"basiszins_vorabpauschale": {"2027": True}}, "Ungültiger Wert True"),
+            ({"basiszins_vorabpauschale": {"2027": "NaN"}}, "Ungültiger Wert 'NaN'"),
+            ({"sparerpauschbetrag": {"2027": {"single": "x"}}}, r"sparerpauschbetrag 2027 .*\(single\)"),
+            ({"basiszins_vorabpauschale": {"27a": 0.01}}, "Ungültiges Jahr '27a'"),
+        ],
+    )
+    def test_ungueltige_werte_beim_laden(self, tmp_path, clean_layers, eintrag, meldung):
+        path = tmp_path / "params.json"
+        path.write_text(json.dumps({"abgeltungssteuer_satz": {"2024": 0.30}}), encoding="utf-8")
+        load_user_parameters(path)
+        path.write_text(json.dumps(eintrag), encoding="utf-8")
+        with pytest.raises(ValueError, match=meldung):
+            load_user_parameters(path)
+        # Die zuvor geladene Datei bleibt aktiv
+        assert get_decimal_param("abgeltungssteuer_satz", 2024) == Decimal("0.3")
+
+    def test_werte_als_decimal_geladen(self, tmp_path, clean_layers):
+        path = tmp_path / "params.json"
+        path.write_text(json.dumps({
+            "basiszins_vorabpauschale": {"_comment": "neu", "2027": "0.0275"},
+            "sparerpauschbetrag": {"2027": {"single": 1200, "joint": 2400}},
+        }), encoding="utf-8")
+        load_user_parameters(path)
+        assert get_param("basiszins_vorabpauschale", 2027) == Decimal("0.0275")
+        assert get_decimal_param("sparerpauschbetrag", 2027) == {
+            "single": Decimal("1200"), "joint": Decimal("2400")
+        }
+
+    def test_override_hat_vorrang(self, tmp_path, clean_layers):
+        path = tmp_path / "params.json"
+        path.write_text(json.dumps({"abgeltungssteuer_satz": {"2024": 0.30}}), encoding="utf-8")
+        load_user_parameters(path)
+        set_parameter_override("abgeltungssteuer_satz", 2024, 0.20)
+
+        assert get_decimal_param("abgeltungssteuer_satz", 2024) == Decimal("0.2")
+        assert get_gesamtsteuersatz(2024) == Decimal("0.2") + Decimal("0.2") * Decimal("0.055")
+
+        clear_parameter_overrides("abgeltungssteuer_satz")
+        assert get_decimal_param("abgeltungssteuer_satz", 2024) == Decimal("0.3")
+
+    def test_versionen_nur_bei_relevanter_aenderung(self, clean_layers):
+        gesamt = parameter_version()
+        basiszins = parameter_version("basiszins_vorabpauschale")
+        spb = parameter_version("sparerpauschbetrag")
+
+        set_parameter_override("basiszins_vorabpauschale", 2026, 0.03)
+        assert parameter_version() > gesamt
+        assert parameter_version("basiszins_vorabpauschale") > basiszins
+        assert parameter_version("sparerpauschbetrag") == spb
+
+        # Gleicher Wert erneut gesetzt -> keine Änderung
+        version = parameter_version()
+        set_parameter_override("basiszins_vorabpauschale", 2026, 0.03)
+        assert parameter_version() == version
+
+    def test_context_cache_invalidierung(self, clean_layers):
+        ctx = get_tax_context(2026)
+        assert get_tax_context(2026) is ctx
+
+        with parameter_override("basiszins_vorabpauschale", 2026, 0.04):
+            was_waere_wenn = get_tax_context(2026)
+            assert was_waere_wenn is not ctx
+            assert was_waere_wenn.basiszins == Decimal("0.04")
+
+        assert get_tax_context(2026).basiszins == Decimal("0.0320")
+
+    def test_kontext_konsistent_bei_schichtwechsel_in_anderem_thread(
+        self, monkeypatch, clean_layers
+    ):
+        """Ein Schichtwechsel während der Auflösung wartet auf deren Ende."""
+        set_parameter_layers(
+            {
+                "basiszins_vorabpauschale": {"2030": 0.01},
+                "sparerpauschbetrag": {"2030": {"single": 1100, "joint": 2200}},
+            },
+            {},
+        )
+        neu = {
+            "basiszins_vorabpauschale": {"2030": 0.02},
+            "sparerpauschbetrag": {"2030": {"single": 1200, "joint": 2400}},
+        }
+        wechsel = threading.Thread(target=set_parameter_layers, args=(neu, {}))
+        original = tax_context._optional_param
+
+        def mit_wechsel(param_name, jahr):
+            # Erster Parameter gelesen -> Wechsel im anderen Thread anstoßen
+            wert = original(param_name, jahr)
+            if wechsel.ident is None:
+                wechsel.start()
+                wechsel.join(timeout=0.2)
+            return wert
+
+        monkeypatch.setattr(tax_context, "_optional_param", mit_wechsel)
+        try:
+            ctx = get_tax_context(2030)
+        finally:
+            wechsel.join()
+        assert (ctx.sparerpauschbetrag, ctx.basiszins) == (Decimal("1100"), Decimal("0.01"))
+        monkeypatch.undo()
+        assert get_tax_context(2030).basiszins == Decimal("0.02")
+        set_parameter_layers({}, {})
@@ -1,12 +1,23 @@
 """Tests für Vorabpauschale-Berechnung."""
 
+import time
+from dataclasses import replace
 from datetime import date
 from decimal import Decimal
+from types import MappingProxyType
 
 import pytest
 
-from pptax.models.portfolio import Security, FondsTyp
-from pptax.engine.vorabpauschale import berechne_vorabpauschale
+from pptax.models.portfolio import Security, FondsTyp, Transaction, TransaktionsTyp
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.vorabpauschale import (
+    ausschuettungen_je_jahr,
+    berechne_jahresuebersicht,
+    berechne_mehrjahresuebersicht,
+    berechne_vorabpauschale,
+    berechne_vorabpauschalen,
+    vorabpauschale_pro_stueck,
+)
 
 
 def _sec(fonds_typ=FondsTyp.AKTIENFONDS):
@@ -98,3 +109,221 @@ class TestVorabpauschale:
         assert erg.teilfreistellung_satz == Decimal("0.00")
         # Volle Besteuerung
         assert erg.vorabpauschale_steuerpflichtig == erg.vorabpauschale_brutto
+
+
+class TestVorabpauschaleProStueck:
+    def test_linear_in_stueckzahl(self):
+        """VP je Stück × Stücke entspricht der Lot-Berechnung (bis auf Rundung)."""
+        for stuecke in (Decimal("1"), Decimal("37.5"), Decimal("1000")):
+            for kaufdatum in (None, date(2024, 4, 10)):
+                erg = berechne_vorabpauschale(
+                    _sec(), 2024, stuecke * Decimal("100"), stuecke * Decimal("110"),
+                    kaufdatum=kaufdatum,
+                )
+                pro_stueck = vorabpauschale_pro_stueck(
+                    2024, Decimal("100"), Decimal("110"),
+                    kaufmonat=kaufdatum.month if kaufdatum else None,
+                )
+                assert abs(stuecke * pro_stueck - erg.vorabpauschale_brutto) <= Decimal("0.01")
+
+    def test_ausschuettung_und_grenzfaelle(self):
+        # Basisertrag 100 × 2,29 % × 0,7 = 1,6030; abzgl. 0,60 Ausschüttung
+        assert vorabpauschale_pro_stueck(
+            2024, Decimal("100"), Decimal("110"), Decimal("0.60")
+        ) == Decimal("1.0030")
+        assert vorabpauschale_pro_stueck(2024, Decimal("100"), Decimal("90")) == 0
+        assert vorabpauschale_pro_stueck(2021, Decimal("100"), Decimal("110")) == 0
+        assert vorabpauschale_pro_stueck(
+            2024, Decimal("100"), Decimal("110"), Decimal("5")
+        ) == 0
+
+
+class TestBerechneVorabpauschalen:
+    def test_identisch_mit_einzelberechnung(self):
+        """Spaltenweise Regelkette rundet exakt wie die Einzelberechnung."""
+        import random
+
+        rng = random.Random(2024)
+        typen = list(FondsTyp)
+        n = 2000
+        securities = [_sec(rng.choice(typen)) for _ in range(n)]
+        jahre = [rng.choice([2018, 2020, 2021, 2022, 2023, 2024, 2025]) for _ in range(n)]
+        anfang = [Decimal(rng.randint(0, 5_000_000)) / 100 for _ in range(n)]
+        ende = [a + Decimal(rng.randint(-50_000, 150_000)) / 100 for a in anfang]
+        aussch = [Decimal(rng.choice([0, 0, rng.randint(0, 20_000)])) / 100 for _ in range(n)]
+        kaufdaten = [
+            rng.choice([None, date(j, rng.randint(1, 12), 15), date(j - 1, 6, 1)])
+            for j in jahre
+        ]
+        kontexte = {2024: get_tax_context(2024, kirchensteuer=True, bundesland="bayern")}
+
+        batch = berechne_vorabpauschalen(
+            securities, jahre, anfang, ende, aussch, kaufdaten, kontexte
+        )
+        for i, erg in enumerate(batch):
+            einzeln = berechne_vorabpauschale(
+                securities[i], jahre[i], anfang[i], ende[i], aussch[i], kaufdaten[i],
+                ctx=kontexte.get(jahre[i]),
+            )
+            assert erg == einzeln
+
+    def test_jahresuebersicht(self):
+        secs = [_sec(), _sec(FondsTyp.MISCHFONDS)]
+        secs[0].uuid, secs[1].uuid = "sec-001", "sec-002"
+        ergebnisse = berechne_jahresuebersicht(
+            secs, 2024,
+            werte_anfang={"sec-001": Decimal("10000"), "sec-002": Decimal("5000")},
+            werte_ende={"sec-001": Decimal("11000")},
+        )
+        assert [e.security_uuid for e in ergebnisse] == ["sec-001"]
+        assert ergebnisse[0] == berechne_vorabpauschale(
+            secs[0], 2024, Decimal("10000"), Decimal("11000")
+        )
+
+    def test_fehlender_basiszins(self):
+        with pytest.raises(ValueError, match="Kein Basiszins"):
+            berechne_vorabpauschalen([_sec()], [2010], [Decimal("1")], [Decimal("2")])
+
+    def test_unterschiedliche_laengen(self):
+        with pytest.raises(ValueError, match="Längen"):
+            berechne_vorabpauschalen([_sec()], [2024, 2023], [Decimal("1")], [Decimal("2")])
+
+
+def _dividende(uuid, datum, betrag):
+    return Transaction(
+        datum=datum,
+        typ=TransaktionsTyp.DIVIDENDE,
+        security_uuid=uuid,
+        stuecke=Decimal("0"),
+        kurs=Decimal("0"),
+        gesamtbetrag=Decimal(betrag),
+    )
+
+
+def _mehrjahresdaten(anzahl_securities, jahre, anzahl_transaktionen, seed=5):
+    import random
+
+    rng = random.Random(seed)
+    securities = [
+        Security(uuid=f"sec-{i}", name=f"Fonds {i}", fonds_typ=rng.choice(list(FondsTyp)))
+        for i in range(anzahl_securities)
+    ]
+    kurse_map = {
+        sec.uuid: {
+            datum: Decimal(rng.randint(5_000, 15_000)) / 100
+            for jahr in jahre
+            for datum in (f"{jahr}-01-02", f"{jahr}-12-30")
+        }
+        for sec in securities
+    }
+    transactions = []
+    for _ in range(anzahl_transaktionen):
+        sec = rng.choice(securities)
+        datum = date(rng.choice(jahre), rng.randint(1, 12), rng.randint(1, 28))
+        if rng.random() < 0.5:
+            transactions.append(_dividende(sec.uuid, datum, rng.randint(1, 300)))
+        else:
+            transactions.append(
+                Transaction(
+                    datum=datum,
+                    typ=TransaktionsTyp.KAUF,
+                    security_uuid=sec.uuid,
+                    stuecke=Decimal("1"),
+                    kurs=Decimal("100"),
+                    gesamtbetrag=Decimal("100"),
+                )
+            )
+    return securities, kurse_map, transactions
+
+
+class TestMehrjahresuebersicht:
+    def test_ausschuettungen_je_jahr(self):
+        txs = [
+            _dividende("a", date(2023, 3, 1), "10"),
+            _dividende("a", date(2023, 9, 1), "5.5"),
+            _dividende("a", date(2024, 3, 1), "7"),
+            _dividende("b", date(2023, 3, 1), "1"),
+        ]
+        assert ausschuettungen_je_jahr(txs) == {
+            "a": {2023: Decimal("15.5"), 2024: Decimal("7")},
+            "b": {2023: Decimal("1")},
+        }
+
+    def test_identisch_mit_zeilenweiser_suche(self):
+        """Aggregat liefert dieselben Zeilen wie der Scan je (Jahr, Wertpapier)."""
+        jahre = [2024, 2023, 2022]
+        securities, kurse_map, transactions = _mehrjahresdaten(12, jahre, 400)
+        ergebnisse = berechne_mehrjahresuebersicht(
+            securities, jahre, kurse_map, ausschuettungen_je_jahr(transactions)
+        )
+
+        assert len(ergebnisse) == len(jahre) * len(securities)
+        for erg in ergebnisse:
+            sec = next(s for s in securities if s.uuid == erg.security_uuid)
+            aussch = sum(
+                (
+                    tx.gesamtbetrag
+                    for tx in transactions
+                    if tx.security_uuid == sec.uuid
+                    and tx.typ == TransaktionsTyp.DIVIDENDE
+                    and tx.datum.year == erg.jahr
+                ),
+                Decimal("0"),
+            )
+            kurse = kurse_map[sec.uuid]
+            assert erg == berechne_vorabpauschale(
+                sec, erg.jahr, kurse[f"{erg.jahr}-01-02"], kurse[f"{erg.jahr}-12-30"], aussch
+            )
+
+    def test_fehlende_kurse_ohne_zeile(self):
+        sec = _sec()
+        ergebnisse = berechne_mehrjahresuebersicht(
+            [sec], [2023, 2024], {"test": {"2024-01-01": Decimal("1"), "2024-12-31": Decimal("2")}}
+        )
+        assert [e.jahr for e in ergebnisse] == [2024]
+
+    def test_ungueltige_zeile_ueberspringen(self):
+        """Fehlt die Teilfreistellung eines Fondstyps, entfällt nur dessen Zeile."""
+        ctx = get_tax_context(2024)
+        ohne_sonstige = replace(
+            ctx,
+            teilfreistellung=MappingProxyType(
+                {t: s for t, s in ctx.teilfreistellung.items() if t != FondsTyp.SONSTIGE}
+            ),
+        )
+        aktien = Security(uuid="a", name="A", fonds_typ=FondsTyp.AKTIENFONDS)
+        sonstige = Security(uuid="s", name="S", fonds_typ=FondsTyp.SONSTIGE)
+        kurse = {"2024-01-01": Decimal("100"), "2024-12-31": Decimal("110")}
+        ergebnisse = berechne_mehrjahresuebersicht(
+            [aktien, sonstige], [2024], {"a": kurse, "s": kurse}, kontexte={2024: ohne_sonstige}
+        )
+        assert [e.security_uuid for e in ergebnisse] == ["a"]
+
+    def test_jahr_ohne_basiszins_ueberspringen(self):
+        sec = _sec()
+        kurse = {
+            f"{jahr}-{md}": Decimal(k)
+            for jahr in (2024, 2099)
+            for md, k in (("01-01", "100"), ("12-31", "110"))
+        }
+        ctx = replace(get_tax_context(2099), basiszins=None)
+        ergebnisse = berechne_mehrjahresuebersicht(
+            [sec], [2099, 2024], {"test": kurse}, kontexte={2099: ctx}
+        )
+        assert [e.jahr for e in ergebnisse] == [2024]
+
+    @pytest.mark.benchmark
+    def test_benchmark_grosse_datei(self):
+        """200 Wertpapiere × 8 Jahre bei 100.000 Transaktionen bleibt schnell
+        (früher ein Transaktions-Scan je Wertpapier und Jahr)."""
+        jahre = list(range(2025, 2017, -1))
+        securities, kurse_map, transactions = _mehrjahresdaten(200, jahre, 100_000)
+
+        start = time.perf_counter()
+        ergebnisse = berechne_mehrjahresuebersicht(
+            securities, jahre, kurse_map, ausschuettungen_je_jahr(transactions)
+        )
+        dauer = time.perf_counter() - start
+
+        assert len(ergebnisse) == 200 * 8
+        assert dauer < 2.0
@@ -6,7 +6,9 @@ from decimal import Decimal
 import pytest
 
 from pptax.engine.fifo import FifoBestand
-from pptax.engine.vp_integration import apply_vorabpauschalen
+from pptax.engine import vp_integration
+from pptax.engine.tax_params import parameter_override
+from pptax.engine.vp_integration import VorabpauschalenSpeicher, apply_vorabpauschalen
 from pptax.models.portfolio import (
     Security,
     FondsTyp,
@@ -296,3 +298,177 @@ class TestApplyVorabpauschalen:
         )
 
         assert fifo.bestand()[0].vorabpauschalen_kumuliert == Decimal("0")
+
+
+class TestVorabpauschaleJeStueck:
+    def test_lots_skalieren_mit_stueckzahl(self):
+        """Eine Berechnung je Jahr/Kaufmonat, Rundung erst je Lot."""
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2022, 5, 1), Decimal("10"), Decimal("90.00"))
+        fifo.kauf(date(2023, 3, 1), Decimal("33"), Decimal("95.00"))
+        fifo.kauf(date(2023, 3, 20), Decimal("7"), Decimal("96.00"))
+        kurse_map = _make_kurse_map("sec-001", {
+            "2024-01-02": Decimal("100"),
+            "2024-12-30": Decimal("110"),
+        })
+
+        apply_vorabpauschalen(
+            positionen={"sec-001": fifo},
+            securities={"sec-001": _make_security()},
+            kurse_map=kurse_map,
+            transactions=[],
+            steuerjahr=2025,
+        )
+
+        # 2024: 100 × 2,29 % × 0,7 = 1,603 je Stück, für alle Lots voll
+        lots = fifo.bestand()
+        assert [l.vorabpauschalen_kumuliert for l in lots] == [
+            Decimal("16.03"), Decimal("52.90"), Decimal("11.22"),
+        ]
+
+
+class TestDividendenNachBestandsverlauf:
+    def test_dividenden_je_stueck_am_jahresende(self):
+        """Spätere Käufe verwässern die Ausschüttung früherer Jahre nicht."""
+        kaeufe = [
+            Transaction(
+                datum=datum, typ=TransaktionsTyp.KAUF, security_uuid="sec-001",
+                stuecke=Decimal("100"), kurs=Decimal("90"), gesamtbetrag=Decimal("9000"),
+            )
+            for datum in (date(2023, 1, 10), date(2025, 2, 1))
+        ]
+        dividende = Transaction(
+            datum=date(2024, 6, 1), typ=TransaktionsTyp.DIVIDENDE, security_uuid="sec-001",
+            stuecke=Decimal("0"), kurs=Decimal("0"), gesamtbetrag=Decimal("100"),
+        )
+        fifo = FifoBestand("sec-001")
+        for tx in kaeufe:
+            fifo.kauf(tx.datum, tx.stuecke, tx.kurs)
+
+        apply_vorabpauschalen(
+            positionen={"sec-001": fifo},
+            securities={"sec-001": _make_security()},
+            kurse_map=_make_kurse_map("sec-001", {
+                "2024-01-02": Decimal("100"),
+                "2024-12-30": Decimal("110"),
+            }),
+            transactions=kaeufe + [dividende],
+            steuerjahr=2026,
+        )
+
+        # Ende 2024: 100 Stücke → 1,00 je Stück; VP = 100 × (1,603 - 1,00)
+        assert fifo.bestand()[0].vorabpauschalen_kumuliert == Decimal("60.30")
+
+
+class TestVorabpauschalenSpeicher:
+    KURSE = {
+        f"{jahr}-{tag}": Decimal(kurs)
+        for jahr, (anfang, ende) in {
+            2020: ("80", "90"), 2023: ("95", "110"), 2024: ("110", "120"), 2025: ("120", "125"),
+        }.items()
+        for tag, kurs in (("01-02", anfang), ("12-30", ende))
+    }
+
+    def _fifo(self) -> FifoBestand:
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2020, 2, 1), Decimal("40"), Decimal("80.00"))
+        fifo.kauf(date(2023, 8, 1), Decimal("25"), Decimal("100.00"))
+        return fifo
+
+    def _vp(self, steuerjahr, speicher, kurse=None, sec=None):
+        fifo = self._fifo()
+        apply_vorabpauschalen(
+            positionen={"sec-001": fifo},
+            securities={"sec-001": sec or _make_security()},
+            kurse_map=_make_kurse_map("sec-001", kurse or self.KURSE),
+            transactions=[],
+            steuerjahr=steuerjahr,
+            speicher=speicher,
+        )
+        return [l.vorabpauschalen_kumuliert for l in fifo.bestand()]
+
+    def test_nur_neue_jahre_werden_berechnet(self, monkeypatch):
+        aufrufe = []
+        original = vp_integration.vorabpauschale_pro_stueck
+
+        def zaehle(jahr, *args, **kwargs):
+            aufrufe.append(jahr)
+            return original(jahr, *args, **kwargs)
+
+        monkeypatch.setattr(vp_integration, "vorabpauschale_pro_stueck", zaehle)
+        speicher = VorabpauschalenSpeicher()
+
+        erwartet_2025 = self._vp(2025, None)
+        erwartet_2026 = self._vp(2026, None)
+        assert self._vp(2025, speicher) == erwartet_2025
+        aufrufe.clear()
+
+        # 2026 benötigt nur das neue Jahr 2025 (beide Lots: ganzes Jahr)
+        assert self._vp(2026, speicher) == erwartet_2026
+        assert aufrufe == [2025]
+        assert self._vp(2026, speicher) == erwartet_2026
+        assert aufrufe == [2025]
+
+    def test_invalidierung_bei_kursaenderung(self):
+        speicher = VorabpauschalenSpeicher()
+        vorher = self._vp(2025, speicher)
+        kurse = dict(self.KURSE, **{"2024-12-30": Decimal("111")})
+        assert self._vp(2025, speicher, kurse=kurse) == self._vp(2025, None, kurse=kurse)
+        assert self._vp(2025, speicher, kurse=kurse) != vorher
+
+    def test_invalidierung_bei_parameteraenderung(self):
+        speicher = VorabpauschalenSpeicher()
+        vorher = self._vp(2025, speicher)
+        with parameter_override("basiszins_vorabpauschale", 2024, 0.01):
+            neu = self._vp(2025, speicher)
+            assert neu == self._vp(2025, None)
+        assert neu != vorher
+        assert self._vp(2025, speicher) == vorher
+
+    def test_invalidierung_bei_fondstyp(self):
+        speicher = VorabpauschalenSpeicher()
+        self._vp(2025, speicher)
+        assert speicher.anzahl_eintraege() > 0
+        speicher._eintraege["sec-001"] = {
+            jahr: {key: Decimal("999") for key in lots}
+            for jahr, lots in speicher._eintraege["sec-001"].items()
+        }
+        misch = Security(uuid="sec-001", name="Misch", fonds_typ=FondsTyp.MISCHFONDS)
+        assert self._vp(2025, speicher, sec=misch) == self._vp(2025, None, sec=misch)
+
+    def _zaehle_jahre(self, monkeypatch) -> list[int]:
+        """Jahre, für die eine VP je Stück neu berechnet wird."""
+        aufrufe: list[int] = []
+        original = vp_integration.vorabpauschale_pro_stueck
+
+        def zaehle(jahr, *args, **kwargs):
+            aufrufe.append(jahr)
+            return original(jahr, *args, **kwargs)
+
+        monkeypatch.setattr(vp_integration, "vorabpauschale_pro_stueck", zaehle)
+        return aufrufe
+
+    def test_andere_parameter_behalten_eintraege(self, monkeypatch):
+        """Z.B. der Abgeltungssteuersatz ändert die Lot-VP nicht."""
+        speicher = VorabpauschalenSpeicher()
+        vorher = self._vp(2025, speicher)
+        aufrufe = self._zaehle_jahre(monkeypatch)
+        with parameter_override("abgeltungssteuer_satz", 2024, 0.3):
+            assert self._vp(2025, speicher) == vorher
+        assert aufrufe == []
+
+    def test_nur_genutzte_kurse_zaehlen(self, monkeypatch):
+        """Ein neuer Kurs im Jahresverlauf verwirft keine Einträge, ein
+        neuer Jahresendkurs nur die des betroffenen Jahres."""
+        unterjaehrig = dict(self.KURSE, **{"2024-06-14": Decimal("300")})
+        jahresende = dict(unterjaehrig, **{"2024-12-30": Decimal("119")})
+        erwartet_unterjaehrig = self._vp(2025, None, kurse=unterjaehrig)
+        erwartet_jahresende = self._vp(2025, None, kurse=jahresende)
+
+        speicher = VorabpauschalenSpeicher()
+        self._vp(2025, speicher)
+        aufrufe = self._zaehle_jahre(monkeypatch)
+        assert self._vp(2025, speicher, kurse=unterjaehrig) == erwartet_unterjaehrig
+        assert aufrufe == []
+        assert self._vp(2025, speicher, kurse=jahresende) == erwartet_jahresende
+        assert set(aufrufe) == {2024}
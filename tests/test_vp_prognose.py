@@ -0,0 +1,129 @@
+"""Tests für die Hochrechnung der Vorabpauschale des laufenden Jahres."""
+
+from datetime import date
+from decimal import Decimal
+
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.tax_params import parameter_override
+from pptax.engine.vorabpauschale import berechne_mehrjahresuebersicht, berechne_vorabpauschale
+from pptax.engine.vp_prognose import VorabpauschalePrognose
+from pptax.models.portfolio import (
+    FondsTyp,
+    HistorischerKurs,
+    Security,
+    Transaction,
+    TransaktionsTyp,
+)
+
+
+def _sec(uuid="sec-001"):
+    return Security(uuid=uuid, name="Test ETF", fonds_typ=FondsTyp.AKTIENFONDS)
+
+
+def _prognose(kurse, transactions=()):
+    fifo = FifoBestand("sec-001")
+    fifo.kauf(date(2024, 3, 1), Decimal("100"), Decimal("90"))
+    fifo.kauf(date(2026, 4, 10), Decimal("60"), Decimal("105"))
+    return VorabpauschalePrognose(
+        positionen={"sec-001": fifo},
+        securities={"sec-001": _sec()},
+        kurse_map={"sec-001": kurse},
+        transactions=list(transactions),
+        jahr=2026,
+    )
+
+
+class TestVorabpauschalePrognose:
+    def test_letzter_kurs_als_jahresende(self):
+        prognose = _prognose({
+            "2026-01-02": Decimal("100"),
+            "2026-05-15": Decimal("104"),
+            "2026-06-30": Decimal("110"),
+        })
+        # Basisertrag je Stück 100 × 3,2 % × 0,7 = 2,24; Kauf im April: 9/12
+        assert prognose.lot_vorabpauschalen("sec-001") == [Decimal("224.00"), Decimal("100.80")]
+        erg = prognose.ergebnis("sec-001")
+        assert erg.jahr == 2026
+        assert erg.wert_jahresende == Decimal("110") * 160
+        assert erg.vorabpauschale_brutto == Decimal("324.80")
+        assert erg.vorabpauschale_steuerpflichtig == Decimal("227.36")
+
+    def test_ergebnis_pro_stueck_wie_mehrjahresuebersicht(self):
+        """Prognosezeilen in derselben Einheit wie die historischen Zeilen."""
+        kurse = {"2026-01-02": Decimal("100"), "2026-06-30": Decimal("110")}
+        prognose = _prognose(kurse)
+        (pro_stueck,) = prognose.ergebnisse_pro_stueck()
+        (erwartet,) = berechne_mehrjahresuebersicht(
+            [_sec()], [2026], {"sec-001": {**kurse, "2026-12-31": Decimal("110")}}
+        )
+        assert pro_stueck == erwartet
+        assert pro_stueck.wert_jahresanfang == Decimal("100")
+        assert pro_stueck.steuer < prognose.ergebnis("sec-001").steuer
+
+    def test_entspricht_einzelberechnung_ohne_unterjaehrige_kaeufe(self):
+        fifo = FifoBestand("sec-001")
+        fifo.kauf(date(2023, 3, 1), Decimal("80"), Decimal("90"))
+        dividende = Transaction(
+            datum=date(2026, 3, 1), typ=TransaktionsTyp.DIVIDENDE, security_uuid="sec-001",
+            stuecke=Decimal("0"), kurs=Decimal("0"), gesamtbetrag=Decimal("40"),
+        )
+        prognose = VorabpauschalePrognose(
+            {"sec-001": fifo}, {"sec-001": _sec()},
+            {"sec-001": {"2026-01-02": Decimal("100"), "2026-08-01": Decimal("120")}},
+            [dividende], jahr=2026,
+        )
+        einzeln = berechne_vorabpauschale(
+            _sec(), 2026, Decimal("8000"), Decimal("9600"), Decimal("40")
+        )
+        assert prognose.ergebnis("sec-001") == einzeln
+
+    def test_inkrementelle_kursaktualisierung(self):
+        prognose = _prognose({"2026-01-02": Decimal("100"), "2026-06-30": Decimal("101")})
+        vorher = prognose.ergebnis("sec-001").vorabpauschale_brutto
+
+        neu = [
+            HistorischerKurs("sec-001", date(2026, 7, 1), Decimal("100.50")),
+            HistorischerKurs("sec-001", date(2026, 7, 2), Decimal("130")),
+            HistorischerKurs("sec-001", date(2025, 12, 30), Decimal("1")),
+            HistorischerKurs("sec-unbekannt", date(2026, 7, 2), Decimal("1")),
+        ]
+        assert prognose.aktualisiere_kurse(neu) == {"sec-001"}
+        assert prognose.ergebnis("sec-001").vorabpauschale_brutto > vorher
+        assert prognose.ergebnis("sec-001").wert_jahresende == Decimal("130") * 160
+        # Ältere Kurse und Wiederholungen ändern nichts
+        assert not prognose.aktualisiere_kurs("sec-001", date(2026, 6, 1), Decimal("50"))
+        assert prognose.aktualisiere_kurse(neu) == set()
+
+    def test_kopie_unabhaengig(self):
+        prognose = _prognose({"2026-01-02": Decimal("100"), "2026-05-15": Decimal("104")})
+        vorher = prognose.ergebnis("sec-001")
+        kopie = prognose.kopie()
+        assert kopie.aktualisiere_kurs("sec-001", date(2026, 6, 30), Decimal("120"))
+        assert prognose.ergebnis("sec-001") == vorher
+        assert kopie.ergebnis("sec-001") != vorher
+        assert kopie.lot_vorabpauschalen("sec-001") != []
+
+    def test_parameteraenderung_erfordert_neuaufbau(self):
+        kurse = {"2026-01-02": Decimal("100"), "2026-06-30": Decimal("110")}
+        prognose = _prognose(kurse)
+        assert prognose.ist_aktuell()
+        assert prognose.kopie().ist_aktuell()
+        with parameter_override("basiszins_vorabpauschale", 2026, 0.01):
+            assert not prognose.ist_aktuell()
+            neu = _prognose(kurse)
+            assert neu.ist_aktuell()
+            # Neuer Basiszins: 100 × 1 % × 0,7 = 0,70 je Stück statt 2,24
+            assert neu.lot_vorabpauschalen("sec-001")[0] == Decimal("70.00")
+            assert prognose.lot_vorabpauschalen("sec-001")[0] == Decimal("224.00")
+        assert prognose.ist_aktuell() is False
+
+    def test_ohne_kurs_im_jahr_keine_prognose(self):
+        prognose = _prognose({"2025-12-31": Decimal("100")})
+        assert prognose.ergebnisse() == []
+        assert prognose.aktualisiere_kurs("sec-001", date(2026, 2, 1), Decimal("101"))
+        assert prognose.ergebnis("sec-001").wert_jahresanfang == Decimal("100") * 160
+
+    def test_kein_jahresanfangskurs(self):
+        prognose = _prognose({"2026-03-01": Decimal("100")})
+        assert prognose.ergebnisse() == []
+        assert prognose.lot_vorabpauschalen("sec-001") == []
@@ -0,0 +1,151 @@
+"""Tests für die Monte-Carlo-Simulation künftiger Steuerlasten."""
+
+import random
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from pptax.engine.fifo import FifoBestand
+from pptax.engine.tax_context import get_tax_context
+from pptax.engine.vorabpauschale import berechne_vorabpauschale
+from pptax.engine.vp_simulation import monatsrenditen, simuliere_steuerlast
+from pptax.models.portfolio import FondsTyp, Security
+
+
+def _monatskurse(start: Decimal, faktoren: list[Decimal], jahr: int = 2023):
+    """Kurse zum Monatsletzten, beginnend mit Januar des Jahres."""
+    kurse = {}
+    kurs = start
+    for i, faktor in enumerate([Decimal("1")] + faktoren):
+        j, m = jahr + i // 12, i % 12 + 1
+        kurs *= faktor
+        kurse[f"{j}-{m:02d}-28"] = kurs
+    return kurse
+
+
+def _bestand(uuid="etf", stuecke="10", kurs="100"):
+    fifo = FifoBestand(uuid)
+    fifo.kauf(date(2023, 1, 15), Decimal(stuecke), Decimal(kurs))
+    return fifo
+
+
+def _zufallsportfolio(seed=1):
+    rng = random.Random(seed)
+    securities, positionen, kurse_map = {}, {}, {}
+    for nr in range(3):
+        uuid = f"sec-{nr}"
+        securities[uuid] = Security(
+            uuid=uuid,
+            name=uuid,
+            fonds_typ=FondsTyp.AKTIENFONDS,
+            is_fond=nr != 2,
+        )
+        positionen[uuid] = _bestand(uuid, str(rng.randint(5, 50)), "100")
+        faktoren = [Decimal(rng.randint(940, 1070)) / 1000 for _ in range(35)]
+        kurse_map[uuid] = _monatskurse(Decimal("100"), faktoren)
+    return positionen, securities, kurse_map
+
+
+class TestMonatsrenditen:
+    def test_letzter_kurs_je_monat(self):
+        kurse = {
+            "2024-01-05": Decimal("90"),
+            "2024-01-31": Decimal("100"),
+            "2024-02-29": Decimal("110"),
+        }
+        assert monatsrenditen(kurse) == [Decimal("1.1")]
+
+    def test_luecke_unterbricht_reihe(self):
+        kurse = {
+            "2024-01-31": Decimal("100"),
+            "2024-03-31": Decimal("120"),
+            "2024-04-30": Decimal("132"),
+        }
+        assert monatsrenditen(kurse) == [Decimal("1.1")]
+
+
+class TestSimuliereSteuerlast:
+    def test_deterministische_rendite(self):
+        """Mit nur einer möglichen Rendite entspricht jedes Perzentil der
+        Einzelberechnung."""
+        sec = Security(uuid="etf", name="ETF", fonds_typ=FondsTyp.AKTIENFONDS)
+        kurse = _monatskurse(Decimal("100"), [Decimal("1.01")] * 12)
+        ergebnis = simuliere_steuerlast(
+            {"etf": _bestand()}, {"etf": sec}, {"etf": kurse},
+            anzahl_jahre=2, anzahl_pfade=20, seed=7,
+        )
+
+        assert ergebnis.anzahl_pfade == 20
+        assert list(ergebnis.vorabpauschale) == [2025, 2026]
+        kurs = kurse["2024-01-28"]
+        for jahr in (2025, 2026):
+            kurs_ende = kurs * Decimal("1.01") ** 12
+            erwartet = berechne_vorabpauschale(sec, jahr, kurs * 10, kurs_ende * 10)
+            assert set(ergebnis.vorabpauschale[jahr].values()) == {
+                erwartet.vorabpauschale_brutto
+            }
+            assert set(ergebnis.vp_steuer[jahr].values()) == {erwartet.steuer}
+            kurs = kurs_ende
+        assert len(set(ergebnis.liquidationssteuer.values())) == 1
+
+    def test_liquidation_rechnet_vorabpauschalen_an(self):
+        sec = Security(uuid="etf", name="ETF", fonds_typ=FondsTyp.SONSTIGE)
+        kurse = _monatskurse(Decimal("100"), [Decimal("1.01")] * 12)
+        ergebnis = simuliere_steuerlast(
+            {"etf": _bestand()}, {"etf": sec}, {"etf": kurse},
+            anzahl_jahre=1, anzahl_pfade=1, start_jahr=2025,
+        )
+        kurs_ende = kurse["2024-01-28"] * Decimal("1.01") ** 12
+        vp = ergebnis.vorabpauschale[2025][50]
+        gewinn = 10 * (kurs_ende - 100) - vp
+        steuersatz = get_tax_context(2025).steuersatz
+        assert ergebnis.liquidationssteuer[50] == (gewinn * steuersatz).quantize(
+            Decimal("0.01")
+        )
+
+    def test_reproduzierbar_mit_seed(self):
+        positionen, securities, kurse_map = _zufallsportfolio()
+        a = simuliere_steuerlast(positionen, securities, kurse_map, 3, 300, seed=42)
+        b = simuliere_steuerlast(positionen, securities, kurse_map, 3, 300, seed=42)
+        c = simuliere_steuerlast(positionen, securities, kurse_map, 3, 300, seed=43)
+
+        assert a == b
+        assert a != c
+        assert a.perzentile == (5, 50, 95)
+        assert a.liquidationssteuer[5] <= a.liquidationssteuer[50] <= a.liquidationssteuer[95]
+
+    def test_positionen_unveraendert(self):
+        positionen, securities, kurse_map = _zufallsportfolio()
+        simuliere_steuerlast(positionen, securities, kurse_map, 3, 50)
+        assert all(f.vorabpauschalen_gesamt() == 0 for f in positionen.values())
+
+    def test_basiszins_szenarien(self):
+        """Nur negative Basiszinsen -> keine Vorabpauschale."""
+        positionen, securities, kurse_map = _zufallsportfolio()
+        ergebnis = simuliere_steuerlast(
+            positionen, securities, kurse_map, 2, 100,
+            basiszins_szenarien=[Decimal("-0.0045"), Decimal("-0.0005")],
+        )
+        for werte in ergebnis.vorabpauschale.values():
+            assert set(werte.values()) == {Decimal("0")}
+
+    def test_unabhaengig_von_workern(self):
+        positionen, securities, kurse_map = _zufallsportfolio()
+        seriell = simuliere_steuerlast(positionen, securities, kurse_map, 2, 600, seed=3)
+        parallel = simuliere_steuerlast(
+            positionen, securities, kurse_map, 2, 600, seed=3, max_workers=2
+        )
+        assert seriell == parallel
+
+    def test_ohne_kurshistorie(self):
+        sec = Security(uuid="etf", name="ETF")
+        with pytest.raises(ValueError, match="Keine historischen Renditen"):
+            simuliere_steuerlast(
+                {"etf": _bestand()}, {"etf": sec},
+                {"etf": {"2024-01-31": Decimal("100")}}, 1, 10,
+            )
+
+    def test_ungueltige_anzahl(self):
+        with pytest.raises(ValueError):
+            simuliere_steuerlast({}, {}, {}, anzahl_jahre=0)